@@ -0,0 +1,85 @@
+import threading
+from abc import abstractmethod
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from deepsearcher.tools import log
+
+
+class BaseAgentSelector:
+    """
+    Chooses the RAG agent that handles a query without calling the LLM.
+
+    A selector may abstain, in which case the RAGRouter falls back to asking the LLM.
+    """
+
+    @abstractmethod
+    def select(self, query: str, agents: List, agent_descriptions: List[str]) -> Optional[int]:
+        """
+        Select the agent for a query
+        :param query:
+        :param agents: the candidate agents
+        :param agent_descriptions: the description of every agent
+        :return: the index of the selected agent, or None if the selector is not confident
+        """
+        pass
+
+
+class EmbeddingAgentSelector(BaseAgentSelector):
+    """
+    Nearest-prototype classifier over agent descriptions and labelled example queries.
+
+    Every agent is represented by the embeddings of its description and of its examples. A
+    query goes to the agent owning the most similar prototype, unless the runner-up agent is
+    within `min_margin`, in which case the selector abstains.
+    """
+
+    def __init__(self, embedding_model, examples: Optional[Dict[str, List[str]]] = None, min_margin: float = 0.03):
+        """
+        Initialize the selector
+        :param embedding_model: the embedding model
+        :param examples: example queries per agent class name, e.g. {"ChainOfRAG": ["Who ..."]}
+        :param min_margin: minimum similarity gap between the best and the second best agent
+        """
+        self.embedding_model = embedding_model
+        self.examples = examples or {}
+        self.min_margin = min_margin
+        self._lock = threading.Lock()
+        self._prototype_key = None
+        self._prototypes: Optional[np.ndarray] = None
+        self._prototype_agents: Optional[np.ndarray] = None
+
+    def _build_prototypes(self, agents: List, agent_descriptions: List[str]):
+        key = tuple(agent.__class__.__name__ for agent in agents), tuple(agent_descriptions)
+        with self._lock:
+            if key == self._prototype_key:
+                return self._prototypes, self._prototype_agents
+            texts, owners = [], []
+            for i, (agent, description) in enumerate(zip(agents, agent_descriptions)):
+                for text in [description] + list(self.examples.get(agent.__class__.__name__, [])):
+                    texts.append(text)
+                    owners.append(i)
+            vectors = np.asarray(self.embedding_model.embed_documents(texts), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            self._prototype_key = key
+            self._prototypes = vectors
+            self._prototype_agents = np.asarray(owners)
+            return self._prototypes, self._prototype_agents
+
+    def select(self, query: str, agents: List, agent_descriptions: List[str]) -> Optional[int]:
+        if len(agents) == 1:
+            return 0
+        prototypes, owners = self._build_prototypes(agents, agent_descriptions)
+        query_vector = np.asarray(self.embedding_model.embed_query(query), dtype=np.float32)
+        similarities = prototypes @ (query_vector / max(np.linalg.norm(query_vector), 1e-12))
+        agent_scores = np.full(len(agents), -np.inf)
+        np.maximum.at(agent_scores, owners, similarities)
+        ranked = np.argsort(-agent_scores)
+        margin = agent_scores[ranked[0]] - agent_scores[ranked[1]]
+        if margin < self.min_margin:
+            log.color_print(
+                f"<think> Agent similarity margin {margin:.3f} is too small, ask the LLM instead </think>\n"
+            )
+            return None
+        return int(ranked[0])
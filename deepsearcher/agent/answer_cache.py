@@ -0,0 +1,239 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from deepsearcher.tools import log
+from deepsearcher.vector_db.base import RetrievalResult
+
+
+class SemanticAnswerCache:
+    """
+    Final answers to earlier questions, looked up by embedding similarity and backed by SQLite.
+
+    A question reuses a stored answer when its embedding is at least `similarity_threshold`
+    similar to the stored question, both share the same `scope` and the answer is younger than
+    `ttl` seconds. The scope is an exact-match key chosen by the caller, for the details that
+    embeddings tend to blur, such as the fiscal period or the ticker. Every answer remembers the
+    collections its retrieved chunks came from, so that re-ingesting a collection invalidates
+    the answers built on it. Answers without any retrieved chunk are invalidated by every ingest.
+
+    The embeddings are kept in memory as one normalised matrix, so a lookup is one matrix-vector
+    product; the SQLite file only holds the payloads.
+
+    Attributes:
+        hits: Number of questions answered from the cache.
+        misses: Number of questions that ran the agents.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            similarity_threshold: float = 0.95,
+            ttl: Optional[float] = 24 * 3600,
+            max_entries: int = 10_000
+    ):
+        """
+        Open (or create) the cache.
+        :param path: path of the SQLite file
+        :param similarity_threshold: minimum cosine similarity between two questions to share an answer
+        :param ttl: seconds an answer stays valid, None to only expire answers on ingest
+        :param max_entries: maximum number of answers kept, the oldest are evicted first
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY AUTOINCREMENT, query TEXT NOT NULL, "
+            "scope TEXT NOT NULL, embedding BLOB NOT NULL, answer TEXT NOT NULL, results TEXT NOT NULL, "
+            "total_tokens INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answer_collections (answer_id INTEGER NOT NULL, collection TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_answer_collections_collection ON answer_collections (collection)"
+        )
+        self._conn.commit()
+        self._ids: List[int] = []
+        self._scopes: List[str] = []
+        self._created_at: List[float] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._load()
+
+    def _load(self):
+        if self.ttl is not None:
+            self._delete_where("created_at < ?", (time.time() - self.ttl,))
+        rows = self._conn.execute("SELECT id, scope, embedding, created_at FROM answers ORDER BY id").fetchall()
+        vectors = []
+        for answer_id, scope, embedding, created_at in rows:
+            vector = np.frombuffer(embedding, dtype=np.float32)
+            if vectors and vector.shape != vectors[0].shape:
+                # written with another embedding model, it can never match again
+                self._delete_ids([answer_id])
+                continue
+            self._ids.append(answer_id)
+            self._scopes.append(scope)
+            self._created_at.append(created_at)
+            vectors.append(vector)
+        self._vectors = np.vstack(vectors) if vectors else None
+
+    def _delete_where(self, condition: str, params: tuple):
+        ids = [row[0] for row in self._conn.execute(f"SELECT id FROM answers WHERE {condition}", params)]
+        self._delete_ids(ids)
+
+    def _delete_ids(self, ids: List[int]):
+        if not ids:
+            return
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(i,) for i in ids])
+        self._conn.executemany("DELETE FROM answer_collections WHERE answer_id = ?", [(i,) for i in ids])
+        self._conn.commit()
+        removed = set(ids)
+        keep = [position for position, answer_id in enumerate(self._ids) if answer_id not in removed]
+        if len(keep) == len(self._ids):
+            return
+        self._ids = [self._ids[position] for position in keep]
+        self._scopes = [self._scopes[position] for position in keep]
+        self._created_at = [self._created_at[position] for position in keep]
+        self._vectors = self._vectors[keep] if keep else None
+
+    @staticmethod
+    def _normalize(vector: Union[np.ndarray, List[float]]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(
+            self, query_vector: Union[np.ndarray, List[float]], scope: str = ""
+    ) -> Optional[Tuple[str, List[RetrievalResult]]]:
+        """
+        Find the answer to a similar earlier question
+        :param query_vector: the embedding of the question
+        :param scope: only answers stored with the same scope are considered
+        :return: the cached (answer, retrieved_results), or None
+        """
+        query_vector = self._normalize(query_vector)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != query_vector.shape[0]:
+                self.misses += 1
+                return None
+            similarities = self._vectors @ query_vector
+            valid = np.asarray(self._scopes, dtype=object) == scope
+            if self.ttl is not None:
+                valid &= np.asarray(self._created_at) >= time.time() - self.ttl
+            similarities[~valid] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            query, answer, results = self._conn.execute(
+                "SELECT query, answer, results FROM answers WHERE id = ?", (self._ids[best],)
+            ).fetchone()
+            self.hits += 1
+        log.color_print(
+            f"<cache> Reuse the answer to \"{query}\" (similarity {similarities[best]:.3f}) </cache>\n"
+        )
+        return answer, [RetrievalResult(embedding=None, **result) for result in json.loads(results)]
+
+    def store(
+            self,
+            query: str,
+            query_vector: Union[np.ndarray, List[float]],
+            answer: str,
+            retrieved_results: List[RetrievalResult],
+            total_tokens: int = 0,
+            scope: str = ""
+    ):
+        """
+        Store the answer to a question
+        :param query: the question, kept for logging
+        :param query_vector: the embedding of the question
+        :param answer:
+        :param retrieved_results: the results the answer was generated from
+        :param total_tokens: the tokens it cost to answer the question
+        :param scope: see `lookup`
+        """
+        query_vector = self._normalize(query_vector)
+        results = [
+            {
+                "text": result.text,
+                "reference": result.reference,
+                "metadata": result.metadata,
+                "score": float(result.score),
+                "rerank_score": result.rerank_score,
+                "collection": result.collection,
+            }
+            for result in retrieved_results
+        ]
+        collections = {result.collection for result in retrieved_results if result.collection}
+        now = time.time()
+        with self._lock:
+            if self._vectors is not None and self._vectors.shape[1] != query_vector.shape[0]:
+                # the embedding model changed, none of the stored questions can match anymore
+                self._delete_ids(list(self._ids))
+            cursor = self._conn.execute(
+                "INSERT INTO answers (query, scope, embedding, answer, results, total_tokens, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (query, scope, query_vector.tobytes(), answer, json.dumps(results, default=str), total_tokens, now),
+            )
+            answer_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO answer_collections (answer_id, collection) VALUES (?, ?)",
+                [(answer_id, collection) for collection in sorted(collections)],
+            )
+            self._conn.commit()
+            self._ids.append(answer_id)
+            self._scopes.append(scope)
+            self._created_at.append(now)
+            self._vectors = (
+                query_vector[None, :] if self._vectors is None else np.vstack([self._vectors, query_vector])
+            )
+            if len(self._ids) > self.max_entries:
+                self._delete_ids(self._ids[: len(self._ids) - self.max_entries])
+
+    def invalidate_collection(self, collection: str) -> int:
+        """
+        Drop the answers that may depend on a collection, e.g. because it is being re-ingested
+        :param collection:
+        :return: the number of answers dropped
+        """
+        with self._lock:
+            ids = [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT answer_id FROM answer_collections WHERE collection = ? "
+                    "UNION SELECT id FROM answers WHERE id NOT IN (SELECT answer_id FROM answer_collections)",
+                    (collection,),
+                )
+            ]
+            self._delete_ids(ids)
+        return len(ids)
+
+    def clear(self):
+        """
+        Drop every answer
+        """
+        with self._lock:
+            self._delete_ids(list(self._ids))
+
+    def stats(self) -> dict:
+        """
+        Return the hit/miss counters and the current size of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._ids),
+        }
@@ -1,3 +1,10 @@
+from typing import Iterable, Iterator, Optional, Union
+
+from deepsearcher.llm.base import ChatResponse
+from deepsearcher.loader.metadata_extractor import extract_query_filters
+from deepsearcher.tools import log
+
+
 def describe_class(description):
     """
     Decorator function to add a description to a class.
@@ -17,3 +24,58 @@ def describe_class(description):
         return cls
 
     return decorator
+
+
+def resolve_query_filters(query: str, filters: Optional[Union[dict, str]], auto_filter: bool) -> Optional[Union[dict, str]]:
+    """
+    Return the vector db filters to apply to the searches made for a query.
+
+    Explicit filters always win. Otherwise, if `auto_filter` is set, the single ticker and the
+    filing type mentioned in the query are used, see `extract_query_filters`. Agents search
+    again without filters when nothing matches.
+
+    Args:
+        query: The user query.
+        filters: The filters passed by the caller, if any.
+        auto_filter: Whether to extract filters from the query when none are passed.
+
+    Returns:
+        The filters, or None to search without filters.
+    """
+    if filters is None and auto_filter:
+        filters = extract_query_filters(query) or None
+        if filters:
+            log.color_print(f"<search> Filter the search with {filters} </search>\n")
+    return filters
+
+
+def stream_answer(chunks: Iterable[ChatResponse], n_token_retrieval: int = 0) -> Iterator[ChatResponse]:
+    """
+    Relay a streamed final answer to the caller of an agent's `query_stream`.
+
+    Every content delta is yielded as it arrives with 0 tokens. Once the stream ends, the full
+    answer is logged and a last response with empty content reports the total token usage,
+    retrieval included. Closing this iterator closes `chunks`, so that a caller that stops
+    reading early releases the rate limiter slot of the LLM stream at once.
+
+    Args:
+        chunks: The responses yielded by `BaseLLM.chat_stream`.
+        n_token_retrieval: The tokens already spent retrieving the context of the answer.
+
+    Yields:
+        The content deltas, then the token usage.
+    """
+    log.color_print("\n==== FINAL ANSWER====\n")
+    parts = []
+    total_tokens = n_token_retrieval
+    try:
+        for chunk in chunks:
+            total_tokens += chunk.total_tokens
+            if chunk.content:
+                parts.append(chunk.content)
+                yield ChatResponse(content=chunk.content, total_tokens=0)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    log.color_print("".join(parts))
+    yield ChatResponse(content="", total_tokens=total_tokens)
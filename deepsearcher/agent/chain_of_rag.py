@@ -1,10 +1,12 @@
-from typing import List, Tuple
-from deepsearcher.llm.base import BaseLLM
-from deepsearcher.agent.collection_router import CollectionRouter
+from typing import Iterator, List, Optional, Tuple, Union
+from deepsearcher.llm.base import BaseLLM, ChatResponse
+from deepsearcher.agent.collection_router import CollectionRouter, RoutingCache
+from deepsearcher.agent.context_packer import ContextPacker
+from deepsearcher.loader.document_store import DocumentStore, hydrate_wider_text
 from deepsearcher.vector_db.base import RetrievalResult, deduplicate_results
 from deepsearcher.tools import log
 
-from deepsearcher.agent.base import describe_class
+from deepsearcher.agent.base import describe_class, resolve_query_filters, stream_answer
 
 FOLLOWUP_QUERY_PROMPT = """You are using a search tool to answer the main query by iteratively searching the database. 
 Given the following intermediate queries and answers, generate a new simple follow-up question that can help answer the 
@@ -96,6 +98,12 @@ class ChainOfRAG:
             early_stopping: bool = False,
             route_collection: bool = True,
             text_window_splitter: bool = True,
+            document_store: DocumentStore = None,
+            search_preset: str = None,
+            search_mode: str = "dense",
+            auto_filter: bool = False,
+            collection_router: CollectionRouter = None,
+            context_packer: ContextPacker = None,
             **kwargs
     ):
         """
@@ -107,6 +115,15 @@ class ChainOfRAG:
         :param early_stopping:
         :param route_collection:
         :param text_window_splitter:
+        :param document_store: the document store holding the context windows of chunks ingested as offsets
+        :param search_preset: name of the vector db search preset used by this agent, e.g. "fast"
+        :param search_mode: "dense" for vector search only, "hybrid" to fuse vector and BM25 search
+        :param auto_filter: restrict the searches to the single ticker and the filing type
+                            mentioned in the query when the caller passes no `filters`
+        :param collection_router: the router selecting the collections searched for every query,
+                                  an LLM router over the vector db by default
+        :param context_packer: selects, merges and budgets the chunks sent to the intermediate and
+                               final answer prompts, see `ContextPacker`; no budget by default
         :param kwargs:
         """
         self.llm = llm
@@ -115,10 +132,17 @@ class ChainOfRAG:
         self.max_iter = max_iter
         self.early_stopping = early_stopping
         self.route_collection = route_collection
-        self.collection_router = CollectionRouter(
+        self.collection_router = collection_router or CollectionRouter(
             llm=self.llm, vector_db=self.vector_db, dim=embedding_model.dimension
         )
         self.text_window_splitter = text_window_splitter
+        self.document_store = document_store
+        self.search_preset = search_preset
+        if search_mode not in ("dense", "hybrid"):
+            raise ValueError(f"Unsupported search mode: {search_mode}")
+        self.search_mode = search_mode
+        self.auto_filter = auto_filter
+        self.context_packer = context_packer or ContextPacker(model=getattr(llm, "model", None))
 
     def _reflect_get_subquery(self, query: str, intermediate_context: List[str]) -> Tuple[str, int]:
         chat_response = self.llm.chat(
@@ -134,33 +158,38 @@ class ChainOfRAG:
         )
         return chat_response.content, chat_response.total_tokens
 
-    def _retrieve_and_answer(self, query: str) -> Tuple[str, List[RetrievalResult], int]:
+    def _retrieve_and_answer(
+            self,
+            query: str,
+            filters: Optional[Union[dict, str]] = None,
+            routing_cache: Optional[RoutingCache] = None
+    ) -> Tuple[str, List[RetrievalResult], int]:
         consume_tokens = 0
+        query_vector = self.embedding_model.embed_query(query)
         if self.route_collection:
             selected_collections, n_token_route = self.collection_router.invoke(
-                query=query, dim=self.embedding_model.dimension
+                query=query, dim=self.embedding_model.dimension, query_vector=query_vector,
+                routing_cache=routing_cache
             )
         else:
             selected_collections = self.collection_router.all_collections
             n_token_route = 0
 
         consume_tokens += n_token_route
-        all_retrieved_results = []
-        for collection in selected_collections:
-            log.color_print(f"<search> Search [{query}] in [{collection}]... </search>\n")
-            query_vector = self.embedding_model.embed_query(query)
-            retrieved_results = self.vector_db.search_data(
-                collection=collection,
-                vector=query_vector
-            )
-            all_retrieved_results.extend(retrieved_results)
+        all_retrieved_results = self._search_collections(selected_collections, query, query_vector, filters)
+        if filters and not all_retrieved_results:
+            # extracted filters can be wrong or too strict, an unfiltered search beats no context at all
+            log.color_print(f"<search> Nothing matched {filters}, search again without filters </search>\n")
+            all_retrieved_results = self._search_collections(selected_collections, query, query_vector, None)
         all_retrieved_results = deduplicate_results(all_retrieved_results)
+        if self.text_window_splitter:
+            hydrate_wider_text(all_retrieved_results, self.document_store)
         chat_response = self.llm.chat(
             [
                 {
                     "role": "user",
                     "content": INTERMEDIATE_ANSWER_PROMPT.format(
-                        retrieved_documents=self._format_retrieved_results(all_retrieved_results),
+                        retrieved_documents=self._format_context(all_retrieved_results, "intermediate_answer"),
                         sub_query=query,
                     )
                 }
@@ -169,9 +198,37 @@ class ChainOfRAG:
         return (
             chat_response.content,
             all_retrieved_results,
-            consume_tokens + chat_response.content,
+            consume_tokens + chat_response.total_tokens,
         )
 
+    def _search_collections(
+            self,
+            selected_collections: List[str],
+            query: str,
+            query_vector: List[float],
+            filters: Optional[Union[dict, str]]
+    ) -> List[RetrievalResult]:
+        all_retrieved_results = []
+        for collection in selected_collections:
+            log.color_print(f"<search> Search [{query}] in [{collection}]... </search>\n")
+            if self.search_mode == "hybrid":
+                retrieved_results = self.vector_db.search_hybrid(
+                    collection=collection,
+                    vectors=[query_vector],
+                    query_texts=[query],
+                    search_preset=self.search_preset,
+                    filters=filters
+                )[0]
+            else:
+                retrieved_results = self.vector_db.search_batch(
+                    collection=collection,
+                    vectors=[query_vector],
+                    search_preset=self.search_preset,
+                    filters=filters
+                )[0]
+            all_retrieved_results.extend(retrieved_results)
+        return all_retrieved_results
+
     def _get_supported_docs(
             self,
             retrieved_results: List[RetrievalResult],
@@ -229,10 +286,14 @@ class ChainOfRAG:
         and filters out supported documents. It keeps track of the intermediate contexts and token usage.
 
         :param query:
-        :param kwargs:
+        :param kwargs: `max_iter`, and `filters` to restrict every search to matching chunks, either
+                       a dict such as {"ticker": "NVDA", "fiscal_period": "2023Q4"} or a backend expression
         :return:
         """
         max_iter = kwargs.pop("max_iter", self.max_iter)
+        filters = resolve_query_filters(query, kwargs.pop("filters", None), self.auto_filter)
+        # follow-up queries of one question mostly route to the same collections, route them once per session
+        routing_cache = self.collection_router.session_cache(query)
         intermediate_contexts = []
         all_retrieved_results = []
         token_usage = 0
@@ -242,7 +303,7 @@ class ChainOfRAG:
             followup_query, n_token0 = self._reflect_get_subquery(query, intermediate_contexts)
             # for the followup query, we identify relevant content and generate potential answers
             intermediate_answer, retrieved_results, n_token1 = self._retrieve_and_answer(
-                followup_query
+                followup_query, filters, routing_cache
             )
             #for the info chunks relevant to the follow up query, the follow up query, and the answer on the
             # follow up query: get the info chunks that support the follow up query and intermediate answer
@@ -281,21 +342,8 @@ class ChainOfRAG:
         :return:
         """
         all_retrieved_results, n_token_retrieval, additional_info = self.retrieve(query, **kwargs)
-        intermediate_context = additional_info["intermediate_context"]
-        log.color_print(
-            f"<think> Summarize answer from all {len(all_retrieved_results)} retrieved chunks... </think>\n"
-        )
         chat_response = self.llm.chat(
-            [
-                {
-                    "role": "user",
-                    "content": FINAL_ANSWER_PROMPT.format(
-                        retrieved_documents=self._format_retrieved_results(all_retrieved_results),
-                        intermediate_context="\n".join(intermediate_context),
-                        query=query,
-                    )
-                }
-            ]
+            self._final_answer_messages(query, all_retrieved_results, additional_info["intermediate_context"])
         )
         log.color_print("\n==== FINAL ANSWER====\n")
         log.color_print(chat_response.content)
@@ -305,14 +353,56 @@ class ChainOfRAG:
             n_token_retrieval + chat_response.total_tokens
         )
 
+    def query_stream(self, query: str, **kwargs) -> Tuple[Iterator[ChatResponse], List[RetrievalResult]]:
+        """
+        Like `query`, but the final answer is streamed from the language model as it is generated.
+        The retrieval chain runs before this method returns.
+        :param query:
+        :param kwargs:
+        :return: the answer deltas, whose last item has empty content and reports the total token
+                 usage (see `stream_answer`), and all retrieved results
+        """
+        all_retrieved_results, n_token_retrieval, additional_info = self.retrieve(query, **kwargs)
+        messages = self._final_answer_messages(query, all_retrieved_results, additional_info["intermediate_context"])
+        return stream_answer(self.llm.chat_stream(messages), n_token_retrieval), all_retrieved_results
+
+    def _final_answer_messages(
+            self, query: str, all_retrieved_results: List[RetrievalResult], intermediate_context: List[str]
+    ) -> List[dict]:
+        log.color_print(
+            f"<think> Summarize answer from all {len(all_retrieved_results)} retrieved chunks... </think>\n"
+        )
+        return [
+            {
+                "role": "user",
+                "content": FINAL_ANSWER_PROMPT.format(
+                    retrieved_documents=self._format_context(all_retrieved_results, "final_answer"),
+                    intermediate_context="\n".join(intermediate_context),
+                    query=query,
+                )
+            }
+        ]
+
     def _format_retrieved_results(self, retrieved_results: List[RetrievalResult]) -> str:
-        formatted_documents = []
-        for i, result in enumerate(retrieved_results):
+        # every result keeps its index here, as the LLM answers with the indices of the documents
+        texts = []
+        for result in retrieved_results:
             if self.text_window_splitter and "wider_text" in result.metadata:
-                text = result.metadata["wider_text"]
+                texts.append(result.metadata["wider_text"])
             else:
-                text = result.text
-            formatted_documents.append(f"<Document {i}>\n{text}\n<\Document {i}>")
+                texts.append(result.text)
+        return self._format_documents(texts)
+
+    def _format_context(self, retrieved_results: List[RetrievalResult], prompt_type: str) -> str:
+        return self._format_documents(
+            self.context_packer.pack(retrieved_results, prompt_type, use_window=self.text_window_splitter)
+        )
+
+    @staticmethod
+    def _format_documents(texts: List[str]) -> str:
+        formatted_documents = []
+        for i, text in enumerate(texts):
+            formatted_documents.append(f"<Document {i}>\n{text}\n<\\Document {i}>")
         return "\n".join(formatted_documents)
 
 
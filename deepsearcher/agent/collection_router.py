@@ -1,6 +1,14 @@
-from typing import List, Tuple
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
 from deepsearcher.tools import log
 from deepsearcher.vector_db.base import BaseVectorDB
+from deepsearcher.vector_db.centroids import CentroidStore
 
 COLLECTION_ROUTE_PROMPT = """
 I provide you with collection_name(s) and corresponding collection_description(s). Please select the collection names 
@@ -15,31 +23,207 @@ Your selected collection name list is:
 """
 
 
+class RoutingCache:
+    """
+    Routing decisions made while answering one user query.
+
+    Sub-queries of a question almost always need the same collections, so a query whose
+    embedding is close enough to an already routed one reuses its collections instead of
+    being routed again.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.85):
+        """
+        :param similarity_threshold: minimum cosine similarity with a routed query to reuse its collections
+        """
+        self.similarity_threshold = similarity_threshold
+        self.created_at = time.monotonic()
+        self._vectors: List[np.ndarray] = []
+        self._collections: List[List[str]] = []
+        self._lock = threading.Lock()
+
+    def lookup(self, query_vector: List[float]) -> Optional[List[str]]:
+        """
+        Return the collections of the most similar routed query, or None if none is similar enough
+        :param query_vector:
+        """
+        with self._lock:
+            if not self._vectors:
+                return None
+            similarities = np.stack(self._vectors) @ _normalize(np.asarray(query_vector, dtype=np.float32)[None, :])[0]
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+            return list(self._collections[best])
+
+    def store(self, query_vector: List[float], collections: List[str]):
+        """
+        Remember the collections a query was routed to
+        :param query_vector:
+        :param collections:
+        """
+        with self._lock:
+            self._vectors.append(_normalize(np.asarray(query_vector, dtype=np.float32)[None, :])[0])
+            self._collections.append(list(collections))
+
+
 class CollectionRouter:
     """
     Route queries to appropriate collections in the vector database
     This class analyzes the content of a query and determines which collections
     in the vector database are most likely to contain relevant information.
+
+    In "llm" mode every query is routed by an LLM call. In "embedding" mode the query
+    embedding is compared with an embedding of every collection description (blended with
+    the collection centroid when a centroid store is given), and the LLM is only asked when
+    the similarities do not clearly separate the relevant collections from the others.
     """
 
-    def __init__(self, llm, vector_db: BaseVectorDB, dim: int, **kwargs):
+    def __init__(
+            self,
+            llm,
+            vector_db: BaseVectorDB,
+            dim: int,
+            embedding_model=None,
+            route_mode: str = "llm",
+            centroid_store: Optional[CentroidStore] = None,
+            centroid_weight: float = 0.5,
+            min_similarity: float = 0.3,
+            selection_margin: float = 0.05,
+            ambiguity_margin: float = 0.02,
+            max_collections: int = 3,
+            session_similarity_threshold: float = 0.85,
+            max_sessions: int = 64,
+            session_ttl: float = 600.0,
+            **kwargs
+    ):
+        """
+        Initialize the collection router
+        :param llm: the language model used in "llm" mode and as the fallback of "embedding" mode
+        :param vector_db:
+        :param dim: the embedding dimension of the collections to route to
+        :param embedding_model: the embedding model, required in "embedding" mode
+        :param route_mode: "llm" or "embedding"
+        :param centroid_store: optional ingest-time centroids of the collections
+        :param centroid_weight: weight of the centroid similarity against the description similarity
+        :param min_similarity: below this best similarity no collection is clearly relevant and the LLM decides
+        :param selection_margin: collections within this margin of the best similarity are selected too
+        :param ambiguity_margin: if the best unselected collection is within this margin of the
+                                 selected ones, the LLM decides
+        :param max_collections: maximum number of collections selected by similarity
+        :param session_similarity_threshold: similarity above which a query reuses the routing of
+                                             an earlier query of the same session, see `RoutingCache`
+        :param max_sessions: number of per-query routing sessions kept
+        :param session_ttl: seconds after which a routing session is started afresh
+        :param kwargs:
+        """
+        if route_mode not in ("llm", "embedding"):
+            raise ValueError(f"Unsupported route mode: {route_mode}")
+        if route_mode == "embedding" and embedding_model is None:
+            raise ValueError("The embedding route mode needs an embedding model")
         self.llm = llm
         self.vector_db = vector_db
+        self.dim = dim
+        self.embedding_model = embedding_model
+        self.route_mode = route_mode
+        self.centroid_store = centroid_store
+        self.centroid_weight = centroid_weight
+        self.min_similarity = min_similarity
+        self.selection_margin = selection_margin
+        self.ambiguity_margin = ambiguity_margin
+        self.max_collections = max(1, max_collections)
+        self.session_similarity_threshold = session_similarity_threshold
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self._sessions = OrderedDict()
+        self._sessions_lock = threading.Lock()
+        self._profile_key = None
+        self._profile_names: List[str] = []
+        self._profile_matrix: Optional[np.ndarray] = None
+        self._profile_lock = threading.Lock()
         self.all_collections = [
             collection_info.collection_name
             for collection_info in self.vector_db.list_collections(dim=dim)]
 
-    def invoke(self, query: str, dim: int, **kwargs) -> Tuple[List[str], int]:
+    def _profiles(self, collection_infos) -> Tuple[List[str], Optional[np.ndarray]]:
         """
-        Determine which collections are relevant for the given query.
-        :param query:
-        :param dim:
-        :param kwargs:
-        :return:
+        Return the names of the routable collections and the unit-norm matrix of their profile
+        vectors. Descriptions are embedded once; the matrix is rebuilt only when the catalog or
+        the centroids change.
         """
-        consume_tokens = 0
-        collection_infos = self.vector_db.list_collections(dim=dim)
-        vector_db_search_prompt = COLLECTION_ROUTE_PROMPT.format(
+        routable = [info for info in collection_infos if info.description]
+        key = (
+            tuple((info.collection_name, info.description) for info in routable),
+            self.centroid_store.version if self.centroid_store is not None else None,
+        )
+        with self._profile_lock:
+            if key != self._profile_key:
+                names = [info.collection_name for info in routable]
+                matrix = None
+                if routable:
+                    description_vectors = np.asarray(
+                        self.embedding_model.embed_documents(
+                            [f"{info.collection_name}: {info.description}" for info in routable]
+                        ),
+                        dtype=np.float32,
+                    )
+                    matrix = _normalize(description_vectors)
+                    if self.centroid_store is not None:
+                        for i, name in enumerate(names):
+                            centroid = self.centroid_store.get(name)
+                            if centroid is not None and centroid.shape[0] == matrix.shape[1]:
+                                matrix[i] = (1 - self.centroid_weight) * matrix[i] + \
+                                    self.centroid_weight * _normalize(centroid[None, :])[0]
+                        matrix = _normalize(matrix)
+                self._profile_key = key
+                self._profile_names = names
+                self._profile_matrix = matrix
+            return self._profile_names, self._profile_matrix
+
+    def _route_by_embedding(
+            self, query: str, query_vector: Optional[List[float]], collection_infos
+    ) -> Optional[List[str]]:
+        """
+        Select collections by similarity with the query embedding
+        :return: the selected collections, or None if the similarities are ambiguous
+        """
+        names, matrix = self._profiles(collection_infos)
+        if matrix is None:
+            return []
+        if query_vector is None:
+            query_vector = self.embedding_model.embed_query(query)
+        similarities = matrix @ _normalize(np.asarray(query_vector, dtype=np.float32)[None, :])[0]
+        order = np.argsort(-similarities)
+        best = similarities[order[0]]
+        if best < self.min_similarity:
+            return None
+        selected = [i for i in order if similarities[i] >= best - self.selection_margin][: self.max_collections]
+        rest = order[len(selected):]
+        if len(rest) > 0 and similarities[selected[-1]] - similarities[rest[0]] < self.ambiguity_margin:
+            return None
+        scores = {names[i]: round(float(similarities[i]), 3) for i in order[:len(selected) + 1]}
+        log.color_print(f"<think> Route [{query}] by similarity: {scores} </think>\n")
+        return [names[i] for i in selected]
+
+    def session_cache(self, original_query: str) -> RoutingCache:
+        """
+        Return the routing cache of the session answering `original_query`, starting one if needed.
+        Sessions are kept per original query, so that asking the same question again routes nothing.
+        :param original_query:
+        """
+        key = " ".join(original_query.lower().split())
+        with self._sessions_lock:
+            cache = self._sessions.get(key)
+            if cache is None or time.monotonic() - cache.created_at > self.session_ttl:
+                cache = RoutingCache(self.session_similarity_threshold)
+                self._sessions[key] = cache
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return cache
+
+    def _build_route_prompt(self, query: str, collection_infos) -> str:
+        return COLLECTION_ROUTE_PROMPT.format(
             question=query,
             collection_info=[
                 {
@@ -49,26 +233,155 @@ class CollectionRouter:
                 for collection_info in collection_infos
             ]
         )
-        chat_response = self.llm.chat(
-            messages=[{"role": "user", "content": vector_db_search_prompt}]
-        )
-        selected_collections = self.llm.literal_eval(chat_response.content)
-        consume_tokens += chat_response.total_tokens
 
+    def _finalize_selection(self, query: str, selected_collections: List[str], collection_infos) -> List[str]:
         for collection_info in collection_infos:
             # If collection description is not provided, use the query as the search query
             if not collection_info.description:
                 selected_collections.append(collection_info.collection_name)
             # If the default collection exist, use the query as the search query
-            if self.vector_db.defeault_collection == collection_info.collection_name:
+            if self.vector_db.default_collection == collection_info.collection_name:
                 selected_collections.append(collection_info.collection_name)
 
-            selected_collections = list(set(selected_collections))
-            log.color_print(
-                f"<think> Perform search [{query}] on the vector DB collections: {selected_collections} </think>\n"
-            )
+        selected_collections = list(set(selected_collections))
+        log.color_print(
+            f"<think> Perform search [{query}] on the vector DB collections: {selected_collections} </think>\n"
+        )
+        return selected_collections
+
+    def invoke(
+            self,
+            query: str,
+            dim: int,
+            query_vector: Optional[List[float]] = None,
+            routing_cache: Optional[RoutingCache] = None,
+            **kwargs
+    ) -> Tuple[List[str], int]:
+        """
+        Determine which collections are relevant for the given query.
+        :param query:
+        :param dim:
+        :param query_vector: the embedding of the query if already computed, used in "embedding" mode
+                             and to look up `routing_cache`
+        :param routing_cache: the routing cache of the current session, see `session_cache`
+        :param kwargs:
+        :return:
+        """
+        if routing_cache is not None and query_vector is not None:
+            cached_collections = self._lookup(query, query_vector, routing_cache)
+            if cached_collections is not None:
+                return cached_collections, 0
+            selected_collections, consume_tokens = self.invoke(query, dim, query_vector=query_vector)
+            routing_cache.store(query_vector, selected_collections)
+            return selected_collections, consume_tokens
+        consume_tokens = 0
+        collection_infos = self.vector_db.list_collections(dim=dim)
+        if self.route_mode == "embedding":
+            selected_collections = self._route_by_embedding(query, query_vector, collection_infos)
+            if selected_collections is not None:
+                return self._finalize_selection(query, selected_collections, collection_infos), consume_tokens
+        vector_db_search_prompt = self._build_route_prompt(query, collection_infos)
+        chat_response = self.llm.chat(
+            messages=[{"role": "user", "content": vector_db_search_prompt}], use_cache=True
+        )
+        selected_collections = self.llm.literal_eval(chat_response.content)
+        consume_tokens += chat_response.total_tokens
+        return self._finalize_selection(query, selected_collections, collection_infos), consume_tokens
+
+    async def ainvoke(
+            self,
+            query: str,
+            dim: int,
+            query_vector: Optional[List[float]] = None,
+            routing_cache: Optional[RoutingCache] = None,
+            **kwargs
+    ) -> Tuple[List[str], int]:
+        """
+        Asynchronous version of `invoke`, issuing the routing call through `llm.achat`.
+        :param query:
+        :param dim:
+        :param query_vector: see `invoke`
+        :param routing_cache: see `invoke`
+        :param kwargs:
+        :return:
+        """
+        if routing_cache is not None and query_vector is not None:
+            cached_collections = self._lookup(query, query_vector, routing_cache)
+            if cached_collections is not None:
+                return cached_collections, 0
+            selected_collections, consume_tokens = await self.ainvoke(query, dim, query_vector=query_vector)
+            routing_cache.store(query_vector, selected_collections)
             return selected_collections, consume_tokens
+        consume_tokens = 0
+        collection_infos = await asyncio.to_thread(self.vector_db.list_collections, dim=dim)
+        if self.route_mode == "embedding":
+            selected_collections = await asyncio.to_thread(
+                self._route_by_embedding, query, query_vector, collection_infos
+            )
+            if selected_collections is not None:
+                return self._finalize_selection(query, selected_collections, collection_infos), consume_tokens
+        vector_db_search_prompt = self._build_route_prompt(query, collection_infos)
+        chat_response = await self.llm.achat(
+            messages=[{"role": "user", "content": vector_db_search_prompt}], use_cache=True
+        )
+        selected_collections = self.llm.literal_eval(chat_response.content)
+        consume_tokens += chat_response.total_tokens
+        return self._finalize_selection(query, selected_collections, collection_infos), consume_tokens
 
 
+    async def ainvoke_batch(
+            self,
+            queries: List[str],
+            dim: int,
+            query_vectors: List[List[float]],
+            routing_cache: Optional[RoutingCache] = None
+    ) -> List[Tuple[List[str], int]]:
+        """
+        Route several queries at once. Queries that miss the routing cache are grouped around
+        leaders by similarity, and only the leaders are routed, concurrently; the other queries
+        of a group reuse their leader's collections.
+        :param queries:
+        :param dim:
+        :param query_vectors: the embedding of every query
+        :param routing_cache: the routing cache of the current session; if None, every query is routed
+        :return: the selected collections and the tokens spent, per query
+        """
+        if routing_cache is None:
+            return list(await asyncio.gather(
+                *[self.ainvoke(query, dim, query_vector=vector) for query, vector in zip(queries, query_vectors)]
+            ))
+        results: List[Optional[Tuple[List[str], int]]] = [None] * len(queries)
+        leaders, followers = [], {}
+        for i, (query, vector) in enumerate(zip(queries, query_vectors)):
+            cached_collections = self._lookup(query, vector, routing_cache)
+            if cached_collections is not None:
+                results[i] = (cached_collections, 0)
+                continue
+            unit = _normalize(np.asarray(vector, dtype=np.float32)[None, :])[0]
+            for leader, leader_unit in leaders:
+                if float(unit @ leader_unit) >= routing_cache.similarity_threshold:
+                    followers.setdefault(leader, []).append(i)
+                    break
+            else:
+                leaders.append((i, unit))
+        leader_results = await asyncio.gather(
+            *[self.ainvoke(queries[i], dim, query_vector=query_vectors[i]) for i, _ in leaders]
+        )
+        for (leader, _), (selected_collections, consume_tokens) in zip(leaders, leader_results):
+            routing_cache.store(query_vectors[leader], selected_collections)
+            results[leader] = (selected_collections, consume_tokens)
+            for i in followers.get(leader, []):
+                results[i] = (list(selected_collections), 0)
+        return results
+
+    def _lookup(self, query: str, query_vector: List[float], routing_cache: RoutingCache) -> Optional[List[str]]:
+        cached_collections = routing_cache.lookup(query_vector)
+        if cached_collections is not None:
+            log.color_print(
+                f"<think> Reuse the routing of a similar query for [{query}]: {cached_collections} </think>\n"
+            )
+        return cached_collections
 
 
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
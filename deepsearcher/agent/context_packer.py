@@ -0,0 +1,127 @@
+from typing import Dict, List, Optional
+
+from deepsearcher.llm.tokenizer import count_tokens
+from deepsearcher.tools import log
+from deepsearcher.vector_db.base import RetrievalResult
+
+
+class _Passage:
+    """
+    A piece of context selected for a prompt: one chunk, or several overlapping windows of the
+    same document merged together.
+    """
+
+    def __init__(self, text: str, tokens: int, doc_id: Optional[str] = None, start: int = 0, end: int = 0):
+        self.text = text
+        self.tokens = tokens
+        self.doc_id = doc_id
+        self.start = start
+        self.end = end
+
+    def overlaps(self, doc_id: str, start: int, end: int) -> bool:
+        return doc_id is not None and self.doc_id == doc_id and self.start <= end and start <= self.end
+
+
+class ContextPacker:
+    """
+    Assembles the retrieved chunks of a prompt within a token budget.
+
+    Chunks are taken by decreasing reranker score, in retrieval order when they have none
+    (raw vector scores are not comparable across metrics and hybrid fusion). Context windows
+    that overlap in the same document, which is common since neighbouring chunks share most
+    of their window, are merged into one passage using their `window_start`/`window_end`
+    offsets, so the shared text is only sent once. Chunks are added until the budget of the
+    prompt type is spent; a chunk that does not fit is skipped, and a smaller one may still fit.
+    """
+
+    def __init__(
+            self, budgets: Optional[Dict[str, int]] = None, model: Optional[str] = None, chunk_overhead: int = 10
+    ):
+        """
+        Initialize the packer
+        :param budgets: maximum number of context tokens per prompt type, e.g.
+                        {"summary": 12000, "reflect": 4000}; prompt types without a budget are unlimited
+        :param model: the LLM model name, to count tokens with its tokenizer
+        :param chunk_overhead: tokens charged per passage for the tags wrapping it in the prompt
+        """
+        self.budgets = budgets or {}
+        self.model = model
+        self.chunk_overhead = chunk_overhead
+
+    def _count(self, text: str) -> int:
+        return count_tokens(text, self.model) + self.chunk_overhead
+
+    @staticmethod
+    def _merge(pieces: List[tuple]) -> tuple:
+        """
+        Merge overlapping (start, end, text) windows of one document into a single one.
+        """
+        pieces = sorted(pieces, key=lambda piece: piece[0])
+        start, end, text = pieces[0]
+        for piece_start, piece_end, piece_text in pieces[1:]:
+            if piece_end > end:
+                text += piece_text[end - piece_start:]
+                end = piece_end
+        return start, end, text
+
+    def pack(self, results: List[RetrievalResult], prompt_type: str, use_window: bool = True) -> List[str]:
+        """
+        Select and merge the context of a prompt
+        :param results: the retrieved chunks
+        :param prompt_type: the key of the budget to apply, e.g. "summary"
+        :param use_window: use the `wider_text` window of the chunks when they have one
+        :return: the passage texts, most relevant first
+        """
+        budget = self.budgets.get(prompt_type)
+        order = sorted(
+            range(len(results)),
+            key=lambda i: (results[i].rerank_score is None, -(results[i].rerank_score or 0.0), i)
+        )
+        passages: List[_Passage] = []
+        used = 0
+        n_packed = 0
+        for i in order:
+            metadata = results[i].metadata or {}
+            text = metadata["wider_text"] if use_window and "wider_text" in metadata else results[i].text
+            doc_id, start, end = None, 0, 0
+            if use_window and "wider_text" in metadata and "doc_id" in metadata:
+                doc_id, start, end = metadata["doc_id"], metadata["window_start"], metadata["window_end"]
+                if end - start != len(text):
+                    doc_id = None
+            overlapping = [passage for passage in passages if passage.overlaps(doc_id, start, end)]
+            if overlapping:
+                start, end, text = self._merge([(p.start, p.end, p.text) for p in overlapping] + [(start, end, text)])
+                if text == overlapping[0].text:
+                    n_packed += 1
+                    continue
+                tokens = self._count(text)
+                freed = sum(passage.tokens for passage in overlapping)
+                if budget is not None and used - freed + tokens > budget:
+                    continue
+                # the merged passage takes the place of the most relevant window it contains
+                first = overlapping[0]
+                first.text, first.tokens, first.start, first.end = text, tokens, start, end
+                passages = [passage for passage in passages if passage is first or passage not in overlapping]
+                used += tokens - freed
+                n_packed += 1
+                continue
+            if any(passage.text == text for passage in passages):
+                n_packed += 1
+                continue
+            tokens = self._count(text)
+            if budget is not None and used + tokens > budget:
+                if passages:
+                    continue
+                # not even the most relevant chunk fits, keep as much of it as the budget allows
+                text = text[: max(0, len(text) * (budget - self.chunk_overhead) // tokens)]
+                tokens = budget
+                doc_id = None
+            passages.append(_Passage(text, tokens, doc_id, start, end))
+            used += tokens
+            n_packed += 1
+        if n_packed < len(results):
+            log.color_print(
+                f"<think> Pack {n_packed} of {len(results)} chunk(s) into {len(passages)} passage(s) "
+                f"within the {budget}-token {prompt_type} budget </think>\n"
+            )
+        return [passage.text for passage in passages]
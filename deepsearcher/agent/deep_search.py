@@ -1,11 +1,17 @@
 import asyncio
-from typing import List, Tuple
-from deepsearcher.agent.collection_router import CollectionRouter
-from deepsearcher.vector_db.base import RetrievalResult
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple, Union
+from deepsearcher.agent.collection_router import CollectionRouter, RoutingCache
+from deepsearcher.agent.context_packer import ContextPacker
+from deepsearcher.llm.base import ChatResponse
+from deepsearcher.loader.document_store import DocumentStore, hydrate_wider_text
+from deepsearcher.reranker.base import BaseReranker
+from deepsearcher.vector_db.base import RetrievalResult, DEFAULT_OUTPUT_FIELDS
 from deepsearcher.tools import log
 from deepsearcher.vector_db.base import deduplicate_results
 
-from deepsearcher.agent.base import describe_class
+from deepsearcher.agent.base import describe_class, resolve_query_filters, stream_answer
 
 SUB_QUERY_PROMPT = """To answer this question more comprehensively, please break down the original question 
 into up to four sub-questions. Return as list of str. If this is a very simple question and no decomposition 
@@ -38,6 +44,18 @@ Retrieved Chunk: {retrieved_chunk}
 Is the chunk helpful in answering the any of the questions?
 """
 
+RERANK_BATCH_PROMPT = """Based on the query questions and the retrieved chunks, determine which chunks are helpful 
+in answering any of the query questions. Each chunk is wrapped in <chunk_i> tags, where i is its index.
+
+Query Questions: {query}
+
+Retrieved Chunks:
+{retrieved_chunks}
+
+Return a python list of int with the indices of the helpful chunks, for example [0, 2]. If none of the chunks 
+is helpful, return an empty list. Do not output any other information.
+"""
+
 REFLECT_PROMPT = """Determine whether additional search queries are needed based on the original query, previous sub queries, and all retrieved document chunks. If further research is required, provide a Python list of up to 3 search queries. If no further research is required, return an empty list.
 
 If the original query is to write a report, then you prefer to generate some further queries, instead return an empty list.
@@ -79,6 +97,16 @@ class DeepSearch:
             max_iter: int = 3,
             route_collection: bool = True,
             text_window_splitter: bool = True,
+            max_concurrency: int = 4,
+            rerank_mode: str = "batch",
+            rerank_batch_size: int = 20,
+            reranker: BaseReranker = None,
+            document_store: DocumentStore = None,
+            search_preset: str = None,
+            search_mode: str = "dense",
+            auto_filter: bool = False,
+            collection_router: CollectionRouter = None,
+            context_packer: ContextPacker = None,
             **kwargs
     ):
         """
@@ -89,6 +117,25 @@ class DeepSearch:
         :param max_iter: the maximum number of iterations for the search process
         :param route_collection: whether to use a collection router for search
         :param text_window_splitter: whether to use text_window splitter
+        :param max_concurrency: the maximum number of blocking embedding and vector search calls
+                                running at the same time while the sub-queries are searched. LLM
+                                calls go through `llm.achat` and the shared rate limiter instead
+        :param rerank_mode: "batch" to judge all candidate chunks of a sub-query in one LLM call,
+                            "pointwise" to ask the LLM about every chunk separately
+        :param rerank_batch_size: the maximum number of chunks judged in one batched rerank call
+        :param reranker: optional local reranker run before the LLM rerank; only the chunks it
+                         leaves ambiguous are sent to the LLM
+        :param document_store: the document store holding the context windows of chunks ingested
+                               as offsets; windows are only read for the accepted chunks
+        :param search_preset: name of the vector db search preset used by this agent, e.g. "accurate"
+        :param search_mode: "dense" for vector search only, "hybrid" to fuse vector and BM25 search
+                            with reciprocal-rank fusion (needs a vector db with a lexical index)
+        :param auto_filter: restrict the searches to the single ticker and the filing type
+                            mentioned in the query when the caller passes no `filters`
+        :param collection_router: the router selecting the collections searched for every query,
+                                  an LLM router over the vector db by default
+        :param context_packer: selects, merges and budgets the chunks sent to the reflection and
+                               summary prompts, see `ContextPacker`; no budget by default
         :param kwargs:
         """
         self.llm = llm
@@ -96,87 +143,305 @@ class DeepSearch:
         self.vector_db = vector_db
         self.max_iter = max_iter
         self.route_collection = route_collection
-        self.collection_router = CollectionRouter(
+        self.collection_router = collection_router or CollectionRouter(
             llm=self.llm, vector_db=self.vector_db, dim=embedding_model.dimension)
         self.text_window_splitter = text_window_splitter
+        self.max_concurrency = max(1, max_concurrency)
+        if rerank_mode not in ("batch", "pointwise"):
+            raise ValueError(f"Unsupported rerank mode: {rerank_mode}")
+        self.rerank_mode = rerank_mode
+        self.rerank_batch_size = max(1, rerank_batch_size)
+        self.reranker = reranker
+        self.document_store = document_store
+        self.search_preset = search_preset
+        if search_mode not in ("dense", "hybrid"):
+            raise ValueError(f"Unsupported search mode: {search_mode}")
+        self.search_mode = search_mode
+        self.auto_filter = auto_filter
+        self.context_packer = context_packer or ContextPacker(model=getattr(llm, "model", None))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="deepsearch"
+        )
 
-    def _generate_sub_queries(self, original_query: str) -> Tuple[List[str], int]:
-        chat_response = self.llm.chat(
+    async def _run_blocking(self, func, *args, **kwargs):
+        """
+        Run a blocking call in the agent's bounded thread pool so that concurrent
+        sub-query searches do not serialise on the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        """
+        Shut down the agent's thread pool, waiting for running searches to finish.
+        The agent cannot run queries afterwards.
+        """
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def _generate_sub_queries(self, original_query: str) -> Tuple[List[str], int]:
+        chat_response = await self.llm.achat(
             messages=[
                 {"role": "user",
                  "content": SUB_QUERY_PROMPT.format(original_query=original_query)}
-            ]
+            ],
+            use_cache=True
         )
         response_content = chat_response.content
         return self.llm.literal_eval(response_content), chat_response.total_tokens
 
-    async def _search_chunks_from_vectordb(self, query: str, sub_queries: List[str]):
-        consume_tokens = 0
+    async def _rerank_chunk(self, query: str, sub_queries: List[str], retrieved_result: RetrievalResult) -> Tuple[bool, int]:
+        chat_response = await self.llm.achat(
+            messages=[
+                {
+                    "role": "user",
+                    "content": RERANK_PROMPT.format(
+                        query=[query] + sub_queries,
+                        retrieved_chunk=f"<chunk>{retrieved_result.text}</chunk>"
+                    ),
+                }
+            ],
+            use_cache=True
+        )
+        response_content = chat_response.content.strip()
+        # strip the reasoning text if exists
+        if "<think>" in response_content and "</think>" in response_content:
+            end_of_think = response_content.find("</think>") + len("</think>")
+            response_content = response_content[end_of_think:].strip()
+        accepted = "YES" in response_content and "NO" not in response_content
+        return accepted, chat_response.total_tokens
+
+    async def _rerank_batch(
+            self, query: str, sub_queries: List[str], retrieved_results: List[RetrievalResult]
+    ) -> Tuple[List[bool], int]:
+        """
+        Judge all the given chunks in a single LLM call. Falls back to one call per chunk
+        when the answer cannot be parsed as a list of chunk indices.
+        """
+        retrieved_chunks = "".join(
+            f"<chunk_{i}>\n{retrieved_result.text}\n</chunk_{i}>\n"
+            for i, retrieved_result in enumerate(retrieved_results)
+        )
+        chat_response = await self.llm.achat(
+            messages=[
+                {
+                    "role": "user",
+                    "content": RERANK_BATCH_PROMPT.format(
+                        query=[query] + sub_queries,
+                        retrieved_chunks=retrieved_chunks,
+                    ),
+                }
+            ],
+            use_cache=True
+        )
+        try:
+            selected_indices = self.llm.literal_eval(chat_response.content)
+            if not isinstance(selected_indices, (list, tuple)):
+                raise ValueError(f"Expected a list of indices, got: {selected_indices}")
+            selected_indices = {int(i) for i in selected_indices}
+            if any(i < 0 or i >= len(retrieved_results) for i in selected_indices):
+                raise ValueError(f"Chunk index out of range: {selected_indices}")
+        except (ValueError, TypeError, SyntaxError) as e:
+            log.warning(f"Failed to parse batched rerank response, falling back to per-chunk rerank: {e}")
+            accepted, consume_tokens = await self._rerank_pointwise(query, sub_queries, retrieved_results)
+            return accepted, consume_tokens + chat_response.total_tokens
+        accepted = [i in selected_indices for i in range(len(retrieved_results))]
+        return accepted, chat_response.total_tokens
+
+    async def _rerank_pointwise(
+            self, query: str, sub_queries: List[str], retrieved_results: List[RetrievalResult]
+    ) -> Tuple[List[bool], int]:
+        rerank_results = await asyncio.gather(
+            *[
+                self._rerank_chunk(query, sub_queries, retrieved_result)
+                for retrieved_result in retrieved_results
+            ]
+        )
+        accepted = [is_accepted for is_accepted, _ in rerank_results]
+        return accepted, sum(n_token for _, n_token in rerank_results)
+
+    async def _rerank(
+            self, query: str, sub_queries: List[str], retrieved_results: List[RetrievalResult]
+    ) -> Tuple[List[bool], int]:
+        if self.rerank_mode == "pointwise":
+            return await self._rerank_pointwise(query, sub_queries, retrieved_results)
+        batches = [
+            retrieved_results[i: i + self.rerank_batch_size]
+            for i in range(0, len(retrieved_results), self.rerank_batch_size)
+        ]
+        batch_results = await asyncio.gather(
+            *[self._rerank_batch(query, sub_queries, batch) for batch in batches]
+        )
+        accepted = [is_accepted for batch_accepted, _ in batch_results for is_accepted in batch_accepted]
+        return accepted, sum(n_token for _, n_token in batch_results)
+
+    async def _route_collections(
+            self, queries: List[str], query_vectors: List[List[float]], routing_cache: Optional[RoutingCache] = None
+    ) -> List[Tuple[List[str], int]]:
         if self.route_collection:
-            selected_collections, n_token_route = self.collection_router.invoke(
-                query=query, dim=self.embedding_model.dimension)
+            return await self.collection_router.ainvoke_batch(
+                queries, self.embedding_model.dimension, query_vectors, routing_cache
+            )
+        return [(self.collection_router.all_collections, 0) for _ in queries]
 
-        else:
-            selected_collections = self.collection_router.all_collections
-            n_token_route = 0
-        consume_tokens += n_token_route
+    def _search_collection(
+            self,
+            collection: str,
+            queries: List[str],
+            query_vectors: List[List[float]],
+            output_fields: Optional[List[str]] = None,
+            filters: Optional[Union[dict, str]] = None
+    ) -> List[List[RetrievalResult]]:
+        if self.search_mode == "hybrid":
+            return self.vector_db.search_hybrid(
+                collection=collection,
+                vectors=query_vectors,
+                query_texts=queries,
+                output_fields=output_fields,
+                search_preset=self.search_preset,
+                filters=filters
+            )
+        return self.vector_db.search_batch(
+            collection=collection,
+            vectors=query_vectors,
+            output_fields=output_fields,
+            search_preset=self.search_preset,
+            filters=filters
+        )
 
-        all_retrieved_results = []
-        query_vector = self.embedding_model.embed_query(query)
-        for collection in selected_collections:
-            log.color_print(f"<search> Search [{query}] in [{collection}]... </search>\n")
-            retrieved_results = self.vector_db.search_data(
-                collection=collection, vector=query_vector
+    async def _search_chunks_from_vectordb(
+            self,
+            queries: List[str],
+            query_vectors: List[List[float]],
+            filters: Optional[Union[dict, str]] = None,
+            routing_cache: Optional[RoutingCache] = None
+    ) -> Tuple[List[List[RetrievalResult]], int]:
+        """
+        Route every query, then search each selected collection once for all the queries routed to it.
+        :return: the candidate chunks of every query, and the tokens spent on routing
+        """
+        route_results = await self._route_collections(queries, query_vectors, routing_cache)
+        consume_tokens = sum(n_token_route for _, n_token_route in route_results)
+
+        collection_query_indices = {}
+        for i, (selected_collections, _) in enumerate(route_results):
+            for collection in selected_collections:
+                log.color_print(f"<search> Search [{queries[i]}] in [{collection}]... </search>\n")
+                collection_query_indices.setdefault(collection, []).append(i)
+
+        candidates = await self._search_routed_queries(queries, query_vectors, collection_query_indices, filters)
+        unmatched = [i for i, query_candidates in enumerate(candidates) if not query_candidates]
+        if filters and unmatched:
+            # extracted filters can be wrong or too strict, an unfiltered search beats no context at all
+            log.color_print(
+                f"<search> Nothing matched {filters} for {[queries[i] for i in unmatched]}, "
+                f"search again without filters </search>\n"
             )
-            if not retrieved_results or len(retrieved_results) == 0:
-                log.color_print(
-                    f"<search> No relevant document chunks found in '{collection}'! </search>\n"
-                )
-                continue
-            accepted_chunk_num = 0
-            references = set()
-            for retrieved_result in retrieved_results:
-                chat_response = self.llm.chat(
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": RERANK_PROMPT.format(
-                                query=[query] + sub_queries,
-                                retrieved_chunk=f"<chunk>{retrieved_result.text}</chunk>"
-                            ),
-                        }
-                    ]
-                )
-                consume_tokens += chat_response.total_tokens
-                response_content = chat_response.content.strip()
-                # strip the reasoning text if exists
-                if "<think>" in response_content and "</think>" in response_content:
-                    end_of_think = response_content.find("</think>") + len("</think>")
-                    response_content = response_content[end_of_think:].strip()
-                if "YES" in response_content and "NO" not in response_content:
-                    all_retrieved_results.append(retrieved_result)
-                    accepted_chunk_num += 1
-                    references.add(retrieved_result.reference)
-
-            if accepted_chunk_num > 0:
-                log.color_print(
-                    f"<search> Accept {accepted_chunk_num} document chunk(s) from references: {list(references)} </search>\n"
-                )
-            else:
-                log.color_print(
-                    f"<search> No document chunk accepted from '{collection}'! </search>\n"
+            unmatched_indices = {}
+            for collection, indices in collection_query_indices.items():
+                for i in indices:
+                    if i in unmatched:
+                        unmatched_indices.setdefault(collection, []).append(i)
+            retried = await self._search_routed_queries(queries, query_vectors, unmatched_indices, None)
+            for i in unmatched:
+                candidates[i] = retried[i]
+        return candidates, consume_tokens
+
+    async def _search_routed_queries(
+            self,
+            queries: List[str],
+            query_vectors: List[List[float]],
+            collection_query_indices: dict,
+            filters: Optional[Union[dict, str]]
+    ) -> List[List[RetrievalResult]]:
+        """
+        Search every collection once for the queries routed to it
+        :param collection_query_indices: the indices of the queries to search, per collection
+        :return: the candidate chunks of every query, empty for queries that were not searched
+        """
+        # stored embeddings are only needed by the local reranker
+        output_fields = DEFAULT_OUTPUT_FIELDS + ["embedding"] if self.reranker is not None else None
+        collections = list(collection_query_indices)
+        batch_results = await asyncio.gather(
+            *[
+                self._run_blocking(
+                    self._search_collection,
+                    collection,
+                    [queries[i] for i in collection_query_indices[collection]],
+                    [query_vectors[i] for i in collection_query_indices[collection]],
+                    output_fields,
+                    filters
                 )
+                for collection in collections
+            ]
+        )
+        candidates = [[] for _ in queries]
+        for collection, results_per_query in zip(collections, batch_results):
+            for i, retrieved_results in zip(collection_query_indices[collection], results_per_query):
+                if not retrieved_results or len(retrieved_results) == 0:
+                    log.color_print(
+                        f"<search> No relevant document chunks found in '{collection}' for [{queries[i]}]! </search>\n"
+                    )
+                    continue
+                candidates[i].extend(retrieved_results)
+        return candidates
+
+    async def _filter_chunks(
+            self,
+            query: str,
+            candidates: List[RetrievalResult],
+            sub_queries: List[str],
+            rerank_vectors: List[List[float]]
+    ) -> Tuple[List[RetrievalResult], int]:
+        """
+        Keep the candidate chunks that help answer the query, using the local reranker
+        first when configured and the LLM for the remaining ones. `rerank_vectors` are the
+        embeddings of the original question and of the sub-queries, scored by the local reranker.
+        """
+        if not candidates:
+            return [], 0
+        consume_tokens = 0
+        all_retrieved_results = []
+        if self.reranker is not None:
+            n_candidates = len(candidates)
+            all_retrieved_results, candidates = self.reranker.rerank(rerank_vectors, candidates)
+            log.color_print(
+                f"<search> Pre-filter kept {len(all_retrieved_results)} and left {len(candidates)} ambiguous "
+                f"out of {n_candidates} chunk(s) for [{query}] </search>\n"
+            )
+        if candidates:
+            accepted, n_token_rerank = await self._rerank(query, sub_queries, candidates)
+            consume_tokens += n_token_rerank
+            all_retrieved_results.extend(
+                retrieved_result for retrieved_result, is_accepted in zip(candidates, accepted) if is_accepted
+            )
+        references = {retrieved_result.reference for retrieved_result in all_retrieved_results}
+        if all_retrieved_results:
+            log.color_print(
+                f"<search> Accept {len(all_retrieved_results)} document chunk(s) from references: {list(references)} </search>\n"
+            )
+        else:
+            log.color_print(
+                f"<search> No document chunk accepted for [{query}]! </search>\n"
+            )
         return all_retrieved_results, consume_tokens
 
-    def _generate_gap_queries(
+    async def _generate_gap_queries(
             self, original_query: str, all_sub_queries: List[str], all_chunks: List[RetrievalResult]
     ) -> Tuple[List[str], int]:
         reflect_prompt = REFLECT_PROMPT.format(
             question=original_query,
             mini_questions=all_sub_queries,
-            mini_chunk_str=self._format_chunk_texts([chunk.text for chunk in all_chunks])
+            mini_chunk_str=self._format_chunk_texts(
+                self.context_packer.pack(all_chunks, "reflect", use_window=False)
+            )
         )
-        chat_response = self.llm.chat([{"role": "user", "content": reflect_prompt}])
+        chat_response = await self.llm.achat([{"role": "user", "content": reflect_prompt}])
         response_content = chat_response.content
         return self.llm.literal_eval(response_content), chat_response.total_tokens
 
@@ -185,19 +450,23 @@ class DeepSearch:
         Retrieve relevant documents from the knowledge base for the given query.
         It performs a search thorugh the vector DB to find the most relevant docs for answering the query
         :param original_query:
-        :param kwargs:
+        :param kwargs: `max_iter`, and `filters` to restrict every search to matching chunks, either
+                       a dict such as {"ticker": "NVDA", "fiscal_period": "2023Q4"} or a backend expression
         :return:
         """
         return asyncio.run(self.async_retrieve(original_query, **kwargs))
 
     async def async_retrieve(self, original_query: str, **kwargs) -> Tuple[List[RetrievalResult], int, dict]:
         max_iter = kwargs.pop("max_iter", self.max_iter)
+        filters = resolve_query_filters(original_query, kwargs.pop("filters", None), self.auto_filter)
+        # sub-queries of one question mostly route to the same collections, route them once per session
+        routing_cache = self.collection_router.session_cache(original_query)
         ### SUB QUERIES ###
         log.color_print(f"<query> {original_query} </query>\n")
         all_search_res = []
         all_sub_queries = []
         total_tokens = 0
-        sub_queries, used_tokens = self._generate_sub_queries(original_query)
+        sub_queries, used_tokens = await self._generate_sub_queries(original_query)
         total_tokens += used_tokens
         if not sub_queries:
             log.color_print("No sub queries were generated by LLM. Exiting.")
@@ -208,19 +477,32 @@ class DeepSearch:
             )
         all_sub_queries.extend(sub_queries)
         sub_gap_queries = sub_queries
+        original_query_vector = None
+        if self.reranker is not None:
+            original_query_vector = await self._run_blocking(self.embedding_model.embed_query, original_query)
 
         for iter in range(max_iter):
             log.color_print(f">> Iteration: {iter + 1}\n")
             search_res_from_vectordb = []
             search_res_from_internet = []
 
-            # Create all search tasks
-            search_tasks = [
-                self._search_chunks_from_vectordb(query, sub_gap_queries)
-                for query in sub_gap_queries
-            ]
-            # Execute all tasks in parallel and wait for results
-            search_results = await asyncio.gather(*search_tasks)
+            # Embed all the queries of this iteration in one request
+            sub_query_vectors = await self._run_blocking(self.embedding_model.embed_documents, sub_gap_queries)
+            # One batched search per collection for all the queries of this iteration
+            candidates, consumed_token = await self._search_chunks_from_vectordb(
+                sub_gap_queries, sub_query_vectors, filters, routing_cache
+            )
+            total_tokens += consumed_token
+            rerank_vectors = sub_query_vectors
+            if original_query_vector is not None:
+                rerank_vectors = [original_query_vector] + list(sub_query_vectors)
+            # Rerank the candidates of every query concurrently
+            search_results = await asyncio.gather(
+                *[
+                    self._filter_chunks(query, query_candidates, sub_gap_queries, rerank_vectors)
+                    for query, query_candidates in zip(sub_gap_queries, candidates)
+                ]
+            )
             # Merge all results
             for result in search_results:
                 search_res, consumed_token = result
@@ -234,7 +516,7 @@ class DeepSearch:
                 log.color_print("<think> Exceeded maximum iterations. Exiting. </think>\n")
                 break
             log.color_print("<think> Reflecting on the search results... </think>\n")
-            sub_gap_queries, consumed_token = self._generate_gap_queries(
+            sub_gap_queries, consumed_token = await self._generate_gap_queries(
                 original_query, all_sub_queries, all_search_res
             )
 
@@ -249,10 +531,12 @@ class DeepSearch:
                 all_sub_queries.extend(sub_gap_queries)
 
         all_search_res = deduplicate_results(all_search_res)
+        if self.text_window_splitter:
+            hydrate_wider_text(all_search_res, self.document_store)
         additional_info = {"all_sub_queries": all_sub_queries}
         return all_search_res, total_tokens, additional_info
 
-    def query(self, query: str, **kwargs) -> Tuple[str, List[RetrievalResult]]:
+    def query(self, query: str, **kwargs) -> Tuple[str, List[RetrievalResult], int]:
 
         """
         Query the agent and generate an answer based on retrieved documents.  The method retrieve
@@ -267,24 +551,9 @@ class DeepSearch:
         all_retrieved_results, n_token_retrieval, additional_info = self.retrieve(query, **kwargs)
         if not all_retrieved_results or len(all_retrieved_results) == 0:
             return f"No relevant information found for query '{query}'.", [], n_token_retrieval
-        all_sub_queries = additional_info["all_sub_queries"]
-        chunk_texts = []
-        for chunk in all_retrieved_results:
-            if self.text_window_splitter and "wider_text" in chunk.metadata:
-                chunk_texts.append(chunk.metadata["wider_text"])
-            else:
-                chunk_texts.append(chunk.text)
-
-        log.color_print(
-            f"<think> Summarize answer from all {len(all_retrieved_results)} retrieved chunks... </think>\n"
-        )
-        summary_prompt = SUMMARY_PROMPT.format(
-            question=query,
-            mini_questions=all_sub_queries,
-            mini_chunk_str=self._format_chunk_texts(chunk_texts),
+        chat_response = self.llm.chat(
+            self._summary_messages(query, all_retrieved_results, additional_info["all_sub_queries"])
         )
-
-        chat_response = self.llm.chat([{"role": "user", "content": summary_prompt}])
         log.color_print("\n==== FINAL ANSWER====\n")
         log.color_print(chat_response.content)
         return (
@@ -293,7 +562,41 @@ class DeepSearch:
             n_token_retrieval + chat_response.total_tokens
         )
 
-    def _format_chnk_texts(self, chunk_texts: List[str]) -> str:
+    def query_stream(self, query: str, **kwargs) -> Tuple[Iterator[ChatResponse], List[RetrievalResult]]:
+        """
+        Like `query`, but the answer is streamed from the language model as it is generated.
+        Retrieval runs before this method returns; the summary is only requested when the
+        stream is consumed.
+        :param query:
+        :param kwargs:
+        :return: A tuple containing:
+            - An iterator of answer deltas, whose last item has empty content and reports the
+              total token usage, see `stream_answer`
+            - A list of retrieved document results
+        """
+        all_retrieved_results, n_token_retrieval, additional_info = self.retrieve(query, **kwargs)
+        if not all_retrieved_results or len(all_retrieved_results) == 0:
+            no_result = f"No relevant information found for query '{query}'."
+            return stream_answer([ChatResponse(content=no_result, total_tokens=0)], n_token_retrieval), []
+        messages = self._summary_messages(query, all_retrieved_results, additional_info["all_sub_queries"])
+        return stream_answer(self.llm.chat_stream(messages), n_token_retrieval), all_retrieved_results
+
+    def _summary_messages(
+            self, query: str, all_retrieved_results: List[RetrievalResult], all_sub_queries: List[str]
+    ) -> List[dict]:
+        log.color_print(
+            f"<think> Summarize answer from all {len(all_retrieved_results)} retrieved chunks... </think>\n"
+        )
+        summary_prompt = SUMMARY_PROMPT.format(
+            question=query,
+            mini_questions=all_sub_queries,
+            mini_chunk_str=self._format_chunk_texts(
+                self.context_packer.pack(all_retrieved_results, "summary", use_window=self.text_window_splitter)
+            ),
+        )
+        return [{"role": "user", "content": summary_prompt}]
+
+    def _format_chunk_texts(self, chunk_texts: List[str]) -> str:
         chunk_str = ""
         for i, chunk in enumerate(chunk_texts):
             chunk_str += f"""<chunk_{i}>\n{chunk}\n</chunk_{i}>\n"""
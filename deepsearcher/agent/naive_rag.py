@@ -1,10 +1,14 @@
-from typing import List, Tuple
-from deepsearcher.llm.base import BaseLLM
+from typing import Iterator, List, Optional, Tuple, Union
+from deepsearcher.llm.base import BaseLLM, ChatResponse
 from deepsearcher.embedding.base import BaseEmbedding
 from deepsearcher.vector_db.base import BaseVectorDB
+from deepsearcher.agent.base import resolve_query_filters, stream_answer
 from deepsearcher.agent.collection_router import CollectionRouter
+from deepsearcher.agent.context_packer import ContextPacker
+from deepsearcher.loader.document_store import DocumentStore, hydrate_wider_text
 from deepsearcher.vector_db.base import RetrievalResult
 from deepsearcher.vector_db.base import deduplicate_results
+from deepsearcher.tools import log
 
 SUMMARY_PROMPT = """You are a AI content analysis expert, good at summarizing content. Please summarize a specific and 
 detailed answer or report based on the previous queries and the retrieved document chunks.
@@ -28,6 +32,12 @@ class NaiveRAG:
             top_k: int = 10,
             route_collection: bool = True,
             text_window_splitter: bool = True,
+            document_store: DocumentStore = None,
+            search_preset: str = None,
+            search_mode: str = "dense",
+            auto_filter: bool = False,
+            collection_router: CollectionRouter = None,
+            context_packer: ContextPacker = None,
             **kwargs
     ):
         """
@@ -38,6 +48,15 @@ class NaiveRAG:
         :param top_k:
         :param route_collection:
         :param text_window_splitter:
+        :param document_store: the document store holding the context windows of chunks ingested as offsets
+        :param search_preset: name of the vector db search preset used by this agent, e.g. "fast"
+        :param search_mode: "dense" for vector search only, "hybrid" to fuse vector and BM25 search
+        :param auto_filter: restrict the searches to the single ticker and the filing type
+                            mentioned in the query when the caller passes no `filters`
+        :param collection_router: the router selecting the collections searched for every query,
+                                  an LLM router over the vector db by default
+        :param context_packer: selects, merges and budgets the chunks sent to the summary prompt,
+                               see `ContextPacker`; no budget by default
         :param kwargs:
         """
         self.llm = llm
@@ -45,41 +64,79 @@ class NaiveRAG:
         self.vector_db = vector_db
         self.top_k = top_k
         self.route_collection = route_collection
-        if self.route_collection:
-            self.collection_router = CollectionRouter(
-                llm=self.llm,
-                vector_db=self.vector_db,
-                dim=embedding_model.dimension
-            )
+        self.collection_router = collection_router or CollectionRouter(
+            llm=self.llm,
+            vector_db=self.vector_db,
+            dim=embedding_model.dimension
+        )
         self.text_window_splitter = text_window_splitter
+        self.document_store = document_store
+        self.search_preset = search_preset
+        if search_mode not in ("dense", "hybrid"):
+            raise ValueError(f"Unsupported search mode: {search_mode}")
+        self.search_mode = search_mode
+        self.auto_filter = auto_filter
+        self.context_packer = context_packer or ContextPacker(model=getattr(llm, "model", None))
 
     def retrieve(self, query: str, **kwargs) -> Tuple[List[RetrievalResult], int, dict]:
         """
         Retrieve relevant docs from the knowledge base for the given query.
         :param query:
-        :param kwargs:
+        :param kwargs: `filters` to restrict the search to matching chunks, either a dict such as
+                       {"ticker": "NVDA", "fiscal_period": "2023Q4"} or a backend expression
         :return:
         """
+        filters = resolve_query_filters(query, kwargs.pop("filters", None), self.auto_filter)
         consume_tokens = 0
+        query_vector = self.embedding_model.embed_query(query)
         if self.route_collection:
-            selected_collections, n_token_route = self.route_collection.invoke(
-                query=query, dim=self.embedding_model.dimension
+            selected_collections, n_token_route = self.collection_router.invoke(
+                query=query, dim=self.embedding_model.dimension, query_vector=query_vector
             )
         else:
             selected_collections = self.collection_router.all_collections
             n_token_route = 0
         consume_tokens += n_token_route
-        all_retrieved_results = []
-        for collection in selected_collections:
-            retrieval_res = self.vector_db.search_data(
-                collection=collection,
-                vector=self.embedding_model.embed_query(query),
-                top_k=max(self.top_k // len(selected_collections), 1)
-            )
-            all_retrieved_results.extend(retrieval_res)
+        all_retrieved_results = self._search_collections(selected_collections, query, query_vector, filters)
+        if filters and not all_retrieved_results:
+            # extracted filters can be wrong or too strict, an unfiltered search beats no context at all
+            log.color_print(f"<search> Nothing matched {filters}, search again without filters </search>\n")
+            all_retrieved_results = self._search_collections(selected_collections, query, query_vector, None)
         all_retrieved_results = deduplicate_results(all_retrieved_results)
+        if self.text_window_splitter:
+            hydrate_wider_text(all_retrieved_results, self.document_store)
         return all_retrieved_results, consume_tokens, {}
 
+    def _search_collections(
+            self,
+            selected_collections: List[str],
+            query: str,
+            query_vector: List[float],
+            filters: Optional[Union[dict, str]]
+    ) -> List[RetrievalResult]:
+        retrieved_results = []
+        for collection in selected_collections:
+            top_k = max(self.top_k // len(selected_collections), 1)
+            if self.search_mode == "hybrid":
+                retrieval_res = self.vector_db.search_hybrid(
+                    collection=collection,
+                    vectors=[query_vector],
+                    query_texts=[query],
+                    top_k=top_k,
+                    search_preset=self.search_preset,
+                    filters=filters
+                )[0]
+            else:
+                retrieval_res = self.vector_db.search_batch(
+                    collection=collection,
+                    vectors=[query_vector],
+                    top_k=top_k,
+                    search_preset=self.search_preset,
+                    filters=filters
+                )[0]
+            retrieved_results.extend(retrieval_res)
+        return retrieved_results
+
     def query(self, query: str, **kwargs) -> Tuple[str, List[RetrievalResult], int]:
         """
         Query the agent and generate an answer based on retrieved documents.
@@ -87,23 +144,35 @@ class NaiveRAG:
         :param kwargs:
         :return:
         """
-        all_retrieved_results, n_token_retrieval, _ = self.retrieve(query)
-        chunk_texts = []
-        for chunk in all_retrieved_results:
-            if self.text_window_splitter and "wider_text" in chunk.metadata:
-                chunk_texts.append(chunk.metadata["wider_text"])
-            else:
-                chunk_texts.append(chunk.text)
+        all_retrieved_results, n_token_retrieval, _ = self.retrieve(query, **kwargs)
+        chat_response = self.llm.chat(self._summary_messages(query, all_retrieved_results))
+        final_answer = chat_response.content
+        log.color_print("\n==== FINAL ANSWER====\n")
+        log.color_print(final_answer)
+        return final_answer, all_retrieved_results, n_token_retrieval + chat_response.total_tokens
+
+    def query_stream(self, query: str, **kwargs) -> Tuple[Iterator[ChatResponse], List[RetrievalResult]]:
+        """
+        Like `query`, but the answer is streamed from the language model as it is generated.
+        :param query:
+        :param kwargs:
+        :return: the answer deltas, whose last item has empty content and reports the total token
+                 usage (see `stream_answer`), and the retrieved results
+        """
+        all_retrieved_results, n_token_retrieval, _ = self.retrieve(query, **kwargs)
+        messages = self._summary_messages(query, all_retrieved_results)
+        return stream_answer(self.llm.chat_stream(messages), n_token_retrieval), all_retrieved_results
+
+    def _summary_messages(self, query: str, all_retrieved_results: List[RetrievalResult]) -> List[dict]:
+        chunk_texts = self.context_packer.pack(
+            all_retrieved_results, "summary", use_window=self.text_window_splitter
+        )
         mini_chunk_str = ""
         for i, chunk in enumerate(chunk_texts):
             mini_chunk_str += f"""<chunk_{i}>\n{chunk}\n</chunk_{i}>\n"""
 
         summary_prompt = SUMMARY_PROMPT.format(query=query, mini_chunk_str=mini_chunk_str)
-        chat_response = self.llm.chat([{"role": "user", "content": summary_prompt}])
-        final_answer = chat_response.content
-        log.color_print("\n==== FINAL ANSWER====\n")
-        log.color_print(final_answer)
-        return final_answer, all_retrieved_results, n_token_retrieval + chat_response.total_tokens
+        return [{"role": "user", "content": summary_prompt}]
 
 
 
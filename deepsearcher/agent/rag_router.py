@@ -1,4 +1,9 @@
-from typing import List, Optional, Tuple
+import re
+import threading
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+from deepsearcher.agent.agent_selector import BaseAgentSelector
+from deepsearcher.llm.base import ChatResponse
 from deepsearcher.tools import log
 from deepsearcher.vector_db.base import RetrievalResult
 RAG_ROUTER_PROMPT = """Given a list of agent indexes and corresponding descriptions, each agent has a specific function. 
@@ -20,17 +25,25 @@ class RAGRouter:
             self,
             llm,
             rag_agents,
-            agent_descriptions: Optional[List[str]] = None):
+            agent_descriptions: Optional[List[str]] = None,
+            selector: Optional[BaseAgentSelector] = None,
+            memo_size: int = 1024):
 
         """
         Initializes the RAGRouter
         :param llm:
         :param rag_agents:
         :param agent_descriptions:
+        :param selector: optional selector tried before the LLM; the LLM is only asked when it abstains
+        :param memo_size: number of routing decisions remembered per normalised query, 0 to disable
         """
         self.llm = llm
         self.rag_agents = rag_agents
         self.agent_descriptions = agent_descriptions
+        self.selector = selector
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
         if not agent_descriptions:
             try:
                 self.agent_descriptions = [
@@ -41,24 +54,55 @@ class RAGRouter:
                     "Please provide agent descriptions or set __description__ attribute for each agent class."
                 )
 
+    def close(self):
+        """
+        Release the resources held by the agents, such as the thread pool of DeepSearch
+        """
+        for agent in self.rag_agents:
+            close = getattr(agent, "close", None)
+            if callable(close):
+                close()
 
-    def _route(self, query: str):
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        return re.sub(r"\s+", " ", query.strip().lower()).rstrip("?!. ")
+
+    def _route_with_llm(self, query: str) -> Tuple[int, int]:
         description_str = "\n".join(
             [f"[{i + 1}]: {description}" for i, description in enumerate(self.agent_descriptions)]
         )
         prompt = RAG_ROUTER_PROMPT.format(query=query, description_str = description_str)
-        chat_response = self.llm.chat(messages=[{"role": "user", "content": prompt}])
+        chat_response = self.llm.chat(messages=[{"role": "user", "content": prompt}], use_cache=True)
         try:
             selected_agent_index = int(chat_response.content) - 1
         except ValueError:
             print("Parse int failed in RAGRouter, but will try to find the last digit as fallback.")
             selected_agent_index = int(self.find_last_digit(chat_response.content)) - 1
+        return selected_agent_index, chat_response.total_tokens
+
+    def _route(self, query: str):
+        memo_key = self._normalize_query(query)
+        with self._memo_lock:
+            selected_agent_index = self._memo.get(memo_key)
+            if selected_agent_index is not None:
+                self._memo.move_to_end(memo_key)
+        n_tokens = 0
+        if selected_agent_index is None and self.selector is not None:
+            selected_agent_index = self.selector.select(query, self.rag_agents, self.agent_descriptions)
+        if selected_agent_index is None:
+            selected_agent_index, n_tokens = self._route_with_llm(query)
+        if self.memo_size > 0:
+            with self._memo_lock:
+                self._memo[memo_key] = selected_agent_index
+                self._memo.move_to_end(memo_key)
+                while len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
 
         selected_agent = self.rag_agents[selected_agent_index]
         log.color_print(
             f"<think> Select agent [{selected_agent.__class__.__name__}] to answer the query [{query}] </think>\n"
         )
-        return self.rag_agents[selected_agent_index], chat_response.total_tokens
+        return self.rag_agents[selected_agent_index], n_tokens
 
     def retrieve(self, query: str, **kwargs) -> Tuple[List[RetrievalResult], int, dict]:
 
@@ -72,6 +116,25 @@ class RAGRouter:
         answer, retrieved_results, n_token_retrieval = agent.query(query, **kwargs)
         return answer, retrieved_results, n_token_router + n_token_retrieval
 
+    def query_stream(self, query: str, **kwargs) -> Tuple[Iterator[ChatResponse], List[RetrievalResult]]:
+        """
+        Route the query and stream the answer of the selected agent, see e.g. `DeepSearch.query_stream`.
+        The tokens spent on routing are added to the usage reported by the last item of the stream.
+        :param query:
+        :param kwargs:
+        :return:
+        """
+        agent, n_token_router = self._route(query)
+        answer_stream, retrieved_results = agent.query_stream(query, **kwargs)
+
+        def with_router_tokens() -> Iterator[ChatResponse]:
+            for chunk in answer_stream:
+                if not chunk.content:
+                    chunk = ChatResponse(content="", total_tokens=chunk.total_tokens + n_token_router)
+                yield chunk
+
+        return with_router_tokens(), retrieved_results
+
 
     def find_last_digit(self, string):
         for char in reversed(string):
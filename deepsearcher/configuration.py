@@ -8,13 +8,23 @@ from deepsearcher.embedding.base import BaseEmbedding
 from deepsearcher.agent.rag_router import RAGRouter
 from deepsearcher.agent.naive_rag import NaiveRAG
 from deepsearcher.loader.base import BaseLoader
+from deepsearcher.loader.document_store import DocumentStore
+from deepsearcher.reranker.base import BaseReranker
 
 from deepsearcher.llm.openai_llm import OpenAISearch
+from deepsearcher.llm.rate_limiter import configure_rate_limiter
 from deepsearcher.embedding.openai_embedding import OpenAIEmbedding
 from deepsearcher.loader.pdf_loader import PDFLoader
 from deepsearcher.vector_db.milvus import Milvus
+from deepsearcher.vector_db.numpy_db import NumpyVectorDB
+from deepsearcher.vector_db.centroids import CentroidStore
+from deepsearcher.reranker.embedding_reranker import EmbeddingSimilarityReranker
 from deepsearcher.agent.deep_search import DeepSearch
 from deepsearcher.agent.chain_of_rag import ChainOfRAG
+from deepsearcher.agent.collection_router import CollectionRouter
+from deepsearcher.agent.agent_selector import EmbeddingAgentSelector
+from deepsearcher.agent.answer_cache import SemanticAnswerCache
+from deepsearcher.agent.context_packer import ContextPacker
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_CONFIG_YAML_PATH = os.path.join(current_dir, "..", "config.yaml")
@@ -27,6 +37,7 @@ class Configuration:
         self.provide_settings = config_data["provide_settings"]
         self.query_settings = config_data["query_settings"]
         self.load_settings = config_data["load_settings"]
+        self.rate_limit_settings = config_data.get("rate_limit_settings", {})
 
     def load_config_data_from_yaml(self, config_path: str):
 
@@ -48,25 +59,71 @@ print(config.provide_settings)
 llm: BaseLLM = None
 embedding_model: BaseEmbedding = None
 file_loader: BaseLoader = None
+document_store: DocumentStore = None
+centroid_store: CentroidStore = None
 vector_db: BaseVectorDB = None
+reranker: BaseReranker = None
 default_searcher: RAGRouter = None
 naive_rag: NaiveRAG = None
+answer_cache: SemanticAnswerCache = None
 
 
 def init_config(config: Configuration):
 
-    global llm, embedding_model, file_loader, vector_db, default_searcher, naive_rag
+    global llm, embedding_model, file_loader, document_store, centroid_store, vector_db, reranker, default_searcher, \
+        naive_rag, answer_cache
     llm_config = config.provide_settings["llm"]["config"]
     embedding_config = config.provide_settings["embedding"]["config"]
     vector_db_config = config.provide_settings["vector_db"]["config"]
     print(llm_config)
 
+    if default_searcher is not None:
+        # re-initialising replaces the agents, release the threads of the previous ones
+        default_searcher.close()
+
+    search_mode = config.query_settings.get("search_mode", "dense")
+    auto_filter = config.query_settings.get("auto_filter", False)
+
+    configure_rate_limiter(**config.rate_limit_settings)
     llm = OpenAISearch(**llm_config)
     embedding_model = OpenAIEmbedding(**embedding_config)
-    file_loader = PDFLoader()
-    vector_db = Milvus(**vector_db_config)
+    file_loader = PDFLoader(**config.provide_settings["file_loader"]["config"])
+    document_store_path = config.load_settings.get("document_store_path")
+    if document_store_path:
+        document_store = DocumentStore(document_store_path)
+    if config.provide_settings["vector_db"]["provider"] == "NumpyVectorDB":
+        vector_db = NumpyVectorDB(**vector_db_config)
+    else:
+        vector_db = Milvus(**vector_db_config)
+    centroid_path = config.load_settings.get("centroid_path")
+    if centroid_path:
+        centroid_store = CentroidStore(centroid_path)
+    answer_cache_config = dict(config.query_settings.get("answer_cache") or {})
+    if answer_cache_config.get("path"):
+        answer_cache = SemanticAnswerCache(**answer_cache_config)
+    if "reranker" in config.provide_settings:
+        reranker = EmbeddingSimilarityReranker(**config.provide_settings["reranker"]["config"])
+    collection_router = CollectionRouter(
+        llm=llm,
+        vector_db=vector_db,
+        dim=embedding_model.dimension,
+        embedding_model=embedding_model,
+        centroid_store=centroid_store,
+        **config.query_settings.get("collection_routing", {})
+    )
+    context_packer = ContextPacker(budgets=config.query_settings.get("context_budgets"), model=llm.model)
+    agent_routing = config.query_settings.get("agent_routing", {})
+    agent_selector = None
+    if agent_routing.get("selector", "llm") == "embedding":
+        agent_selector = EmbeddingAgentSelector(
+            embedding_model=embedding_model,
+            examples=agent_routing.get("examples"),
+            min_margin=agent_routing.get("min_margin", 0.03)
+        )
     default_searcher = RAGRouter(
         llm=llm,
+        selector=agent_selector,
+        memo_size=agent_routing.get("memo_size", 1024),
         rag_agents=[
             DeepSearch(
                 llm=llm,
@@ -74,7 +131,16 @@ def init_config(config: Configuration):
                 vector_db=vector_db,
                 max_iter=config.query_settings['max_iter'],
                 route_collection=True,
-                text_window_splitter=True
+                text_window_splitter=True,
+                max_concurrency=config.query_settings.get("max_concurrency", 4),
+                rerank_mode=config.query_settings.get("rerank_mode", "batch"),
+                reranker=reranker,
+                document_store=document_store,
+                search_preset="accurate",
+                search_mode=search_mode,
+                auto_filter=auto_filter,
+                collection_router=collection_router,
+                context_packer=context_packer
             ),
             ChainOfRAG(
                 llm=llm,
@@ -82,7 +148,13 @@ def init_config(config: Configuration):
                 vector_db=vector_db,
                 max_iter=config.query_settings["max_iter"],
                 route_collection=True,
-                text_window_splitter=True
+                text_window_splitter=True,
+                document_store=document_store,
+                search_preset="accurate",
+                search_mode=search_mode,
+                auto_filter=auto_filter,
+                collection_router=collection_router,
+                context_packer=context_packer
             )
         ]
     )
@@ -93,7 +165,13 @@ def init_config(config: Configuration):
         vector_db=vector_db,
         top_k=10,
         route_collection=True,
-        text_window_splitter=True
+        text_window_splitter=True,
+        document_store=document_store,
+        search_preset="fast",
+        search_mode=search_mode,
+        auto_filter=auto_filter,
+        collection_router=collection_router,
+        context_packer=context_packer
     )
 
 
@@ -1,5 +1,10 @@
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple
+from deepsearcher.embedding.cache import EmbeddingCache
+from deepsearcher.llm.tokenizer import count_tokens
 from deepsearcher.loader.splitter import Chunk
+from deepsearcher.tools import log
 from tqdm import tqdm
 
 class BaseEmbedding:
@@ -7,6 +12,28 @@ class BaseEmbedding:
     Abstract base class for embedding model implementations.
     """
 
+    cache: EmbeddingCache = None
+
+    def _cached_embed(self, texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        Embed texts, serving the ones already in `self.cache` from disk and only sending
+        the others to `embed_fn`.
+        :param texts: the texts to embed
+        :param embed_fn: the function calling the embedding provider
+        :return: one embedding per text, in input order
+        """
+        if self.cache is None:
+            return embed_fn(texts)
+        embeddings = self.cache.get_many(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            missing_embeddings = embed_fn(missing_texts)
+            self.cache.put_many(missing_texts, missing_embeddings)
+            for i, embedding in zip(missing, missing_embeddings):
+                embeddings[i] = embedding
+        return embeddings
+
     def embed_query(self, text: str) -> List[float]:
         """
         Embed a single query
@@ -23,28 +50,83 @@ class BaseEmbedding:
         """
         return [self.embed_query(text) for text in texts]
 
-    def embed_chunks(self, chunks: List[Chunk], batch_size: int = 256) -> List[Chunk]:
+    def embed_chunks(
+            self,
+            chunks: List[Chunk],
+            batch_size: int = 256,
+            max_batch_tokens: int = 100_000,
+            max_concurrency: int = 4,
+            max_retries: int = 3
+    ) -> List[Chunk]:
         """
         Embed a list of Chunk objects.
-        This method extracts the text from each chunk, embeds it in batches,
-        updates the chunks with their embeddings.
+        This method extracts the text from each chunk, packs the texts into batches bounded
+        by both item count and token count, embeds several batches concurrently, and updates
+        the chunks with their embeddings in input order. If a batch still fails after its
+        retries, the batches that have not started are cancelled and the error is raised.
         :param chunks:
-        :param batch_size:
+        :param batch_size: maximum number of texts per request
+        :param max_batch_tokens: maximum number of tokens per request
+        :param max_concurrency: maximum number of requests in flight
+        :param max_retries: number of retries for a failed batch before giving up
         :return:
         """
         texts = [chunk.text for chunk in chunks]
-        batch_texts = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
-        embeddings = []
-        for batch_text in tqdm(batch_texts, desc="Embedding chunks"):
-            batch_embeddings = self.embed_documents(batch_text)
-            embeddings.extend(batch_embeddings)
+        batch_ranges = _pack_batches(texts, batch_size, max_batch_tokens, model=getattr(self, "model", None))
+        embeddings = [None] * len(texts)
+        executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+        try:
+            futures = {
+                executor.submit(self._embed_batch_with_retry, texts[start:end], max_retries): (start, end)
+                for start, end in batch_ranges
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Embedding chunks"):
+                start, end = futures[future]
+                embeddings[start:end] = future.result()
+        finally:
+            # after a failure, drop the batches still queued instead of waiting for all of them
+            executor.shutdown(wait=False, cancel_futures=True)
         for chunk, embedding in zip(chunks, embeddings):
             chunk.embedding = embedding
+        if self.cache is not None:
+            log.info(f"Embedding cache stats: {self.cache.stats()}")
         return chunks
 
+    def _embed_batch_with_retry(self, texts: List[str], max_retries: int) -> List[List[float]]:
+        for attempt in range(max_retries + 1):
+            try:
+                return self.embed_documents(texts)
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                delay = 2 ** attempt
+                log.warning(f"Embedding batch of {len(texts)} texts failed ({e}), retrying in {delay}s")
+                time.sleep(delay)
+
     @property
     def dimension(self):
         pass
 
 
-
+def _pack_batches(
+        texts: List[str], batch_size: int, max_batch_tokens: int, model: Optional[str] = None
+) -> List[Tuple[int, int]]:
+    """
+    Greedily pack consecutive texts into batches of at most `batch_size` texts and
+    `max_batch_tokens` tokens, counted with the tokenizer of `model`, see `count_tokens`.
+    A text larger than the token budget gets a batch of its own.
+    :return: the (start, end) index range of every batch
+    """
+    batch_ranges = []
+    start = 0
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        n_tokens = count_tokens(text, model)
+        if i > start and (i - start >= batch_size or batch_tokens + n_tokens > max_batch_tokens):
+            batch_ranges.append((start, i))
+            start = i
+            batch_tokens = 0
+        batch_tokens += n_tokens
+    if start < len(texts):
+        batch_ranges.append((start, len(texts)))
+    return batch_ranges
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of embedding vectors backed by SQLite.
+
+    Entries are keyed by a hash of (model, dimension, text), so the same file can be shared
+    by several embedding models. Vectors are stored as float32 blobs. When the cache grows
+    beyond `max_entries`, the least recently used entries are evicted.
+
+    Attributes:
+        hits: Number of texts served from the cache.
+        misses: Number of texts that had to be embedded by the provider.
+    """
+
+    def __init__(self, path: str, model: str, dimension: int, max_entries: int = 1_000_000):
+        """
+        Open (or create) the cache.
+        :param path: path of the SQLite file
+        :param model: name of the embedding model
+        :param dimension: dimension of the embedding vectors
+        :param max_entries: maximum number of vectors kept in the cache
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.model = model
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\x00{self.dimension}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up the embeddings of several texts
+        :param texts: the texts to look up
+        :return: one embedding per text, None for the texts that are not cached
+        """
+        keys = [self._key(text) for text in texts]
+        found = {}
+        with self._lock:
+            unique_keys = list(set(keys))
+            # stay below SQLite's limit on the number of host parameters
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i: i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+            results = [
+                np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+                for key in keys
+            ]
+            n_hits = sum(1 for result in results if result is not None)
+            self.hits += n_hits
+            self.misses += len(results) - n_hits
+        return results
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]):
+        """
+        Store the embeddings of several texts, evicting the least recently used entries if needed
+        :param texts: the embedded texts
+        :param embeddings: the embedding of each text
+        """
+        now = time.time()
+        rows = [
+            (self._key(text), np.asarray(embedding, dtype=np.float32).tobytes(), now)
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows
+            )
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if size > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (size - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """
+        Return the hit/miss counters and the current size of the cache.
+        """
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": size,
+        }
@@ -1,6 +1,7 @@
 from typing import List
 from openai import OpenAI
 from deepsearcher.embedding.base import BaseEmbedding
+from deepsearcher.embedding.cache import EmbeddingCache
 import os
 
 OPENAI_MODEL_DIM_MAP = {
@@ -25,9 +26,15 @@ class OpenAIEmbedding(BaseEmbedding):
             base_url = kwargs.pop("base_url")
         else:
             base_url = os.getenv("OPENAI_BASE_URL")
+        cache_path = kwargs.pop("cache_path", None)
+        cache_max_entries = kwargs.pop("cache_max_entries", 1_000_000)
         self.dim = dimension
         self.model = model
         self.client = OpenAI(api_key=api_key, base_url=base_url, **kwargs)
+        if cache_path:
+            self.cache = EmbeddingCache(
+                cache_path, model=self.model, dimension=self.dim, max_entries=cache_max_entries
+            )
 
     def embed_query(self, text: str) -> List[float]:
         """
@@ -35,9 +42,7 @@ class OpenAIEmbedding(BaseEmbedding):
         :param text: The query text to embed
         :return: List[float]: A list of floats representing the embedding vector
         """
-        return (
-            self.client.embeddings.create(input=[text], model=self.model, dimensions=self.dim).data[0].embedding
-        )
+        return self._cached_embed([text], self._create_embeddings)[0]
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
@@ -45,10 +50,12 @@ class OpenAIEmbedding(BaseEmbedding):
         :param texts: A list of document texts to embed
         :return: A list of embedding vectors, one for each input text
         """
-        res = self.client.embeddings.create(input=[texts], model=self.model, dimensions=self.dim)
-        res = [r.embedding for r in res.data]
-        return res
+        return self._cached_embed(texts, self._create_embeddings)
+
+    def _create_embeddings(self, texts: List[str]) -> List[List[float]]:
+        res = self.client.embeddings.create(input=texts, model=self.model, dimensions=self.dim)
+        return [r.embedding for r in res.data]
 
     @property
     def dimension(self) -> int:
-        return self.dim
\ No newline at end of file
+        return self.dim
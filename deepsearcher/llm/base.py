@@ -1,7 +1,10 @@
-from typing import Dict, List
+from typing import Awaitable, Callable, Dict, Iterator, List
 import ast
+import asyncio
 import re
 
+from deepsearcher.llm.cache import LLMResponseCache
+
 
 class ChatResponse:
 
@@ -20,22 +23,86 @@ class ChatResponse:
 
 class BaseLLM:
 
+    model: str = ""
+    cache: LLMResponseCache = None
+
     def __init__(self):
         """
         Initialize a BAseLLM object
         """
         pass
 
-    def chat(self, messages: List[Dict]) -> ChatResponse:
+    def chat(self, messages: List[Dict], use_cache: bool = False) -> ChatResponse:
         """
         Send a chat message to the language model and get a response
         :param messages: A list of message dictionaries, typically in the format:
                          [{"role": "system", "content": "..."}, {"role": "user", "content": "..."}]
+        :param use_cache: serve the response from `self.cache` if the same prompt was answered before.
+                          Only call sites whose prompts are deterministic should opt in
         :return:
             A ChatResponse object containing the model's response.
         """
         pass
 
+    async def achat(self, messages: List[Dict], use_cache: bool = False) -> ChatResponse:
+        """
+        Asynchronously send a chat message to the language model and get a response.
+        Subclasses with an async client should override this; the default runs `chat`
+        in a worker thread so that it does not block the event loop.
+        :param messages: A list of message dictionaries, see `chat`
+        :param use_cache: see `chat`
+        :return:
+            A ChatResponse object containing the model's response.
+        """
+        return await asyncio.to_thread(self.chat, messages, use_cache)
+
+    def chat_stream(self, messages: List[Dict]) -> Iterator[ChatResponse]:
+        """
+        Send a chat message to the language model and yield the response as it is generated.
+        Subclasses whose provider supports streaming should override this; the default yields
+        the whole response of `chat` at once.
+        :param messages: A list of message dictionaries, see `chat`
+        :return:
+            An iterator of ChatResponse objects. Their contents concatenate to the full response,
+            and the token usage of the call is reported by the last one, the others report 0.
+        """
+        yield self.chat(messages)
+
+    def _cached_chat(
+            self, messages: List[Dict], use_cache: bool, chat_fn: Callable[[List[Dict]], ChatResponse]
+    ) -> ChatResponse:
+        """
+        Answer from `self.cache` when allowed, otherwise call `chat_fn` and cache its response.
+        A response served from the cache reports 0 tokens, as nothing was spent on it.
+        :param messages:
+        :param use_cache:
+        :param chat_fn: the function calling the provider
+        :return:
+        """
+        if not use_cache or self.cache is None:
+            return chat_fn(messages)
+        cached = self.cache.get(self.model, messages)
+        if cached is not None:
+            return ChatResponse(content=cached[0], total_tokens=0)
+        chat_response = chat_fn(messages)
+        self.cache.put(self.model, messages, chat_response.content, chat_response.total_tokens)
+        return chat_response
+
+    async def _acached_chat(
+            self, messages: List[Dict], use_cache: bool, achat_fn: Callable[[List[Dict]], Awaitable[ChatResponse]]
+    ) -> ChatResponse:
+        """
+        Asynchronous version of `_cached_chat`
+        """
+        if not use_cache or self.cache is None:
+            return await achat_fn(messages)
+        cached = self.cache.get(self.model, messages)
+        if cached is not None:
+            return ChatResponse(content=cached[0], total_tokens=0)
+        chat_response = await achat_fn(messages)
+        self.cache.put(self.model, messages, chat_response.content, chat_response.total_tokens)
+        return chat_response
+
     @staticmethod
     def literal_eval(response_content: str):
         """
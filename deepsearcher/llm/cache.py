@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class LLMResponseCache:
+    """
+    Persistent cache of chat completions backed by SQLite.
+
+    Entries are keyed by a hash of (model, messages), so only byte-identical prompts hit.
+    An entry expires `ttl` seconds after it was written, and when the cache grows beyond
+    `max_entries` the least recently used entries are evicted. Callers opt in per call, see
+    `BaseLLM.chat`.
+
+    Attributes:
+        hits: Number of calls served from the cache.
+        misses: Number of calls that had to go to the provider.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 100_000):
+        """
+        Open (or create) the cache.
+        :param path: path of the SQLite file
+        :param ttl: seconds an entry stays valid, None to never expire
+        :param max_entries: maximum number of responses kept in the cache
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+            "total_tokens INTEGER NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(model: str, messages: List[Dict]) -> str:
+        payload = json.dumps(messages, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{model}\x00{payload}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, messages: List[Dict]) -> Optional[Tuple[str, int]]:
+        """
+        Look up the response to a prompt
+        :param model:
+        :param messages:
+        :return: the cached (content, total_tokens), or None if missing or expired
+        """
+        key = self._key(model, messages)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, total_tokens, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[2] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0], row[1]
+
+    def put(self, model: str, messages: List[Dict], content: str, total_tokens: int):
+        """
+        Store the response to a prompt, evicting expired and least recently used entries if needed
+        :param model:
+        :param messages:
+        :param content:
+        :param total_tokens: the tokens the original call cost
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, total_tokens, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self._key(model, messages), content, total_tokens, now, now),
+            )
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if size > self.max_entries:
+                if self.ttl is not None:
+                    self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                    (size,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+                if size > self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                        (size - self.max_entries,),
+                    )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """
+        Return the hit/miss counters and the current size of the cache.
+        """
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": size,
+        }
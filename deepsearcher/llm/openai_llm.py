@@ -1,6 +1,8 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from deepsearcher.llm.base import ChatResponse, BaseLLM
-from typing import Dict, List
+from deepsearcher.llm.cache import LLMResponseCache
+from deepsearcher.llm.rate_limiter import estimate_tokens, get_rate_limiter
+from typing import Dict, Iterator, List
 import os
 
 
@@ -9,8 +11,10 @@ class OpenAISearch(BaseLLM):
     def __init__(self, model: str = "o1-mini", **kwargs):
         """
         Initializes an OpenAI language model client.
+        Every call goes through the process-wide rate limiter, see `deepsearcher.llm.rate_limiter`.
         :param model:
-        :param kwargs:
+        :param kwargs: `cache_path`, `cache_ttl` and `cache_max_entries` enable the response cache,
+                       see `LLMResponseCache`; the rest is passed to the OpenAI client
         """
         print('LLM KWARGS: ', kwargs)
         self.model = model
@@ -19,17 +23,73 @@ class OpenAISearch(BaseLLM):
             base_url = kwargs.pop("base_url")
         else:
             base_url = os.getenv("OPENAI_BASE_URL")
+        cache_path = kwargs.pop("cache_path", None)
+        cache_ttl = kwargs.pop("cache_ttl", 7 * 24 * 3600)
+        cache_max_entries = kwargs.pop("cache_max_entries", 100_000)
+        if cache_path:
+            self.cache = LLMResponseCache(cache_path, ttl=cache_ttl, max_entries=cache_max_entries)
 
         self.client = OpenAI(api_key=api_key, base_url=base_url, **kwargs)
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url, **kwargs)
+        self.rate_limiter = get_rate_limiter()
 
-    def chat(self, messages: List[Dict]) -> ChatResponse:
-        completion = self.client.chat.chat.completions.create(
-            model=self.model,
-            messages=messages,
-        )
+    def chat(self, messages: List[Dict], use_cache: bool = False) -> ChatResponse:
+        return self._cached_chat(messages, use_cache, self._chat)
+
+    async def achat(self, messages: List[Dict], use_cache: bool = False) -> ChatResponse:
+        return await self._acached_chat(messages, use_cache, self._achat)
+
+    def _chat(self, messages: List[Dict]) -> ChatResponse:
+        estimated_tokens = estimate_tokens(messages)
+        with self.rate_limiter.limit(estimated_tokens):
+            completion = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+            )
+        self.rate_limiter.record_usage(estimated_tokens, completion.usage.total_tokens)
         return ChatResponse(
             content=completion.choices[0].message.content,
             total_tokens=completion.usage.total_tokens
         )
 
+    async def _achat(self, messages: List[Dict]) -> ChatResponse:
+        estimated_tokens = estimate_tokens(messages)
+        async with self.rate_limiter.alimit(estimated_tokens):
+            completion = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+            )
+        self.rate_limiter.record_usage(estimated_tokens, completion.usage.total_tokens)
+        return ChatResponse(
+            content=completion.choices[0].message.content,
+            total_tokens=completion.usage.total_tokens
+        )
 
+    def chat_stream(self, messages: List[Dict]) -> Iterator[ChatResponse]:
+        """
+        Stream the completion, one ChatResponse per content delta, followed by one with empty
+        content that reports the token usage. The rate limiter slot is held while the completion
+        streams; a caller that stops reading early must `close()` the iterator (e.g. with
+        `contextlib.closing`) to release the slot at once rather than when it is garbage-collected.
+        """
+        estimated_tokens = estimate_tokens(messages)
+        total_tokens = 0
+        # `limit` releases the slot in a finally block, which also runs when the caller closes
+        # this generator while it is suspended at a yield
+        with self.rate_limiter.limit(estimated_tokens):
+            try:
+                with self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                ) as stream:
+                    for chunk in stream:
+                        if chunk.usage is not None:
+                            total_tokens = chunk.usage.total_tokens
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield ChatResponse(content=chunk.choices[0].delta.content, total_tokens=0)
+            finally:
+                # some OpenAI-compatible servers ignore include_usage, keep the estimate then
+                self.rate_limiter.record_usage(estimated_tokens, total_tokens or estimated_tokens)
+        yield ChatResponse(content="", total_tokens=total_tokens)
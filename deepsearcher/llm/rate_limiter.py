@@ -0,0 +1,234 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional
+
+
+class _TokenBucket:
+    """
+    A token bucket refilled continuously at `capacity_per_minute / 60` units per second.
+    Reservations are taken immediately and may drive the bucket negative; the caller then
+    waits until the debt has been refilled.
+    """
+
+    def __init__(self, capacity_per_minute: float):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Take `amount` units from the bucket and return the number of seconds to wait before
+        the reservation is covered.
+        """
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def adjust(self, delta: float, now: float):
+        """
+        Correct a previous reservation once the real usage is known.
+        """
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class _SlotWaiter:
+    """
+    A caller queued for a request slot: a thread waiting on an event, or a coroutine waiting on
+    a future of its event loop. `granted` is set under the limiter lock when a slot is handed over.
+    """
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.granted = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._set_result)
+
+    def _set_result(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class RateLimiter:
+    """
+    Process-wide limiter shared by every LLM call.
+
+    It combines a cap on in-flight requests with token buckets for the provider's
+    requests-per-minute (RPM) and tokens-per-minute (TPM) limits. The same limiter
+    serves synchronous callers (`limit`) and coroutines (`alimit`), so agents running
+    in threads and agents running on an event loop draw from one budget. Callers that
+    find no free slot queue up and are served in FIFO order, whichever kind they are.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = 8,
+            requests_per_minute: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None
+    ):
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = deque()
+        self.configure(
+            max_concurrency=max_concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+
+    def configure(
+            self,
+            max_concurrency: int = 8,
+            requests_per_minute: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None
+    ):
+        """
+        (Re)configure the limits. Requests already in flight keep the slot they hold; when the
+        concurrency shrinks, queued callers wait until enough of them have finished.
+        :param max_concurrency: maximum number of requests in flight at the same time
+        :param requests_per_minute: provider RPM limit, None to disable
+        :param tokens_per_minute: provider TPM limit, None to disable
+        """
+        with self._lock:
+            self.max_concurrency = max(1, int(max_concurrency))
+            self._request_bucket = _TokenBucket(requests_per_minute) if requests_per_minute else None
+            self._token_bucket = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+            self._grant_waiters()
+
+    def _grant_waiters(self):
+        """
+        Hand the free slots to the oldest waiters. Must be called with `self._lock` held.
+        """
+        while self._waiters and self._in_flight < self.max_concurrency:
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self._in_flight += 1
+            try:
+                waiter.wake()
+            except RuntimeError:
+                # the event loop of the waiter is closed, nobody will use the slot
+                self._in_flight -= 1
+
+    def _acquire(self):
+        with self._lock:
+            if not self._waiters and self._in_flight < self.max_concurrency:
+                self._in_flight += 1
+                return
+            waiter = _SlotWaiter()
+            self._waiters.append(waiter)
+        waiter.event.wait()
+
+    async def _aacquire(self):
+        with self._lock:
+            if not self._waiters and self._in_flight < self.max_concurrency:
+                self._in_flight += 1
+                return
+            waiter = _SlotWaiter(asyncio.get_running_loop())
+            self._waiters.append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                self._release()
+            raise
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._grant_waiters()
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self._request_bucket is not None:
+                wait = max(wait, self._request_bucket.reserve(1, now))
+            if self._token_bucket is not None:
+                wait = max(wait, self._token_bucket.reserve(estimated_tokens, now))
+            return wait
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """
+        Replace the estimate taken when the request was admitted with the real token usage.
+        :param estimated_tokens: the estimate passed to `limit`/`alimit`
+        :param actual_tokens: the total tokens reported by the provider
+        """
+        with self._lock:
+            if self._token_bucket is not None:
+                self._token_bucket.adjust(actual_tokens - estimated_tokens, time.monotonic())
+
+    @contextmanager
+    def limit(self, estimated_tokens: int = 0):
+        """
+        Block until a request slot and enough RPM/TPM budget are available.
+        :param estimated_tokens: estimated total tokens of the request
+        """
+        self._acquire()
+        try:
+            wait = self._reserve(estimated_tokens)
+            if wait > 0:
+                time.sleep(wait)
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def alimit(self, estimated_tokens: int = 0):
+        """
+        Asynchronous counterpart of `limit`; waits without blocking the event loop.
+        :param estimated_tokens: estimated total tokens of the request
+        """
+        await self._aacquire()
+        try:
+            wait = self._reserve(estimated_tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield
+        finally:
+            self._release()
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """
+    Cheap estimate of the prompt size (roughly four characters per token) used to
+    admit a request before the provider reports the real usage.
+    :param messages: chat messages
+    :return: the estimated number of tokens
+    """
+    return sum(len(str(message.get("content", ""))) for message in messages) // 4 + 4 * len(messages)
+
+
+_rate_limiter = RateLimiter()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Return the rate limiter shared by all LLM clients in this process.
+    """
+    return _rate_limiter
+
+
+def configure_rate_limiter(**kwargs):
+    """
+    Configure the shared rate limiter, see `RateLimiter.configure`.
+    """
+    _rate_limiter.configure(**kwargs)
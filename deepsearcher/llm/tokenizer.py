@@ -0,0 +1,39 @@
+import functools
+from typing import Callable, Optional
+
+from deepsearcher.tools import log
+
+
+@functools.lru_cache(maxsize=None)
+def _encoder(model: Optional[str]) -> Optional[Callable[[str], list]]:
+    """
+    Return the tiktoken encode function for a model, or None if tiktoken or its encoding files
+    are unavailable. Models unknown to tiktoken, e.g. DeepSeek ones, use the cl100k_base encoding,
+    which is close enough to budget prompts.
+    """
+    try:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return encoding.encode
+    except Exception as e:
+        log.warning(f"tiktoken unavailable ({e}), token counts are estimated from the text length")
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Count the tokens of a text with the tokenizer of `model`.
+    Falls back to a conservative estimate of three characters per token when tiktoken is not
+    installed or cannot load its encoding, e.g. offline.
+    :param text:
+    :param model: the LLM model name, e.g. "o1-mini"
+    :return: the number of tokens
+    """
+    encode = _encoder(model)
+    if encode is None:
+        return len(text) // 3 + 1
+    return len(encode(text, disallowed_special=()))
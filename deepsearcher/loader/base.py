@@ -1,5 +1,5 @@
 import os
-from typing import List
+from typing import Iterable, Iterator, List
 from langchain_core.documents import Document
 
 
@@ -19,12 +19,32 @@ class BaseLoader:
         :return:
         """
         documents = []
-        for file in os.listdir(directory):
-            for suffix in self.supported_file_types:
-                if file.endswith(suffix):
-                    documents.extend(self.load_file(os.path.join(directory, file)))
+        for docs in self.load_files(self.list_supported_files(directory)):
+            documents.extend(docs)
         return documents
 
+    def load_files(self, file_paths: Iterable[str]) -> Iterator[List[Document]]:
+        """
+        Load several files, yielding the documents of each file in input order.
+        Loaders that can parse files in parallel override this method.
+        :param file_paths:
+        :return:
+        """
+        for file_path in file_paths:
+            yield self.load_file(file_path) or []
+
+    def list_supported_files(self, directory: str) -> List[str]:
+        """
+        List the files of a directory that this loader supports, in a stable order
+        :param directory:
+        :return:
+        """
+        return [
+            os.path.join(directory, file)
+            for file in sorted(os.listdir(directory))
+            if any(file.endswith(suffix) for suffix in self.supported_file_types)
+        ]
+
     @property
     def supported_file_types(self) -> List[str]:
         pass
\ No newline at end of file
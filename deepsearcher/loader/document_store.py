@@ -0,0 +1,140 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Optional
+
+
+class DocumentStore:
+    """
+    Compact local store of full document texts.
+
+    Each document is stored once as a zlib-compressed blob in SQLite, keyed by a document id
+    derived from its collection and reference, so that collections ingesting the same file
+    never share, overwrite or delete each other's documents. Chunks then only carry the document id and the offsets of their
+    context window, and the window text is read back from here when it is needed.
+    """
+
+    def __init__(self, path: str, cache_size: int = 32):
+        """
+        Open (or create) the document store
+        :param path: path of the SQLite file
+        :param cache_size: number of decompressed documents kept in memory
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY, collection TEXT NOT NULL DEFAULT '', "
+            "reference TEXT NOT NULL, content BLOB NOT NULL)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(documents)")]
+        if "collection" not in columns:
+            # stores written before documents were scoped by collection
+            self._conn.execute("ALTER TABLE documents ADD COLUMN collection TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("DROP INDEX IF EXISTS idx_documents_reference")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_documents_collection_reference ON documents (collection, reference)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def doc_id_for(collection: str, reference: str, part: int = 0) -> str:
+        """
+        Return the document id of the `part`-th document loaded from the given reference into a collection
+        """
+        return hashlib.sha1(f"{collection}\x00{reference}\x00{part}".encode("utf-8")).hexdigest()
+
+    def put(self, doc_id: str, collection: str, reference: str, text: str):
+        """
+        Store (or replace) the full text of a document
+        :param doc_id:
+        :param collection:
+        :param reference:
+        :param text:
+        """
+        content = zlib.compress(text.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (doc_id, collection, reference, content) VALUES (?, ?, ?, ?)",
+                (doc_id, collection, reference, content),
+            )
+            self._conn.commit()
+            self._cache.pop(doc_id, None)
+
+    def get(self, doc_id: str) -> Optional[str]:
+        """
+        Return the full text of a document, or None if it is not stored
+        :param doc_id:
+        """
+        with self._lock:
+            if doc_id in self._cache:
+                self._cache.move_to_end(doc_id)
+                return self._cache[doc_id]
+            row = self._conn.execute("SELECT content FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is None:
+                return None
+            text = zlib.decompress(row[0]).decode("utf-8")
+            self._cache[doc_id] = text
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return text
+
+    def delete_reference(self, collection: str, reference: str):
+        """
+        Remove all the documents of a collection loaded from the given reference
+        :param collection:
+        :param reference:
+        """
+        self._delete_where("collection = ? AND reference = ?", (collection, reference))
+
+    def drop_collection(self, collection: str):
+        """
+        Remove all the documents of a collection, e.g. because it is rebuilt
+        :param collection:
+        """
+        self._delete_where("collection = ?", (collection,))
+
+    def _delete_where(self, condition: str, params: tuple):
+        with self._lock:
+            doc_ids = [row[0] for row in self._conn.execute(f"SELECT doc_id FROM documents WHERE {condition}", params)]
+            self._conn.execute(f"DELETE FROM documents WHERE {condition}", params)
+            self._conn.commit()
+            for doc_id in doc_ids:
+                self._cache.pop(doc_id, None)
+
+
+def hydrate_wider_text(results: List, document_store: Optional[DocumentStore]) -> List:
+    """
+    Fill `metadata["wider_text"]` of results stored as offsets into the document store.
+
+    Results that already carry their window text, or that have no document offsets, are left
+    untouched. Documents are read once per call however many of their chunks are hydrated.
+
+    Args:
+        results: The retrieval results (RetrievalResult objects) to hydrate.
+        document_store: The document store, or None to do nothing.
+
+    Returns:
+        The same list of results.
+    """
+    if document_store is None:
+        return results
+    texts = {}
+    for result in results:
+        metadata = result.metadata or {}
+        if "wider_text" in metadata or "doc_id" not in metadata:
+            continue
+        doc_id = metadata["doc_id"]
+        if doc_id not in texts:
+            texts[doc_id] = document_store.get(doc_id)
+        text = texts[doc_id]
+        if text is not None:
+            metadata["wider_text"] = text[metadata["window_start"]: metadata["window_end"]]
+    return results
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+
+def file_content_hash(file_path: str, block_size: int = 1 << 20) -> str:
+    """
+    Compute the sha256 of a file's content without reading it into memory at once
+    :param file_path:
+    :param block_size:
+    :return: the hex digest
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class IngestManifest:
+    """
+    Record of the files ingested into one collection, used for incremental re-ingest.
+
+    For every file it keeps the size, modification time and content hash seen at the last
+    successful ingest. It is stored as a JSON file named after the collection.
+    """
+
+    def __init__(self, path: str):
+        """
+        Load the manifest stored at `path`, or start an empty one
+        :param path:
+        """
+        self.path = path
+        self.files: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                self.files = json.load(file).get("files", {})
+
+    @classmethod
+    def for_collection(cls, manifest_dir: str, collection: str) -> "IngestManifest":
+        """
+        Load the manifest of a collection from the manifest directory
+        :param manifest_dir:
+        :param collection:
+        :return:
+        """
+        return cls(os.path.join(manifest_dir, f"{collection}.json"))
+
+    def is_unchanged(self, file_path: str) -> bool:
+        """
+        Check whether a file is identical to the version recorded in the manifest.
+        Size and modification time are compared first; the content hash is only computed
+        when they differ, so that touched but unmodified files are still skipped.
+        :param file_path:
+        :return:
+        """
+        record = self.files.get(file_path)
+        if record is None:
+            return False
+        stat = os.stat(file_path)
+        if record["size"] == stat.st_size and record["mtime"] == stat.st_mtime:
+            return True
+        if record["size"] != stat.st_size:
+            return False
+        content_hash = file_content_hash(file_path)
+        if content_hash != record["content_hash"]:
+            return False
+        record["mtime"] = stat.st_mtime
+        return True
+
+    @staticmethod
+    def fingerprint(file_path: str) -> dict:
+        """
+        Return the size, modification time and content hash of a file as stored in the manifest
+        :param file_path:
+        :return:
+        """
+        stat = os.stat(file_path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "content_hash": file_content_hash(file_path)}
+
+    def record(self, file_path: str, fingerprint: Optional[dict] = None):
+        """
+        Record the state of an ingested file
+        :param file_path:
+        :param fingerprint: the `fingerprint` taken before the file was loaded, so that an edit
+                            made while it was being ingested is picked up by the next run;
+                            the current state of the file if None
+        """
+        self.files[file_path] = fingerprint or self.fingerprint(file_path)
+
+    def remove(self, file_path: str):
+        self.files.pop(file_path, None)
+
+    def clear(self):
+        self.files = {}
+
+    def stale_files(self, roots: List[str], current_files: List[str]) -> List[str]:
+        """
+        List the recorded files that lie under one of `roots` but are no longer among `current_files`
+        :param roots: the files and directories being ingested
+        :param current_files: the files found under `roots` in this run
+        :return:
+        """
+        current = set(current_files)
+        abs_roots = [os.path.abspath(root) for root in roots]
+        stale = []
+        for file_path in self.files:
+            if file_path in current:
+                continue
+            abs_path = os.path.abspath(file_path)
+            if any(abs_path == root or abs_path.startswith(root.rstrip(os.sep) + os.sep) for root in abs_roots):
+                stale.append(file_path)
+        return stale
+
+    def save(self):
+        """
+        Atomically write the manifest to disk
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"files": self.files}, file, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,191 @@
+import os
+import re
+from typing import Optional
+
+_MONTHS = {
+    month: i + 1 for i, month in enumerate(
+        ["january", "february", "march", "april", "may", "june", "july", "august",
+         "september", "october", "november", "december"]
+    )
+}
+_ORDINAL_QUARTERS = {"first": 1, "second": 2, "third": 3, "fourth": 4}
+
+_FORM_PATTERN = re.compile(r"\bForm\s+(10-K|10-Q|8-K|20-F|6-K|S-1|DEF\s*14A)\b", re.IGNORECASE)
+_BARE_FORM_PATTERN = re.compile(r"\b(10-?K|10-?Q|8-?K|20-?F|6-?K)\b", re.IGNORECASE)
+
+_YEAR_QUARTER_PATTERN = re.compile(r"\b(20\d{2})\s*-?\s*Q([1-4])\b", re.IGNORECASE)
+_QUARTER_YEAR_PATTERN = re.compile(r"\bQ([1-4])\s*(?:FY\s*)?'?(20\d{2}|\d{2})\b", re.IGNORECASE)
+_ORDINAL_QUARTER_PATTERN = re.compile(
+    r"\b(first|second|third|fourth)\s+quarter\s+(?:of\s+)?(?:fiscal\s+(?:year\s+)?)?(20\d{2})\b", re.IGNORECASE
+)
+_FISCAL_YEAR_PATTERN = re.compile(r"\b(?:FY\s*'?(20\d{2}|\d{2})|fiscal\s+(?:year\s+)?(20\d{2}))\b", re.IGNORECASE)
+_YEAR_ENDED_PATTERN = re.compile(
+    r"\bfiscal\s+year\s+ended\s+(january|february|march|april|may|june|july|august|september|october|november|december)"
+    r"\s+\d{1,2},?\s+(20\d{2})",
+    re.IGNORECASE,
+)
+
+_DATE_PATTERN = re.compile(
+    r"\b(january|february|march|april|may|june|july|august|september|october|november|december)"
+    r"\s+(\d{1,2}),?\s+(20\d{2}|19\d{2})\b",
+    re.IGNORECASE,
+)
+_ISO_DATE_PATTERN = re.compile(r"\b((?:19|20)\d{2})-(\d{2})-(\d{2})\b")
+# "For the fiscal year ended September 28, 2024": the period end, not the filing date
+_PERIOD_END_PREFIX_PATTERN = re.compile(r"\b(?:ended|ending)\s*:?\s*$", re.IGNORECASE)
+
+_EXCHANGE_TICKER_PATTERN = re.compile(r"\b(?:NASDAQ|Nasdaq|NYSE|AMEX)\s*:\s*([A-Z]{1,5}(?:\.[A-Z])?)\b")
+_LISTING_TICKER_PATTERN = re.compile(
+    r"\b([A-Z]{1,5})\s+(?:The\s+)?(?:Nasdaq|NASDAQ|New York Stock Exchange|NYSE)\b"
+)
+_DOLLAR_TICKER_PATTERN = re.compile(r"\$([A-Z]{1,5})\b")
+_POSSESSIVE_TICKER_PATTERN = re.compile(r"\b([A-Z]{2,5})['’]s\b")
+_REFERENCE_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+")
+
+# upper-case words that look like tickers but are not
+_NON_TICKERS = frozenset(
+    "AI API CEO CFO COO CTO EPS ESG FY GAAP IPO LLC LTD PDF Q SEC US USA USD YOY".split()
+)
+_REFERENCE_STOPWORDS = frozenset("annual report form quarterly earnings transcript filing sec fy".split())
+
+
+def _normalize_year(year: str) -> int:
+    return int(year) if len(year) == 4 else 2000 + int(year)
+
+
+def _normalize_form(form: str) -> str:
+    form = re.sub(r"\s+", " ", form.upper())
+    if "-" not in form and not form.startswith("DEF"):
+        form = form[:-1] + "-" + form[-1]
+    return form
+
+
+def extract_filing_type(text: str) -> Optional[str]:
+    """
+    Return the SEC form type mentioned in a text, e.g. "10-K", or None
+    """
+    match = _FORM_PATTERN.search(text) or _BARE_FORM_PATTERN.search(text)
+    return _normalize_form(match.group(1)) if match else None
+
+
+def extract_fiscal_period(text: str) -> Optional[str]:
+    """
+    Return the first fiscal period mentioned in a text, normalised to "2023Q4" for quarters
+    and "FY2023" for fiscal years, or None
+    """
+    candidates = []
+    for match in _YEAR_QUARTER_PATTERN.finditer(text):
+        candidates.append((match.start(), f"{match.group(1)}Q{match.group(2)}"))
+        break
+    for match in _QUARTER_YEAR_PATTERN.finditer(text):
+        candidates.append((match.start(), f"{_normalize_year(match.group(2))}Q{match.group(1)}"))
+        break
+    for match in _ORDINAL_QUARTER_PATTERN.finditer(text):
+        candidates.append((match.start(), f"{match.group(2)}Q{_ORDINAL_QUARTERS[match.group(1).lower()]}"))
+        break
+    for match in _YEAR_ENDED_PATTERN.finditer(text):
+        candidates.append((match.start(), f"FY{match.group(2)}"))
+        break
+    for match in _FISCAL_YEAR_PATTERN.finditer(text):
+        candidates.append((match.start(), f"FY{_normalize_year(match.group(1) or match.group(2))}"))
+        break
+    if not candidates:
+        return None
+    return min(candidates)[1]
+
+
+def extract_date(text: str) -> Optional[str]:
+    """
+    Return the first calendar date written in a text as an ISO "YYYY-MM-DD" string, or None.
+    Dates that close a reporting period ("year ended September 28, 2024"), which 10-K and 10-Q
+    covers state before the filing date, are skipped.
+    """
+    candidates = []
+    for match in _DATE_PATTERN.finditer(text):
+        if not _PERIOD_END_PREFIX_PATTERN.search(text[max(0, match.start() - 20): match.start()]):
+            month = _MONTHS[match.group(1).lower()]
+            candidates.append((match.start(), f"{match.group(3)}-{month:02d}-{int(match.group(2)):02d}"))
+            break
+    for match in _ISO_DATE_PATTERN.finditer(text):
+        if not _PERIOD_END_PREFIX_PATTERN.search(text[max(0, match.start() - 20): match.start()]):
+            candidates.append((match.start(), match.group(0)))
+            break
+    if not candidates:
+        return None
+    return min(candidates)[1]
+
+
+def _ticker_from_reference(reference: str) -> Optional[str]:
+    """
+    Guess the ticker from a file name such as "NVDA_10K_2023.pdf"
+    """
+    name = os.path.splitext(os.path.basename(reference))[0]
+    tokens = _REFERENCE_TOKEN_PATTERN.findall(name)
+    if len(tokens) < 2:
+        return None
+    first = tokens[0]
+    if first.isalpha() and len(first) <= 5 and first.lower() not in _REFERENCE_STOPWORDS:
+        return first.upper()
+    return None
+
+
+def extract_ticker(text: str, reference: str = "") -> Optional[str]:
+    """
+    Return the ticker of the company a document is about, read from exchange listings in its
+    text (e.g. "(NASDAQ: NVDA)") or else from its file name, or None
+    """
+    for pattern in (_EXCHANGE_TICKER_PATTERN, _LISTING_TICKER_PATTERN):
+        for match in pattern.finditer(text):
+            if match.group(1) not in _NON_TICKERS:
+                return match.group(1)
+    if reference:
+        return _ticker_from_reference(reference)
+    return None
+
+
+def extract_filing_metadata(text: str, reference: str = "", max_chars: int = 10_000) -> dict:
+    """
+    Extract the scalar fields used to filter searches from the beginning of a document,
+    where filings state the company, form type and period on their cover page.
+    :param text: the text of the document
+    :param reference: the path of the document, used as a fallback for the ticker
+    :param max_chars: number of leading characters of the text that are inspected
+    :return: a dict with the fields that were found among "ticker", "fiscal_period",
+             "filing_type" and "filing_date"
+    """
+    head = text[:max_chars]
+    # "AAPL_10Q_2023Q3.pdf" -> "AAPL 10Q 2023Q3", so that the patterns see word boundaries
+    name = " ".join(_REFERENCE_TOKEN_PATTERN.findall(os.path.splitext(os.path.basename(reference))[0]))
+    fields = {
+        "ticker": extract_ticker(head, reference),
+        "fiscal_period": extract_fiscal_period(head) or extract_fiscal_period(name),
+        "filing_type": extract_filing_type(head) or extract_filing_type(name),
+        "filing_date": extract_date(head),
+    }
+    return {key: value for key, value in fields.items() if value}
+
+
+def extract_query_filters(query: str) -> dict:
+    """
+    Extract search filters from a question, e.g. {"ticker": "NVDA"} for "What drove NVDA's
+    revenue?". A ticker is only taken when written unambiguously ("$NVDA", "NASDAQ: NVDA" or
+    "NVDA's") and when it is the only one, since comparison questions need every company named.
+    Fiscal periods are not used: filings are tagged with one period from their cover page, which
+    often differs from how questions name it ("FY2024" vs "2023Q4"), so an exact match would hide
+    the relevant chunks.
+    :param query:
+    :return: a filter dict, empty if nothing was recognised
+    """
+    filters = {}
+    tickers = {
+        ticker
+        for pattern in (_DOLLAR_TICKER_PATTERN, _EXCHANGE_TICKER_PATTERN, _POSSESSIVE_TICKER_PATTERN)
+        for ticker in pattern.findall(query)
+        if ticker not in _NON_TICKERS
+    }
+    if len(tickers) == 1:
+        filters["ticker"] = tickers.pop()
+    filing_type = extract_filing_type(query)
+    if filing_type:
+        filters["filing_type"] = filing_type
+    return filters
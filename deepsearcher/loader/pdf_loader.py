@@ -1,14 +1,43 @@
-from typing import List
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional
 from langchain_core.documents import Document
 from deepsearcher.loader.base import BaseLoader
 import pdfplumber
 
 
-class PDFLoader(BaseLoader):
+def _extract_pages(file_path: str, start: int = 0, end: Optional[int] = None) -> List[str]:
+    """
+    Extract the text of pages [start, end) of a PDF, all pages by default. Runs in a worker process.
+    """
+    with pdfplumber.open(file_path) as file:
+        return [page.extract_text() or "" for page in file.pages[start:end]]
+
+
+def _count_pages(file_path: str) -> int:
+    """
+    Count the pages of a PDF. Runs in a worker process.
+    """
+    with pdfplumber.open(file_path) as file:
+        return len(file.pages)
 
-    def __init__(self):
 
-        pass
+class PDFLoader(BaseLoader):
+
+    def __init__(self, num_workers: int = 1, pages_per_task: int = 50, split_min_bytes: int = 5_000_000):
+        """
+        Initialize the PDF loader
+        :param num_workers: number of worker processes used to parse PDFs, 1 to parse in the calling thread
+        :param pages_per_task: number of pages of a PDF parsed by one task, so that large files are
+                               spread across several workers
+        :param split_min_bytes: PDFs smaller than this are parsed by a single task; only larger ones
+                                are split into page ranges, since every task re-opens its file
+        """
+        self.num_workers = num_workers
+        self.pages_per_task = max(1, pages_per_task)
+        self.split_min_bytes = split_min_bytes
 
     def load_file(self, file_path: str) -> List[Document]:
         """
@@ -18,7 +47,7 @@ class PDFLoader(BaseLoader):
         """
         if file_path.endswith(".pdf"):
             with pdfplumber.open(file_path) as file:
-                page_content = "\n\n".join([page.extract_text() for page in file.pages])
+                page_content = "\n\n".join([page.extract_text() or "" for page in file.pages])
                 return [Document(page_content=page_content, metadata={"reference": file_path})]
 
         elif file_path.endswith(".txt") or file_path.endswith(".md"):
@@ -26,7 +55,48 @@ class PDFLoader(BaseLoader):
                 page_content = file.read()
                 return [Document(page_content=page_content, metadata={"reference": file_path})]
 
+    def load_files(self, file_paths: Iterable[str]) -> Iterator[List[Document]]:
+        """
+        Load several files, parsing PDFs page range by page range in a process pool.
+        The documents of each file are yielded in input order; at most about twice as
+        many files as workers are in flight at a time.
+        :param file_paths:
+        :return:
+        """
+        if self.num_workers <= 1:
+            yield from super().load_files(file_paths)
+            return
+        # the loader runs in a pipeline thread next to other threads (embedding pool, SQLite caches),
+        # and forking a multithreaded process can deadlock the child
+        with ProcessPoolExecutor(
+                max_workers=self.num_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            pending = deque()
+            for file_path in file_paths:
+                pending.append((file_path, self._submit(executor, file_path)))
+                if len(pending) > 2 * self.num_workers:
+                    yield self._collect(*pending.popleft())
+            while pending:
+                yield self._collect(*pending.popleft())
+
+    def _submit(self, executor: ProcessPoolExecutor, file_path: str):
+        if not file_path.endswith(".pdf"):
+            return self.load_file(file_path) or []
+        if os.path.getsize(file_path) < self.split_min_bytes:
+            return [executor.submit(_extract_pages, file_path)]
+        # the workers are already busy with the files submitted before, so waiting here costs little
+        n_pages = executor.submit(_count_pages, file_path).result()
+        return [
+            executor.submit(_extract_pages, file_path, start, min(start + self.pages_per_task, n_pages))
+            for start in range(0, n_pages, self.pages_per_task)
+        ]
+
+    def _collect(self, file_path: str, submitted) -> List[Document]:
+        if not file_path.endswith(".pdf"):
+            return submitted
+        pages = [page for future in submitted for page in future.result()]
+        return [Document(page_content="\n\n".join(pages), metadata={"reference": file_path})]
 
     @property
     def supported_file_types(self) -> List[str]:
-        return ["pdf", "md", 'txt']
\ No newline at end of file
+        return ["pdf", "md", 'txt']
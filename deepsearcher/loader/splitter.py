@@ -1,8 +1,11 @@
-from typing import List
+from typing import List, Optional
 
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from deepsearcher.loader.document_store import DocumentStore
+from deepsearcher.tools import log
+
 class Chunk:
 
     """
@@ -28,32 +31,56 @@ class Chunk:
 
 
 def _sentence_window_split(split_docs: List[Document],
-                           original_document: Document, offset: int = 200) -> List[Chunk]:
+                           original_document: Document, offset: int = 200,
+                           doc_id: Optional[str] = None) -> List[Chunk]:
 
     """
     Create chunks with context windows from split documents.
 
     This function takes documents that have been split into smaller pieces and
     adds context from the original document by including text before and after
-    each split piece, up to the specified offset.
+    each split piece, up to the specified offset. The start of each piece is the
+    `start_index` recorded by the splitter; pieces without a valid one are searched for after
+    the previous piece only, so splitting stays linear in the document size. A piece that
+    cannot be located there gets no context window: searching the whole document would place
+    repeated boilerplate at its first occurrence.
 
     Args:
        split_docs: List of documents that have been split.
        original_document: The original document before splitting.
        offset: Number of characters to include before and after each split piece.
+       doc_id: If set, the window is stored as `doc_id`, `window_start` and `window_end`
+          offsets into the document store instead of as `wider_text`.
 
     Returns:
        A list of Chunk objects with context windows.
     """
     chunks = []
     original_text = original_document.page_content
+    # split_docs are in document order, so each piece is searched for from just after the
+    # start of the previous one: the scan stays local (linear overall) and repeated text
+    # maps to the right occurrence
+    search_from = 0
     for doc in split_docs:
         doc_text = doc.page_content
-        start_index = original_text.index(doc_text)
-        end_index = start_index + len(doc_text) - 1
-        wider_text = original_text[max(0, start_index - offset) : min(len(original_text), end_index + offset)]
+        start_index = doc.metadata.pop("start_index", -1)
+        if start_index < 0 or original_text[start_index: start_index + len(doc_text)] != doc_text:
+            start_index = original_text.find(doc_text, search_from)
         reference = doc.metadata.pop("reference", "")
-        doc.metadata["wider_text"] = wider_text
+        if start_index == -1:
+            log.warning(f"chunk of '{reference}' not found in its document, it is stored without a context window")
+            chunks.append(Chunk(text=doc_text, reference=reference, metadata=doc.metadata))
+            continue
+        end_index = start_index + len(doc_text)
+        search_from = start_index + 1
+        window_start = max(0, start_index - offset)
+        window_end = min(len(original_text), end_index + offset)
+        if doc_id is not None:
+            doc.metadata["doc_id"] = doc_id
+            doc.metadata["window_start"] = window_start
+            doc.metadata["window_end"] = window_end
+        else:
+            doc.metadata["wider_text"] = original_text[window_start:window_end]
         chunk = Chunk(text=doc_text, reference=reference, metadata=doc.metadata)
         chunks.append(chunk)
     return chunks
@@ -62,7 +89,8 @@ def _sentence_window_split(split_docs: List[Document],
 
 
 def split_docs_to_chunks(documents: List[Document], chunk_size: int = 1500,
-                         chunk_overlap=100):
+                         chunk_overlap=100, document_store: Optional[DocumentStore] = None,
+                         collection: str = ""):
 
     """
     Split documents into chunks with context windows.
@@ -74,17 +102,29 @@ def split_docs_to_chunks(documents: List[Document], chunk_size: int = 1500,
         documents: List of documents to split.
         chunk_size: Size of each chunk in characters.
         chunk_overlap: Number of characters to overlap between chunks.
+        document_store: If set, the full text of every document is stored there once and
+            chunks reference their context window by offsets instead of duplicating it.
+        collection: The collection the chunks are ingested into, which scopes their documents
+            in the document store.
 
     Returns:
         A list of Chunk objects with context windows.
     """
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
     )
     all_chunks = []
+    reference_parts = {}
     for doc in documents:
         split_docs = text_splitter.split_documents([doc])
-        split_chunks = _sentence_window_split(split_docs, doc, offset=300)
+        doc_id = None
+        if document_store is not None:
+            reference = doc.metadata.get("reference", "")
+            part = reference_parts.get(reference, 0)
+            reference_parts[reference] = part + 1
+            doc_id = DocumentStore.doc_id_for(collection, reference, part)
+            document_store.put(doc_id, collection, reference, doc.page_content)
+        split_chunks = _sentence_window_split(split_docs, doc, offset=300, doc_id=doc_id)
         all_chunks.extend(split_chunks)
     return all_chunks
 
@@ -1,9 +1,12 @@
-from deepsearcher.vector_db.milvus import Milvus
 from deepsearcher import configuration
+from deepsearcher.loader.manifest import IngestManifest
+from deepsearcher.loader.metadata_extractor import extract_filing_metadata
+from deepsearcher.tools import log
+from deepsearcher.tools.pipeline import run_pipeline
 from tqdm import tqdm
 import os
-from typing import List, Union
-from deepsearcher.loader.splitter import split_docs_to_chunks
+from typing import Iterable, Iterator, List, Union
+from deepsearcher.loader.splitter import Chunk, split_docs_to_chunks
 def load_from_local_files(
 
         paths_or_directory: Union[str, List[str]],
@@ -12,19 +15,38 @@ def load_from_local_files(
         force_new_collection: bool = False,
         chunk_size: int = 1500,
         chunk_overlap: int = 100,
-        batch_size: int = 256
+        batch_size: int = 256,
+        max_batch_tokens: int = 100_000,
+        embedding_concurrency: int = 4,
+        queue_size: int = 4,
+        incremental: bool = False,
+        manifest_dir: str = "./.deepsearcher/manifests",
+        extract_metadata: bool = True
 ):
     """
     Load knowledge from local files or directories into the vector database
     It processes files from a path, splits them into chunks, embeds the chunks,
-    and stores them in a vector db
+    and stores them in a vector db.
+    Loading, splitting, embedding and inserting run as a streaming pipeline of
+    concurrent stages connected by bounded queues, so memory stays bounded and
+    chunks become searchable while the ingest is still running.
     :param paths_or_directory:
     :param collection_name:
     :param collection_description:
     :param force_new_collection:
     :param chunk_size:
     :param chunk_overlap:
-    :param batch_size:
+    :param batch_size: maximum number of chunks per embedding request
+    :param max_batch_tokens: maximum estimated number of tokens per embedding request
+    :param embedding_concurrency: maximum number of embedding requests in flight
+    :param queue_size: maximum number of items buffered between two pipeline stages
+    :param incremental: only ingest files that are new or changed since the last run, according
+                        to the collection's manifest; chunks of changed and removed files are
+                        deleted from the collection first
+    :param manifest_dir: directory holding the per-collection ingest manifests
+    :param extract_metadata: extract the ticker, fiscal period, filing type and filing date of
+                             every file from its first pages into the metadata of its chunks,
+                             so that searches can be filtered on them
     :return:
     """
 
@@ -35,34 +57,115 @@ def load_from_local_files(
 
     collection_name = collection_name.replace(" ", "_").replace("-", "_")
     file_loader = configuration.file_loader
+    document_store = configuration.document_store
+    centroid_store = configuration.centroid_store
+    answer_cache = configuration.answer_cache
     vector_db.init_collection(
         dim=embedding_model.dimension,
         collection=collection_name,
         description=collection_description,
         force_new_collection=force_new_collection
     )
+    if force_new_collection and centroid_store is not None:
+        centroid_store.remove(collection_name)
+    if force_new_collection and document_store is not None:
+        document_store.drop_collection(collection_name)
+    if answer_cache is not None:
+        # answers built on this collection may change, and new answers written while the
+        # ingest runs see a half-loaded collection, so drop them before and after
+        answer_cache.invalidate_collection(collection_name)
     if isinstance(paths_or_directory, str):
         paths_or_directory = [paths_or_directory]
 
-    all_docs = []
-    for path in tqdm(paths_or_directory, desc="Loading Files"):
+    file_paths = []
+    for path in paths_or_directory:
         if not os.path.exists(path):
             raise FileNotFoundError(f"Error: File or directory '{path}' does not exist.")
         if os.path.isdir(path):
-            docs = file_loader.load_directory(path)
+            file_paths.extend(file_loader.list_supported_files(path))
         else:
-            docs = file_loader.load_file(path)
-        all_docs.extend(docs)
+            file_paths.append(path)
 
-    chunks = split_docs_to_chunks(
-        all_docs,
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap
-    )
-    chunks = embedding_model.embed_chunks(chunks, batch_size=batch_size)
-    vector_db.insert_data(collection=collection_name, chunks=chunks)
+    manifest = None
+    fingerprints = {}
+    if incremental:
+        manifest = IngestManifest.for_collection(manifest_dir, collection_name)
+        if force_new_collection:
+            manifest.clear()
+        for stale_path in manifest.stale_files(paths_or_directory, file_paths):
+            log.color_print(f"<ingest> Purge removed file [{stale_path}] </ingest>\n")
+            vector_db.delete_data(collection=collection_name, reference=stale_path)
+            if document_store is not None:
+                document_store.delete_reference(collection_name, stale_path)
+            manifest.remove(stale_path)
+        unchanged = {path for path in file_paths if manifest.is_unchanged(path)}
+        file_paths = [path for path in file_paths if path not in unchanged]
+        log.color_print(
+            f"<ingest> Skip {len(unchanged)} unchanged file(s), ingest {len(file_paths)} new or changed file(s) </ingest>\n"
+        )
+        # drop whatever an earlier (possibly interrupted) run stored for these files
+        for path in file_paths:
+            vector_db.delete_data(collection=collection_name, reference=path)
+            if document_store is not None:
+                document_store.delete_reference(collection_name, path)
+        # taken before loading, so that a file edited during the ingest is not recorded as ingested
+        fingerprints = {path: IngestManifest.fingerprint(path) for path in file_paths}
+
+    def load_stage(paths: Iterable[str]) -> Iterator:
+        for docs in tqdm(file_loader.load_files(paths), total=len(file_paths), desc="Loading Files"):
+            if docs:
+                yield docs
 
+    def split_stage(docs_iter: Iterable) -> Iterator[List[Chunk]]:
+        for docs in docs_iter:
+            if extract_metadata:
+                # the fields are read from the cover page, so all documents of a file share them
+                filing_metadata = extract_filing_metadata(
+                    "\n".join(doc.page_content for doc in docs[:3]), docs[0].metadata.get("reference", "")
+                )
+                for doc in docs:
+                    doc.metadata.update(filing_metadata)
+            chunks = split_docs_to_chunks(
+                docs, chunk_size=chunk_size, chunk_overlap=chunk_overlap, document_store=document_store,
+                collection=collection_name
+            )
+            if chunks:
+                yield chunks
 
+    def embed_stage(chunks_iter: Iterable[List[Chunk]]) -> Iterator[List[Chunk]]:
+        # accumulate enough chunks to keep every concurrent embedding request full
+        flush_size = batch_size * max(1, embedding_concurrency)
+        buffer = []
+        for chunks in chunks_iter:
+            buffer.extend(chunks)
+            while len(buffer) >= flush_size:
+                batch, buffer = buffer[:flush_size], buffer[flush_size:]
+                yield _embed(batch)
+        if buffer:
+            yield _embed(buffer)
 
+    def _embed(chunks: List[Chunk]) -> List[Chunk]:
+        return embedding_model.embed_chunks(
+            chunks,
+            batch_size=batch_size,
+            max_batch_tokens=max_batch_tokens,
+            max_concurrency=embedding_concurrency
+        )
 
+    # files whose chunks were inserted; files that gave no chunks are not recorded in the manifest
+    inserted_references = set()
+    for chunks in run_pipeline(file_paths, [load_stage, split_stage, embed_stage], queue_size=queue_size):
+        vector_db.insert_data(collection=collection_name, chunks=chunks)
+        inserted_references.update(chunk.reference for chunk in chunks)
+        if centroid_store is not None:
+            centroid_store.update(collection_name, [chunk.embedding for chunk in chunks])
 
+    if centroid_store is not None:
+        centroid_store.save()
+    if answer_cache is not None:
+        answer_cache.invalidate_collection(collection_name)
+    if manifest is not None:
+        for path in file_paths:
+            if path in inserted_references:
+                manifest.record(path, fingerprints[path])
+        manifest.save()
@@ -1,33 +1,130 @@
-from typing import List, Tuple
+import json
+import re
+from typing import Iterator, List, Tuple
+
+from deepsearcher.llm.base import ChatResponse
 from deepsearcher.vector_db.base import RetrievalResult
-from openai import OpenAI
-from deepsearcher.agent.rag_router import RAGRouter
-from deepsearcher.agent.deep_search import DeepSearch
-from deepsearcher.embedding.openai_embedding import OpenAIEmbedding
+from deepsearcher.loader.metadata_extractor import extract_query_filters
 from deepsearcher import configuration
 
-def query(original_query: str, max_iter: int = 3) -> Tuple[str, List[RetrievalResult]]:
+# capitalised words that start questions or instructions rather than name an entity
+_NON_ENTITY_WORDS = frozenset(
+    "a an and are as at by can compare could describe did do does explain for give how i in is list "
+    "of on or please show should summarize summarise tell the their this to was were what when where "
+    "which who why would".split()
+)
+# words that change what a question compares or asks the direction of
+_COMPARISON_WORDS = frozenset(
+    "against between compare compared comparison decline declined decrease decreased difference "
+    "drop dropped fall fell grew growth higher increase increased less lower more than versus vs".split()
+)
+
+
+def _answer_scope(original_query: str, max_iter: int) -> str:
+    """
+    Build the exact-match key of a question in the answer cache. Embeddings barely separate
+    "2023Q3" from "2023Q4" or "Apple's revenue" from "Microsoft's revenue", so the extracted
+    filters, every number, every capitalised entity name and every comparison word of the
+    question must match as well as its meaning. Questions typed without any capitalised name,
+    e.g. "apple revenue 2023", cannot be told apart that way, so all their words except the
+    stopwords must match instead.
+    """
+    words = re.findall(r"[A-Za-z][A-Za-z0-9&.\-]*(?:'s)?", original_query)
+    normalized = [re.sub(r"'s$", "", word).rstrip(".").lower() for word in words]
+    entities = {
+        word for word, original in zip(normalized, words) if original[0].isupper()
+    } - _NON_ENTITY_WORDS
+    if not entities:
+        entities = set(normalized) - _NON_ENTITY_WORDS
+    return json.dumps(
+        {
+            "filters": extract_query_filters(original_query),
+            "numbers": sorted(set(re.findall(r"\d+(?:\.\d+)?", original_query))),
+            "entities": sorted(entities),
+            "comparisons": sorted(set(normalized) & _COMPARISON_WORDS),
+            "max_iter": max_iter,
+        },
+        sort_keys=True,
+    )
+
+
+def query(original_query: str, max_iter: int = 3, use_cache: bool = True) -> Tuple[str, List[RetrievalResult], int]:
     """
     Query the knowlwdge base with a question to get an answer.
-    :param original_query: 
-    :param max_iter: 
+    If an answer cache is configured, the answer to a near-identical earlier question is
+    returned without running the agents.
+    :param original_query:
+    :param max_iter:
+    :param use_cache: look the question up in the answer cache and store the new answer in it
     :return: A Tuple containing:
         - The generated answer as a string
         - A list of retrieval results that were used to generat the answer
         - The number of tokens consumed during the process
     """
-    client = OpenAI(api_key=api_key, base_url=base_url, **kwargs)
-    embed_config = {
-        "model_name": "text-embedding-ada-002",
-        "api_key": api_key,
-        "base_url": base_url,
-        "dimension": 1536}
-    embedding_model = OpenAIEmbedding(embed_config)
-    default_searcher = RAGRouter(llm = client, rag_agents=[
-        DeepSearch(llm=client,
-                   embedding_model = embedding_model)
-    ])
-    return RAGRouter.query(original_query, max_iter=max_iter)
+    default_searcher = configuration.default_searcher
+    answer_cache = configuration.answer_cache if use_cache else None
+    if answer_cache is not None:
+        query_vector = configuration.embedding_model.embed_query(original_query)
+        scope = _answer_scope(original_query, max_iter)
+        cached = answer_cache.lookup(query_vector, scope=scope)
+        if cached is not None:
+            answer, retrieved_results = cached
+            return answer, retrieved_results, 0
+    answer, retrieved_results, consume_tokens = default_searcher.query(original_query, max_iter=max_iter)
+    if answer_cache is not None:
+        answer_cache.store(
+            original_query, query_vector, answer, retrieved_results, total_tokens=consume_tokens, scope=scope
+        )
+    return answer, retrieved_results, consume_tokens
+
+
+def query_stream(
+        original_query: str, max_iter: int = 3, use_cache: bool = True
+) -> Tuple[Iterator[ChatResponse], List[RetrievalResult]]:
+    """
+    Like `query`, but the answer is streamed as the language model generates it, so that a
+    front end can show it from the first token on. Retrieval runs before this function returns.
+    :param original_query:
+    :param max_iter:
+    :param use_cache: see `query`; a cached answer is yielded at once, and a streamed answer is
+                      stored once the stream has been fully consumed
+    :return: A Tuple containing:
+        - An iterator of answer deltas, whose last item has empty content and reports the
+          number of tokens consumed during the process. A caller that stops reading early
+          must `close()` it to release the language model's rate limiter slot
+        - A list of retrieval results that were used to generat the answer
+    """
+    default_searcher = configuration.default_searcher
+    answer_cache = configuration.answer_cache if use_cache else None
+    if answer_cache is not None:
+        query_vector = configuration.embedding_model.embed_query(original_query)
+        scope = _answer_scope(original_query, max_iter)
+        cached = answer_cache.lookup(query_vector, scope=scope)
+        if cached is not None:
+            answer, retrieved_results = cached
+            cached_stream = [ChatResponse(content=answer, total_tokens=0), ChatResponse(content="", total_tokens=0)]
+            return iter(cached_stream), retrieved_results
+    answer_stream, retrieved_results = default_searcher.query_stream(original_query, max_iter=max_iter)
+    if answer_cache is None:
+        return answer_stream, retrieved_results
+
+    def store_when_done() -> Iterator[ChatResponse]:
+        parts = []
+        consume_tokens = 0
+        try:
+            for chunk in answer_stream:
+                parts.append(chunk.content)
+                consume_tokens += chunk.total_tokens
+                yield chunk
+        finally:
+            answer_stream.close()
+        answer_cache.store(
+            original_query, query_vector, "".join(parts), retrieved_results,
+            total_tokens=consume_tokens, scope=scope
+        )
+
+    return store_when_done(), retrieved_results
+
 
 def retrieve(original_query: str, max_iter: int = 3) -> Tuple[List[RetrievalResult], List[str], int]:
     """
@@ -44,5 +141,6 @@ def retrieve(original_query: str, max_iter: int = 3) -> Tuple[List[RetrievalResu
           - An empty list (placeholder for future use)
           - The number of tokens consumed during the process
     """
-    retrieved_results, consume_tokens, metadata = RAGRouter.retrieve(original_query, max_iter=max_iter)
-    return retrieved_results, [], consume_tokens
\ No newline at end of file
+    default_searcher = configuration.default_searcher
+    retrieved_results, consume_tokens, metadata = default_searcher.retrieve(original_query, max_iter=max_iter)
+    return retrieved_results, [], consume_tokens
@@ -0,0 +1,30 @@
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from deepsearcher.vector_db.base import RetrievalResult
+
+
+class BaseReranker:
+    """
+    Abstract base class for local reranker implementations.
+
+    A reranker is a cheap stage that runs before the LLM rerank. It splits the retrieved
+    candidates into chunks that are accepted outright and ambiguous chunks that still have
+    to be judged by the LLM; every other candidate is dropped.
+    """
+
+    def rerank(
+            self,
+            query_vectors: List[Union[np.array, List[float]]],
+            retrieved_results: List[RetrievalResult]
+    ) -> Tuple[List[RetrievalResult], List[RetrievalResult]]:
+        """
+        Score the retrieved results against the query vectors
+        :param query_vectors: embeddings of the query and its sub-queries
+        :param retrieved_results: the candidates returned by the vector db
+        :return: A tuple containing:
+            - the results accepted without an LLM call
+            - the ambiguous results that should be judged by the LLM
+        """
+        pass
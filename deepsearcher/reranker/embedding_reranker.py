@@ -0,0 +1,98 @@
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from deepsearcher.reranker.base import BaseReranker
+from deepsearcher.vector_db.base import RetrievalResult
+
+
+class EmbeddingSimilarityReranker(BaseReranker):
+    """
+    Rerank candidates by the cosine similarity between their stored embedding and the
+    query vectors, computed in one vectorised NumPy pass.
+
+    A candidate's score is its best similarity over all query vectors, i.e. the original
+    question and its sub-queries. Cosine scores depend on the embedding model, so the default
+    cutoffs are relative: the `accept_top_k` best candidates within `accept_margin` of the best
+    one are accepted without an LLM call, candidates outside the `top_n` best or more than
+    `reject_margin` below the best one are dropped, and the rest are left for the LLM to judge.
+    The absolute `accept_threshold` and `reject_threshold` are off by default and should only be
+    set after looking at the score distribution of the model in use.
+    Candidates without an embedding are always treated as ambiguous.
+    """
+
+    def __init__(
+            self,
+            accept_threshold: Optional[float] = None,
+            reject_threshold: Optional[float] = None,
+            reject_margin: Optional[float] = 0.1,
+            top_n: Optional[int] = 10,
+            accept_top_k: int = 2,
+            accept_margin: float = 0.02,
+    ):
+        """
+        Initialize the reranker
+        :param accept_threshold: minimum cosine similarity to accept a chunk without the LLM, None to
+                                 only accept chunks by rank
+        :param reject_threshold: cosine similarity under which a chunk is dropped, None to disable
+        :param reject_margin: drop chunks scoring more than this below the best chunk, None to disable
+        :param top_n: maximum number of chunks kept per call, None to keep all of them
+        :param accept_top_k: number of best chunks accepted without the LLM when they score within
+                             `accept_margin` of the best chunk, 0 to disable
+        :param accept_margin: see `accept_top_k`
+        """
+        if accept_threshold is not None and reject_threshold is not None and reject_threshold > accept_threshold:
+            raise ValueError("reject_threshold must not be greater than accept_threshold")
+        self.accept_threshold = accept_threshold
+        self.reject_threshold = reject_threshold
+        self.reject_margin = reject_margin
+        self.top_n = top_n
+        self.accept_top_k = accept_top_k
+        self.accept_margin = accept_margin
+
+    def rerank(
+            self,
+            query_vectors: List[Union[np.array, List[float]]],
+            retrieved_results: List[RetrievalResult]
+    ) -> Tuple[List[RetrievalResult], List[RetrievalResult]]:
+        scored_results = [
+            result for result in retrieved_results
+            if result.embedding is not None and len(result.embedding) > 0
+        ]
+        ambiguous = [
+            result for result in retrieved_results
+            if result.embedding is None or len(result.embedding) == 0
+        ]
+        if not scored_results or len(query_vectors) == 0:
+            return [], ambiguous + scored_results
+
+        queries = np.array(query_vectors, dtype=np.float32)
+        docs = np.array([result.embedding for result in scored_results], dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        docs /= np.maximum(np.linalg.norm(docs, axis=1, keepdims=True), 1e-12)
+        scores = (docs @ queries.T).max(axis=1)
+
+        order = np.argsort(-scores, kind="stable")
+        if self.top_n is not None:
+            order = order[: self.top_n]
+        if len(order) == 0:
+            return [], ambiguous
+
+        best = float(scores[order[0]])
+        reject_below = -np.inf
+        if self.reject_threshold is not None:
+            reject_below = self.reject_threshold
+        if self.reject_margin is not None:
+            reject_below = max(reject_below, best - self.reject_margin)
+        accepted = []
+        for rank, idx in enumerate(order):
+            score = float(scores[idx])
+            result = scored_results[idx]
+            result.rerank_score = score
+            if rank < self.accept_top_k and score >= best - self.accept_margin and score >= reject_below:
+                accepted.append(result)
+            elif self.accept_threshold is not None and score >= self.accept_threshold:
+                accepted.append(result)
+            elif score >= reject_below:
+                ambiguous.append(result)
+        return accepted, ambiguous
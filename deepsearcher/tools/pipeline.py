@@ -0,0 +1,112 @@
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, List
+
+_SENTINEL = object()
+
+
+class _PipelineStopped(Exception):
+    """
+    Raised inside a stage when another stage failed and the pipeline is shutting down.
+    """
+
+
+def _put(q: queue.Queue, item, stop_event: threading.Event) -> bool:
+    """
+    Put an item on a bounded queue, giving up if the pipeline has been stopped.
+
+    Returns:
+        True if the item was queued, False if the pipeline was stopped.
+    """
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _iter_queue(q: queue.Queue, stop_event: threading.Event) -> Iterator:
+    """
+    Yield items from a queue until the upstream stage finishes.
+
+    Raises:
+        _PipelineStopped: If the pipeline is stopped before the upstream stage finishes.
+    """
+    while True:
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            if stop_event.is_set():
+                raise _PipelineStopped()
+            continue
+        if item is _SENTINEL:
+            return
+        yield item
+
+
+def _run_stage(
+        stage: Callable[[Iterable], Iterable],
+        inputs: Iterable,
+        out_queue: queue.Queue,
+        stop_event: threading.Event,
+        errors: List[BaseException]
+):
+    try:
+        for item in stage(inputs):
+            if not _put(out_queue, item, stop_event):
+                return
+        _put(out_queue, _SENTINEL, stop_event)
+    except _PipelineStopped:
+        pass
+    except BaseException as e:
+        errors.append(e)
+        stop_event.set()
+
+
+def run_pipeline(
+        source: Iterable,
+        stages: List[Callable[[Iterable], Iterable]],
+        queue_size: int = 4
+) -> Iterator:
+    """
+    Run a chain of generator stages concurrently, each in its own thread.
+
+    Every stage is a function that takes an iterable of inputs and yields outputs. Stages are
+    connected by bounded queues, so at most `queue_size` items wait between two stages and
+    memory stays bounded however large the source is. The outputs of the last stage are
+    yielded in the calling thread. If any stage raises, the whole pipeline stops and the
+    exception is re-raised to the caller.
+
+    Args:
+        source: The items fed to the first stage.
+        stages: The stage functions, in order.
+        queue_size: The maximum number of items buffered between two stages.
+
+    Yields:
+        The outputs of the last stage.
+    """
+    stop_event = threading.Event()
+    errors: List[BaseException] = []
+    threads = []
+    inputs = source
+    for stage in stages:
+        out_queue = queue.Queue(maxsize=queue_size)
+        thread = threading.Thread(
+            target=_run_stage, args=(stage, inputs, out_queue, stop_event, errors), daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+        inputs = _iter_queue(out_queue, stop_event)
+    try:
+        for item in inputs:
+            yield item
+    except _PipelineStopped:
+        pass
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
@@ -1,7 +1,25 @@
 from abc import ABC, abstractmethod
+import operator
+import threading
+import time
 import numpy as np
-from typing import List, Union
+from typing import List, Optional, Tuple, Union
 from deepsearcher.loader.splitter import Chunk
+from deepsearcher.tools import log
+from deepsearcher.vector_db.lexical_index import LexicalIndex
+
+DEFAULT_OUTPUT_FIELDS = ["text", "reference", "metadata"]
+# scalar metadata extracted at ingest time that backends can index for filtered search
+FILTER_FIELDS = ["ticker", "fiscal_period", "filing_type", "filing_date"]
+# metadata kept in the lexical index: enough to filter hits and hydrate their window from the document store
+LEXICAL_METADATA_FIELDS = FILTER_FIELDS + ["doc_id", "window_start", "window_end"]
+_COMPARISONS = {
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
 
 class RetrievalResult:
     """
@@ -16,6 +34,8 @@ class RetrievalResult:
         reference: A reference to the source of the document.
         metadata: Additional metadata associated with the document.
         score: The similarity score of the document to the query.
+        rerank_score: The relevance score assigned by a reranker, if any.
+        collection: The collection the document was retrieved from, if known.
     """
 
     def __init__(
@@ -25,6 +45,8 @@ class RetrievalResult:
             reference: str,
             metadata: dict,
             score: float = 0.0,
+            rerank_score: Optional[float] = None,
+            collection: Optional[str] = None,
     ):
         """
         Initialize a RetrievalResult object.
@@ -35,12 +57,16 @@ class RetrievalResult:
             reference: A reference to the source of the document.
             metadata: Additional metadata associated with the document.
             score: The similarity score of the document to the query. Defaults to 0.0.
+            rerank_score: The relevance score assigned by a reranker. Defaults to None.
+            collection: The collection the document was retrieved from. Defaults to None.
         """
         self.embedding = embedding
         self.text = text
         self.reference = reference
         self.metadata = metadata
         self.score: float = score
+        self.rerank_score: Optional[float] = rerank_score
+        self.collection: Optional[str] = collection
 
     def __repr__(self):
         """
@@ -86,6 +112,34 @@ class BaseVectorDB:
             **kwargs):
 
         self.default_collections = default_collection
+        self.default_search_params = kwargs.get("search_params") or {}
+        self.search_presets = kwargs.get("search_presets") or {}
+        lexical_index_path = kwargs.get("lexical_index_path")
+        self.lexical_index: Optional[LexicalIndex] = (
+            LexicalIndex(lexical_index_path, metadata_fields=LEXICAL_METADATA_FIELDS) if lexical_index_path else None
+        )
+        # seconds a cached collection catalog is trusted, as a fallback for changes made by other processes
+        catalog_ttl = kwargs.get("catalog_ttl")
+        self.catalog_ttl: float = 300.0 if catalog_ttl is None else catalog_ttl
+        self._catalog: Optional[List[Tuple[CollectionInfo, int]]] = None
+        self._catalog_loaded_at = 0.0
+        self._catalog_lock = threading.Lock()
+
+    def resolve_search_params(self, search_params: Optional[dict] = None, search_preset: Optional[str] = None) -> dict:
+        """
+        Resolve the query-time search params: explicit `search_params` win over the named
+        `search_preset`, which wins over the default search params of the db.
+        :param search_params: explicit search params for this query
+        :param search_preset: name of a preset from the `search_presets` config, e.g. "fast" or "accurate"
+        :return:
+        """
+        if search_params is not None:
+            return search_params
+        if search_preset is not None:
+            if search_preset in self.search_presets:
+                return self.search_presets[search_preset]
+            log.warning(f"Unknown search preset '{search_preset}', using the default search params")
+        return self.default_search_params
 
     @abstractmethod
     def init_collection(
@@ -130,21 +184,172 @@ class BaseVectorDB:
 
     @abstractmethod
     def search_data(
-            self, collection: str, vector: Union[np.array, List[float]], *args, **kwargs
+            self,
+            collection: str,
+            vector: Union[np.array, List[float]],
+            output_fields: Optional[List[str]] = None,
+            *args,
+            **kwargs
     ) -> List[RetrievalResult]:
         """
         Search for similar vectors in a collection
         :param collection:
         :param vector:
+        :param output_fields: the fields returned for every hit, `DEFAULT_OUTPUT_FIELDS` if None.
+                              Add "embedding" to get the stored vectors back as float32 arrays
+        :param args:
+        :param kwargs: backends accept `search_params` and `search_preset`, see `resolve_search_params`,
+                       and `filters`, a dict restricting the search to chunks whose metadata match,
+                       see `matches_filters`
+        :return:
+        """
+        pass
+
+    def search_batch(
+            self,
+            collection: str,
+            vectors: List[Union[np.array, List[float]]],
+            top_k: int = 5,
+            output_fields: Optional[List[str]] = None,
+            *args,
+            **kwargs
+    ) -> List[List[RetrievalResult]]:
+        """
+        Search for similar vectors of several queries in a collection.
+        Backends that can search many vectors in one request should override this;
+        the default issues one `search_data` call per vector.
+        :param collection:
+        :param vectors: the query vectors
+        :param top_k:
+        :param output_fields: see `search_data`
+        :param args:
+        :param kwargs:
+        :return: one list of results per query vector, in input order
+        """
+        return [
+            self.search_data(collection, vector, top_k=top_k, output_fields=output_fields, *args, **kwargs)
+            for vector in vectors
+        ]
+
+    def search_lexical(
+            self,
+            collection: str,
+            query_texts: List[str],
+            top_k: int = 5,
+            filters: Optional[dict] = None,
+    ) -> List[List[RetrievalResult]]:
+        """
+        Search the lexical (BM25) index of a collection with several query texts.
+        Returns empty results if the db was created without a `lexical_index_path`.
+        :param collection:
+        :param query_texts:
+        :param top_k:
+        :param filters: see `matches_filters`
+        :return: one list of results per query text, in input order, with the BM25 score as `score`
+        """
+        if self.lexical_index is None:
+            return [[] for _ in query_texts]
+        predicate = (lambda metadata: matches_filters(metadata, filters)) if filters else None
+        return [
+            [
+                RetrievalResult(embedding=None, text=hit["text"], reference=hit["reference"],
+                                metadata=hit["metadata"], score=hit["score"], collection=collection)
+                for hit in self.lexical_index.search(collection, query_text, top_k=top_k, predicate=predicate)
+            ]
+            for query_text in query_texts
+        ]
+
+    def search_hybrid(
+            self,
+            collection: str,
+            vectors: List[Union[np.array, List[float]]],
+            query_texts: List[str],
+            top_k: int = 5,
+            output_fields: Optional[List[str]] = None,
+            rrf_k: int = 60,
+            candidate_multiplier: int = 2,
+            *args,
+            **kwargs
+    ) -> List[List[RetrievalResult]]:
+        """
+        Search several queries with both the dense index and the lexical (BM25) index and fuse
+        the two rankings of every query with reciprocal-rank fusion. Falls back to dense search
+        if the db was created without a `lexical_index_path`.
+        :param collection:
+        :param vectors: the query vectors
+        :param query_texts: the query texts, aligned with `vectors`
+        :param top_k: number of fused results per query
+        :param output_fields: see `search_data`. Results found only by the lexical index carry no embedding
+        :param rrf_k: the RRF constant, larger values flatten the contribution of the top ranks
+        :param candidate_multiplier: each ranking contributes `top_k * candidate_multiplier` candidates
+        :param kwargs: forwarded to `search_batch`; dict `filters` also restrict the lexical search
+        :return: one list of results per query, in input order, with the fused score as `score`
+        """
+        if self.lexical_index is None:
+            log.warning("Hybrid search requested but no lexical index is configured, using dense search only")
+            return self.search_batch(collection, vectors, top_k=top_k, output_fields=output_fields, *args, **kwargs)
+        filters = kwargs.get("filters")
+        if isinstance(filters, str):
+            log.warning("The lexical index only supports dict filters, using dense search only")
+            return self.search_batch(collection, vectors, top_k=top_k, output_fields=output_fields, *args, **kwargs)
+        candidate_k = top_k * candidate_multiplier
+        dense_results = self.search_batch(
+            collection, vectors, top_k=candidate_k, output_fields=output_fields, *args, **kwargs
+        )
+        lexical_results = self.search_lexical(collection, query_texts, top_k=candidate_k, filters=filters)
+        return [
+            reciprocal_rank_fusion([dense, lexical], k=rrf_k, top_k=top_k)
+            for dense, lexical in zip(dense_results, lexical_results)
+        ]
+
+    @abstractmethod
+    def delete_data(self, collection: str, reference: str, *args, **kwargs):
+        """
+        Delete all the chunks of a collection that come from the given reference
+        :param collection:
+        :param reference:
         :param args:
         :param kwargs:
         :return:
         """
         pass
 
-    def list_collections(selfself, *args, **kwargs) -> List[CollectionInfo]:
+    @abstractmethod
+    def _load_catalog(self) -> List[Tuple[CollectionInfo, int]]:
+        """
+        Read every collection of the db with its description and embedding dimension.
+        Backends implement this instead of `list_collections`, which serves it from a cache.
+        :return: (collection info, dimension) pairs
+        """
         pass
 
+    def invalidate_catalog(self):
+        """
+        Drop the cached collection catalog, so that the next `list_collections` reads it again.
+        Backends call this whenever they create or drop a collection.
+        """
+        with self._catalog_lock:
+            self._catalog = None
+
+    def list_collections(self, *args, **kwargs) -> List[CollectionInfo]:
+        """
+        List the collections of the db from the cached catalog, reading it again when it has
+        been invalidated or is older than `catalog_ttl` seconds
+        :param args:
+        :param kwargs: `dim` to only list the collections of that embedding dimension
+        :return:
+        """
+        dim = kwargs.pop("dim", 0)
+        with self._catalog_lock:
+            if self._catalog is None or time.monotonic() - self._catalog_loaded_at > self.catalog_ttl:
+                self._catalog = self._load_catalog()
+                self._catalog_loaded_at = time.monotonic()
+            catalog = self._catalog
+        return [
+            collection_info for collection_info, collection_dim in catalog
+            if dim == 0 or collection_dim == dim
+        ]
+
     @abstractmethod
     def clear_db(self, *args, **kwargs):
         pass
@@ -177,3 +382,75 @@ def deduplicate_results(results: List[RetrievalResult]) -> List[RetrievalResult]
             all_text_set.add(result.text)
             deduplicated_results.append(result)
     return deduplicated_results
+
+
+def matches_filters(metadata: dict, filters: Optional[dict]) -> bool:
+    """
+    Check the metadata of a chunk against a filter dict.
+
+    Every key of `filters` names a metadata field, usually one of `FILTER_FIELDS`, and all of
+    them must match. A value can be a scalar, matched for equality; a list, matched if the field
+    equals any of its items; or a dict of comparisons among "gt", "gte", "lt" and "lte", e.g.
+    {"filing_date": {"gte": "2023-01-01"}}.
+
+    Args:
+        metadata: The metadata of the chunk.
+        filters: The filter dict, None or empty to match everything.
+
+    Returns:
+        True if the chunk matches every filter.
+    """
+    if not filters:
+        return True
+    for field, condition in filters.items():
+        value = metadata.get(field)
+        if isinstance(condition, dict):
+            if value is None:
+                return False
+            for op, bound in condition.items():
+                if op not in _COMPARISONS:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+                if not _COMPARISONS[op](value, bound):
+                    return False
+        elif isinstance(condition, (list, tuple, set)):
+            if value not in condition:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def reciprocal_rank_fusion(
+        result_lists: List[List[RetrievalResult]],
+        k: int = 60,
+        top_k: Optional[int] = None,
+) -> List[RetrievalResult]:
+    """
+    Fuse several rankings of the same collection with reciprocal-rank fusion.
+
+    Every result scores the sum of 1 / (k + rank) over the rankings it appears in, so chunks
+    ranked well by several retrievers come first without having to calibrate their raw scores
+    against each other. Results are identified by their reference and text; the first ranking
+    that contains a result provides the object that is returned.
+
+    Args:
+        result_lists: The rankings to fuse, each sorted best first.
+        k: The RRF constant. Defaults to 60.
+        top_k: The number of fused results to return, all of them if None.
+
+    Returns:
+        The fused results, best first, with the fused score as `score`.
+    """
+    fused = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            key = (result.reference, result.text)
+            if key not in fused:
+                fused[key] = [result, 0.0]
+            fused[key][1] += 1.0 / (k + rank)
+    ranked = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)
+    if top_k is not None:
+        ranked = ranked[:top_k]
+    for result, score in ranked:
+        result.score = score
+    return [result for result, _ in ranked]
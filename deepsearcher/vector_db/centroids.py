@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+
+class CentroidStore:
+    """
+    Running mean of the chunk embeddings of every collection, maintained at ingest time.
+
+    Centroids summarise what a collection actually contains, which complements its free-text
+    description when queries are routed to collections. They are stored as the sum and count
+    of the inserted embeddings in a JSON file. Chunks deleted by an incremental re-ingest are
+    not subtracted, so a centroid is an approximation until its collection is rebuilt.
+
+    Attributes:
+        version: Incremented on every change, so that consumers know when to refresh.
+    """
+
+    def __init__(self, path: str):
+        """
+        Load the centroids stored at `path`, or start empty
+        :param path: path of the JSON file
+        """
+        self.path = path
+        self.version = 0
+        self._lock = threading.Lock()
+        self._sums = {}
+        self._counts = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                data = json.load(file)
+            for collection, entry in data.get("collections", {}).items():
+                self._sums[collection] = np.asarray(entry["sum"], dtype=np.float64)
+                self._counts[collection] = entry["count"]
+
+    def update(self, collection: str, embeddings: List[List[float]]):
+        """
+        Add the embeddings of newly inserted chunks to the centroid of a collection
+        :param collection:
+        :param embeddings:
+        """
+        if len(embeddings) == 0:
+            return
+        batch = np.asarray(embeddings, dtype=np.float64)
+        with self._lock:
+            if collection in self._sums and self._sums[collection].shape[0] == batch.shape[1]:
+                self._sums[collection] += batch.sum(axis=0)
+                self._counts[collection] += len(batch)
+            else:
+                self._sums[collection] = batch.sum(axis=0)
+                self._counts[collection] = len(batch)
+            self.version += 1
+
+    def get(self, collection: str) -> Optional[np.ndarray]:
+        """
+        Return the centroid of a collection as a float32 vector, or None if nothing was ingested into it
+        :param collection:
+        """
+        with self._lock:
+            if collection not in self._sums or self._counts[collection] == 0:
+                return None
+            return (self._sums[collection] / self._counts[collection]).astype(np.float32)
+
+    def remove(self, collection: str):
+        """
+        Forget the centroid of a collection, e.g. when it is dropped and rebuilt
+        :param collection:
+        """
+        with self._lock:
+            if self._sums.pop(collection, None) is not None:
+                self._counts.pop(collection, None)
+                self.version += 1
+
+    def save(self):
+        """
+        Atomically write the centroids to disk
+        """
+        with self._lock:
+            data = {
+                "collections": {
+                    collection: {"sum": self._sums[collection].tolist(), "count": self._counts[collection]}
+                    for collection in self._sums
+                }
+            }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, self.path)
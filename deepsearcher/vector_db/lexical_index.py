@@ -0,0 +1,212 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Callable, List, Optional
+
+from deepsearcher.loader.splitter import Chunk
+
+# keeps tickers, fiscal periods and filing types such as "nvda", "2023q4", "10-k" or "ebitda" as single tokens
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/&][a-z0-9]+)*")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase lexical tokens, dropping common English stopwords
+    """
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    Sparse lexical index of chunk texts scored with BM25, stored in SQLite.
+
+    It complements dense search for exact tokens such as tickers, metric names and fiscal
+    periods. Every collection of the vector db has its own postings in the same file, and a
+    slim chunk payload is stored alongside so that lexical hits can be returned without a round
+    trip to the vector db: the chunk text and reference, and only the metadata fields needed to
+    filter hits and locate their window in the document store. The `wider_text` window is only
+    stored for chunks ingested without a document store, which have nowhere else to read it from.
+    """
+
+    def __init__(
+            self, path: str, k1: float = 1.5, b: float = 0.75, metadata_fields: Optional[List[str]] = None
+    ):
+        """
+        Open (or create) the lexical index
+        :param path: path of the SQLite file
+        :param k1: BM25 term frequency saturation
+        :param b: BM25 length normalisation
+        :param metadata_fields: the chunk metadata fields stored with the postings, None to store none
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.metadata_fields = list(metadata_fields or [])
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                collection TEXT NOT NULL,
+                text TEXT NOT NULL,
+                reference TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_collection_reference ON chunks (collection, reference);
+            CREATE TABLE IF NOT EXISTS postings (
+                collection TEXT NOT NULL,
+                term TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_postings_term ON postings (collection, term);
+            CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings (chunk_id);
+            CREATE TABLE IF NOT EXISTS stats (
+                collection TEXT PRIMARY KEY,
+                n_docs INTEGER NOT NULL,
+                total_length INTEGER NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def _update_stats(self, collection: str, n_docs: int, total_length: int):
+        self._conn.execute(
+            "INSERT INTO stats (collection, n_docs, total_length) VALUES (?, ?, ?) "
+            "ON CONFLICT(collection) DO UPDATE SET n_docs = n_docs + excluded.n_docs, "
+            "total_length = total_length + excluded.total_length",
+            (collection, n_docs, total_length),
+        )
+
+    def add(self, collection: str, chunks: List[Chunk]):
+        """
+        Index the texts of the given chunks
+        :param collection:
+        :param chunks:
+        """
+        with self._lock:
+            total_length = 0
+            for chunk in chunks:
+                term_counts = Counter(tokenize(chunk.text))
+                length = sum(term_counts.values())
+                total_length += length
+                metadata = {
+                    field: chunk.metadata[field] for field in self.metadata_fields if field in chunk.metadata
+                }
+                if "wider_text" in chunk.metadata and "doc_id" not in chunk.metadata:
+                    metadata["wider_text"] = chunk.metadata["wider_text"]
+                cursor = self._conn.execute(
+                    "INSERT INTO chunks (collection, text, reference, metadata, length) VALUES (?, ?, ?, ?, ?)",
+                    (collection, chunk.text, chunk.reference, json.dumps(metadata), length),
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings (collection, term, chunk_id, tf) VALUES (?, ?, ?, ?)",
+                    [(collection, term, cursor.lastrowid, tf) for term, tf in term_counts.items()],
+                )
+            self._update_stats(collection, len(chunks), total_length)
+            self._conn.commit()
+
+    def delete_reference(self, collection: str, reference: str):
+        """
+        Remove the chunks of a collection that come from the given reference
+        :param collection:
+        :param reference:
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, length FROM chunks WHERE collection = ? AND reference = ?", (collection, reference)
+            ).fetchall()
+            if not rows:
+                return
+            chunk_ids = [(row[0],) for row in rows]
+            self._conn.executemany("DELETE FROM postings WHERE chunk_id = ?", chunk_ids)
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", chunk_ids)
+            self._update_stats(collection, -len(rows), -sum(row[1] for row in rows))
+            self._conn.commit()
+
+    def drop_collection(self, collection: str):
+        """
+        Remove everything indexed for a collection
+        :param collection:
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM postings WHERE collection = ?", (collection,))
+            self._conn.execute("DELETE FROM chunks WHERE collection = ?", (collection,))
+            self._conn.execute("DELETE FROM stats WHERE collection = ?", (collection,))
+            self._conn.commit()
+
+    def search(
+            self,
+            collection: str,
+            query: str,
+            top_k: int = 5,
+            predicate: Optional[Callable[[dict], bool]] = None
+    ) -> List[dict]:
+        """
+        Return the chunks of a collection with the best BM25 score for the query
+        :param collection:
+        :param query:
+        :param top_k:
+        :param predicate: if set, only chunks whose metadata satisfy it are returned
+        :return: the hits, best first, as dicts with "text", "reference", "metadata" and "score"
+        """
+        terms = list(set(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            stats = self._conn.execute(
+                "SELECT n_docs, total_length FROM stats WHERE collection = ?", (collection,)
+            ).fetchone()
+            if stats is None or stats[0] <= 0:
+                return []
+            n_docs, total_length = stats
+            rows = self._conn.execute(
+                f"SELECT p.term, p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.chunk_id "
+                f"WHERE p.collection = ? AND p.term IN ({','.join('?' * len(terms))})",
+                [collection] + terms,
+            ).fetchall()
+            if not rows:
+                return []
+            avg_length = max(total_length / n_docs, 1e-9)
+            document_frequency = Counter(row[0] for row in rows)
+            scores = Counter()
+            for term, chunk_id, tf, length in rows:
+                df = document_frequency[term]
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (
+                    tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                )
+            ranked = scores.most_common() if predicate is not None else scores.most_common(top_k)
+            hits = []
+            # with a predicate, read the payloads page by page until enough of them match
+            page_size = max(top_k, 1) * 4
+            for i in range(0, len(ranked), page_size):
+                page = ranked[i: i + page_size]
+                chunk_rows = self._conn.execute(
+                    f"SELECT id, text, reference, metadata FROM chunks WHERE id IN ({','.join('?' * len(page))})",
+                    [chunk_id for chunk_id, _ in page],
+                ).fetchall()
+                payloads = {row[0]: row[1:] for row in chunk_rows}
+                for chunk_id, score in page:
+                    if chunk_id not in payloads:
+                        continue
+                    text, reference, metadata = payloads[chunk_id]
+                    metadata = json.loads(metadata)
+                    if predicate is not None and not predicate(metadata):
+                        continue
+                    hits.append({"text": text, "reference": reference, "metadata": metadata, "score": score})
+                    if len(hits) >= top_k:
+                        return hits
+        return hits
@@ -1,11 +1,17 @@
-from typing import List, Optional, Union
+import json
+from typing import List, Optional, Tuple, Union
 
 import numpy as np
 from deepsearcher.tools import log
 from pymilvus import DataType, MilvusClient
 
 from deepsearcher.loader.splitter import Chunk
-from deepsearcher.vector_db.base import BaseVectorDB, RetrievalResult, CollectionInfo
+from deepsearcher.vector_db.base import (
+    BaseVectorDB, RetrievalResult, CollectionInfo, DEFAULT_OUTPUT_FIELDS, FILTER_FIELDS
+)
+
+_FILTER_FIELD_MAX_LENGTH = 64
+_COMPARISON_OPERATORS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
 
 
 class Milvus(BaseVectorDB):
@@ -19,6 +25,13 @@ class Milvus(BaseVectorDB):
             uri: str = "http://localhost:19530",
             token: str = "root:Milvus",
             db: str = "default",
+            metric_type: str = "L2",
+            index_type: str = "AUTOINDEX",
+            index_params: Optional[dict] = None,
+            search_params: Optional[dict] = None,
+            search_presets: Optional[dict] = None,
+            lexical_index_path: Optional[str] = None,
+            catalog_ttl: float = 300.0,
     ):
         """
         Initializes the milvus client
@@ -26,9 +39,38 @@ class Milvus(BaseVectorDB):
         :param uri:
         :param token:
         :param db:
+        :param metric_type: metric of the embedding index of new collections
+        :param index_type: ANN index type of new collections, e.g. "HNSW", "IVF_FLAT", "IVF_PQ";
+                           always "AUTOINDEX" for a Milvus Lite database file
+        :param index_params: build params of the index, e.g. {"M": 16, "efConstruction": 200} for HNSW
+                             or {"nlist": 1024} for IVF indexes
+        :param search_params: default query-time params, e.g. {"ef": 64} or {"nprobe": 16}
+        :param search_presets: named query-time params selectable per call, e.g.
+                               {"fast": {"nprobe": 8}, "accurate": {"nprobe": 64}}
+        :param lexical_index_path: path of the SQLite BM25 index kept next to the collections,
+                                   required for hybrid search
+        :param catalog_ttl: seconds the cached list of collections and their descriptions is
+                            trusted before it is read again
         """
-        super().__init__(default_collection)
+        super().__init__(
+            default_collection,
+            search_params=search_params,
+            search_presets=search_presets,
+            lexical_index_path=lexical_index_path,
+            catalog_ttl=catalog_ttl,
+        )
         self.default_collection = default_collection
+        self.metric_type = metric_type
+        # a local database file is served by Milvus Lite, which only builds its default index
+        self.is_lite = uri.endswith(".db")
+        if self.is_lite and index_type != "AUTOINDEX":
+            log.warning(f"Milvus Lite ({uri}) does not support index type {index_type}, using AUTOINDEX")
+            index_type, index_params = "AUTOINDEX", None
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        # whether each collection has the typed filter fields, collections created before
+        # they were introduced are filtered through their metadata JSON instead
+        self._typed_filter_fields = {}
         self.client = MilvusClient(uri=uri, token=token, db_name=db, timeout=30)
 
     def init_collection(
@@ -39,7 +81,7 @@ class Milvus(BaseVectorDB):
             force_new_collection: bool = False,
             text_max_length: int = 65_535,
             reference_max_length: int = 2048,
-            metric_type: str = "L2",
+            metric_type: Optional[str] = None,
             *args,
             **kwargs,
     ):
@@ -50,7 +92,11 @@ class Milvus(BaseVectorDB):
         try:
             has_collection = self.client.has_collection(collection, timeout=5)
             if force_new_collection and has_collection:
-                self.client_drop_collection(collection)
+                self.client.drop_collection(collection)
+                self._typed_filter_fields.pop(collection, None)
+                self.invalidate_catalog()
+                if self.lexical_index is not None:
+                    self.lexical_index.drop_collection(collection)
             elif has_collection:
                 return
 
@@ -62,16 +108,28 @@ class Milvus(BaseVectorDB):
             schema.add_field("text", DataType.VARCHAR, max_length=text_max_length)
             schema.add_field("reference", DataType.VARCHAR, max_length=reference_max_length)
             schema.add_field("metadata", DataType.JSON)
+            for field in FILTER_FIELDS:
+                schema.add_field(field, DataType.VARCHAR, max_length=_FILTER_FIELD_MAX_LENGTH)
             index_params = self.client.prepare_index_params()
-            index_params.add_index(field_name="embedding", metric_type=metric_type)
+            index_params.add_index(
+                field_name="embedding",
+                index_type=self.index_type,
+                metric_type=metric_type or self.metric_type,
+                params=self.index_params,
+            )
+            if not self.is_lite:
+                for field in FILTER_FIELDS:
+                    index_params.add_index(field_name=field, index_type="INVERTED")
             self.client.create_collection(
                 collection,
                 schema=schema,
                 index_params=index_params,
                 consistency_level="Strong",
             )
+            self._typed_filter_fields[collection] = True
+            self.invalidate_catalog()
         except Exception as e:
-            print(f"fail to init db for milvus, error info: {e}")
+            log.critical(f"fail to init db for milvus, error info: {e}")
 
     def insert_data(
             self,
@@ -108,18 +166,82 @@ class Milvus(BaseVectorDB):
                 embeddings, texts, references, metadatas
             )
         ]
+        if self._has_typed_filter_fields(collection):
+            for data in datas:
+                for field in FILTER_FIELDS:
+                    data[field] = str(data["metadata"].get(field) or "")[:_FILTER_FIELD_MAX_LENGTH]
         batch_datas = [datas[i: i + batch_size] for i in range(0, len(datas), batch_size)]
         try:
             for batch_data in batch_datas:
                 self.client.insert(collection_name=collection, data=batch_data)
+            if self.lexical_index is not None:
+                self.lexical_index.add(collection, chunks)
+        except Exception as e:
+            log.critical(f"fail to insert data, error info: {e}")
+
+    def _has_typed_filter_fields(self, collection: str) -> bool:
+        if collection not in self._typed_filter_fields:
+            try:
+                fields = {field["name"] for field in self.client.describe_collection(collection)["fields"]}
+            except Exception as e:
+                log.warning(f"fail to describe collection, error info: {e}")
+                return False
+            self._typed_filter_fields[collection] = all(field in fields for field in FILTER_FIELDS)
+        return self._typed_filter_fields[collection]
+
+    def filter_expression(self, collection: str, filters: Union[dict, str, None]) -> str:
+        """
+        Translate a filter dict (see `matches_filters`) into a Milvus boolean expression.
+        `FILTER_FIELDS` are matched on their indexed scalar fields when the collection has them,
+        other fields through the metadata JSON. Strings are taken as Milvus expressions as is.
+        :param collection:
+        :param filters:
+        :return: the expression, "" to search the whole collection
+        """
+        if not filters:
+            return ""
+        if isinstance(filters, str):
+            return filters
+        typed = self._has_typed_filter_fields(collection)
+        clauses = []
+        for field, condition in filters.items():
+            name = field if typed and field in FILTER_FIELDS else f"metadata[{json.dumps(field)}]"
+            if isinstance(condition, dict):
+                for op, bound in condition.items():
+                    if op not in _COMPARISON_OPERATORS:
+                        raise ValueError(f"Unsupported filter operator: {op}")
+                    clauses.append(f"{name} {_COMPARISON_OPERATORS[op]} {json.dumps(bound)}")
+            elif isinstance(condition, (list, tuple, set)):
+                clauses.append(f"{name} in {json.dumps(list(condition))}")
+            else:
+                clauses.append(f"{name} == {json.dumps(condition)}")
+        return " and ".join(clauses)
+
+    def delete_data(self, collection: Optional[str], reference: str, *args, **kwargs):
+        """
+        Delete all the chunks of a Milvus collection that come from the given reference
+        :param collection:
+        :param reference:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        if not collection:
+            collection = self.default_collection
+        escaped_reference = reference.replace("\\", "\\\\").replace('"', '\\"')
+        try:
+            self.client.delete(collection_name=collection, filter=f'reference == "{escaped_reference}"')
+            if self.lexical_index is not None:
+                self.lexical_index.delete_reference(collection, reference)
         except Exception as e:
-            print(f"fail to insert data, error info")
+            log.warning(f"fail to delete data, error info: {e}")
 
     def search_data(
             self,
             collection: Optional[str],
             vector: Union[np.array, List[float]],
             top_k: int = 5,
+            output_fields: Optional[List[str]] = None,
             *args,
             **kwargs
     ) -> List[RetrievalResult]:
@@ -129,70 +251,97 @@ class Milvus(BaseVectorDB):
         :param collection:
         :param vector:
         :param top_k:
-        :param kwargs:
+        :param output_fields: the fields returned for every hit, `DEFAULT_OUTPUT_FIELDS` if None.
+                              Embeddings are only shipped back when "embedding" is requested
+        :param kwargs: `search_params` or `search_preset` to tune recall against latency, and
+                       `filters` to prune the search space before the ANN search, either a dict
+                       (see `filter_expression`) or a Milvus boolean expression
         :return:
         """
+        return self.search_batch(collection, [vector], top_k=top_k, output_fields=output_fields, **kwargs)[0]
+
+    def search_batch(
+            self,
+            collection: Optional[str],
+            vectors: List[Union[np.array, List[float]]],
+            top_k: int = 5,
+            output_fields: Optional[List[str]] = None,
+            *args,
+            **kwargs
+    ) -> List[List[RetrievalResult]]:
+        """
+        Search for similar vectors of several queries in a Milvus collection with a single request
+        :param collection:
+        :param vectors:
+        :param top_k:
+        :param output_fields: see `search_data`
+        :param kwargs: `search_params`, `search_preset` or `filters`, see `search_data`
+        :return: one list of results per query vector, in input order
+        """
         if not collection:
             collection = self.default_collection
+        if output_fields is None:
+            output_fields = DEFAULT_OUTPUT_FIELDS
+        if len(vectors) == 0:
+            return []
+        params = self.resolve_search_params(kwargs.get("search_params"), kwargs.get("search_preset"))
         try:
             search_results = self.client.search(
                 collection_name=collection,
-                data=[vector],
+                data=list(vectors),
+                filter=self.filter_expression(collection, kwargs.get("filters")),
                 limit=top_k,
-                output_fields=["embedding", "text", "reference", "metadata"],
+                output_fields=output_fields,
+                search_params={"params": params},
                 timeout=10
             )
-            return [
-                RetrievalResult(
-                    embedding=b["entity"]["embedding"],
-                    text=b["entity"]["text"],
-                    reference=b["entity"]["reference"],
-                    score=b["distance"],
-                    metadata=b["entity"]["metadata"]
-                )
-                for a in search_results
-                for b in a
-            ]
+            return [[self._to_retrieval_result(b, collection) for b in a] for a in search_results]
         except Exception as e:
-            log.critical(f"dail to search data, error info: {e}")
-            return []
+            log.critical(f"fail to search data, error info: {e}")
+            return [[] for _ in vectors]
 
-    def list_collections(self, *args, **kwargs) -> List[CollectionInfo]:
+    @staticmethod
+    def _to_retrieval_result(hit: dict, collection: str) -> RetrievalResult:
+        entity = hit["entity"]
+        embedding = entity.get("embedding")
+        return RetrievalResult(
+            embedding=np.asarray(embedding, dtype=np.float32) if embedding is not None else None,
+            text=entity.get("text", ""),
+            reference=entity.get("reference", ""),
+            score=hit["distance"],
+            metadata=entity.get("metadata") or {},
+            collection=collection
+        )
 
+    def _load_catalog(self) -> List[Tuple[CollectionInfo, int]]:
         """
-        List all collections in the Milvus DB
-        :param args:
-        :param kwargs:
+        Describe every collection of the Milvus DB, see `BaseVectorDB.list_collections`
         :return:
         """
-        collection_infos = []
-        dim = kwargs.pop("dim", 0)
+        catalog = []
         try:
             collections = self.client.list_collections()
             for collection in collections:
                 description = self.client.describe_collection(collection)
-                if dim != 0:
-                    skip = False
-                    for field_dict in description["fields"]:
-                        if (
-                            field_dict["name"] == "embedding" and field_dict["type"] == DataType.FLOAT_VECTOR
-                        ):
-                            if field_dict["params"]["dim"] != dim:
-                                skip = True
-
-                    if skip:
-                        continue
-
-                collection_infos.append(
-                    CollectionInfo(
-                        collection_name=collection,
-                        description=description["description"]
+                dim = 0
+                for field_dict in description["fields"]:
+                    if field_dict["name"] == "embedding" and field_dict["type"] == DataType.FLOAT_VECTOR:
+                        dim = field_dict["params"]["dim"]
+                field_names = {field_dict["name"] for field_dict in description["fields"]}
+                self._typed_filter_fields[collection] = all(field in field_names for field in FILTER_FIELDS)
+                catalog.append(
+                    (
+                        CollectionInfo(
+                            collection_name=collection,
+                            description=description["description"]
+                        ),
+                        dim
                     )
                 )
         except Exception as e:
             log.critical(f"fail to list collections, error info: {e}")
 
-        return collection_infos
+        return catalog
 
     def clear_db(self, collection: str = "deepsearcher", *args, **kwargs):
         """
@@ -206,6 +355,10 @@ class Milvus(BaseVectorDB):
             collection = self.default_collection
         try:
             self.client.drop_collection(collection)
+            self._typed_filter_fields.pop(collection, None)
+            self.invalidate_catalog()
+            if self.lexical_index is not None:
+                self.lexical_index.drop_collection(collection)
         except Exception as e:
             log.warning(f"fail to clear db, error info: {e}")
 
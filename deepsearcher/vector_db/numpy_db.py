@@ -0,0 +1,537 @@
+import json
+import os
+import shutil
+import threading
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from deepsearcher.loader.splitter import Chunk
+from deepsearcher.tools import log
+from deepsearcher.vector_db.base import (
+    BaseVectorDB, CollectionInfo, DEFAULT_OUTPUT_FIELDS, RetrievalResult, matches_filters
+)
+
+_INFO_FILE = "info.json"
+_EMBEDDINGS_FILE = "embeddings.f32"
+_RECORDS_FILE = "records.jsonl"
+
+
+class _CollectionState:
+    """
+    In-memory view of one collection: its info, its records and a memory map of its embeddings.
+
+    A state is a snapshot: writes publish a new state instead of changing this one, so a search
+    can keep using the state it started with without holding the db lock. The memory map is
+    opened when the snapshot is taken, so it keeps the rows it knows about even after the files
+    are appended to or compacted.
+    """
+
+    def __init__(self, path: str, info: Optional[dict] = None, records: Optional[List[dict]] = None):
+        self.path = path
+        if info is None:
+            with open(os.path.join(path, _INFO_FILE), "r") as file:
+                info = json.load(file)
+        self.info = info
+        if records is None:
+            records = self._load_records(path, info["dim"])
+        self.records = records
+        if self.count == 0:
+            self._embeddings = np.zeros((0, self.dim), dtype=np.float32)
+        else:
+            self._embeddings = np.memmap(
+                os.path.join(path, _EMBEDDINGS_FILE), dtype=np.float32, mode="r", shape=(self.count, self.dim)
+            )
+        self._norms = None
+        self._columns = {}
+        self.ivf = None
+
+    @staticmethod
+    def _load_records(path: str, dim: int) -> List[dict]:
+        """
+        Read the records of a collection, repairing its files after an interrupted insert.
+        Inserts append the embeddings before the records, so the records file is authoritative:
+        a torn last record is dropped, and embeddings without a record are truncated.
+        """
+        records_path = os.path.join(path, _RECORDS_FILE)
+        records = []
+        lines = []
+        if os.path.exists(records_path):
+            with open(records_path, "r") as file:
+                lines = file.readlines()
+        torn = bool(lines) and not lines[-1].endswith("\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                torn = True
+                break
+        embeddings_path = os.path.join(path, _EMBEDDINGS_FILE)
+        row_bytes = dim * np.dtype(np.float32).itemsize
+        size = os.path.getsize(embeddings_path) if os.path.exists(embeddings_path) else 0
+        if size < len(records) * row_bytes:
+            records = records[: size // row_bytes]
+            torn = True
+        if torn:
+            log.warning(f"repair the records of '{path}' after an interrupted insert, {len(records)} kept")
+            with open(records_path, "w") as file:
+                for record in records:
+                    file.write(json.dumps(record) + "\n")
+        if size > len(records) * row_bytes:
+            log.warning(f"drop {size // row_bytes - len(records)} embedding(s) without a record in '{path}'")
+            with open(embeddings_path, "r+b") as file:
+                file.truncate(len(records) * row_bytes)
+        return records
+
+    @property
+    def dim(self) -> int:
+        return self.info["dim"]
+
+    @property
+    def count(self) -> int:
+        return len(self.records)
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._embeddings
+
+    @property
+    def norms(self) -> np.ndarray:
+        if self._norms is None:
+            self._norms = np.linalg.norm(self.embeddings, axis=1)
+        return self._norms
+
+    def column(self, field: str) -> np.ndarray:
+        """
+        Return the values of a metadata field for every row, None where it is missing
+        """
+        if field not in self._columns:
+            column = np.empty(self.count, dtype=object)
+            column[:] = [record["metadata"].get(field) for record in self.records]
+            self._columns[field] = column
+        return self._columns[field]
+
+
+class _IVFIndex:
+    """
+    Coarse quantiser: k-means centroids with one inverted list of row ids per centroid.
+    """
+
+    def __init__(self, embeddings: np.ndarray, nlist: int, n_iter: int = 10, sample_size: int = 256, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        n = embeddings.shape[0]
+        nlist = min(nlist, n)
+        sample_ids = rng.choice(n, size=min(n, nlist * sample_size), replace=False)
+        sample = np.asarray(embeddings[np.sort(sample_ids)], dtype=np.float32)
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assignments = self._assign(sample, centroids)
+            for c in range(nlist):
+                members = sample[assignments == c]
+                if len(members) > 0:
+                    centroids[c] = members.mean(axis=0)
+        self.centroids = centroids
+        assignments = np.concatenate(
+            [self._assign(np.asarray(embeddings[i: i + 65536]), centroids) for i in range(0, n, 65536)]
+        )
+        order = np.argsort(assignments, kind="stable")
+        boundaries = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        self.lists = [order[boundaries[c]: boundaries[c + 1]] for c in range(nlist)]
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (
+            np.sum(centroids ** 2, axis=1)[None, :] - 2 * vectors @ centroids.T
+        )
+        return np.argmin(distances, axis=1)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nearest = np.argsort(np.sum(self.centroids ** 2, axis=1) - 2 * self.centroids @ query)[:nprobe]
+        return np.sort(np.concatenate([self.lists[c] for c in nearest]))
+
+
+class NumpyVectorDB(BaseVectorDB):
+    """
+    In-process vector database backed by NumPy.
+
+    Every collection is a directory holding its embeddings as a memory-mapped float32 matrix,
+    its texts, references and metadata as a JSON-lines sidecar, and an info file. Search is an
+    exact brute-force top-k with `argpartition`; for larger collections an optional IVF coarse
+    quantiser restricts the scan to the `nprobe` closest clusters.
+    """
+
+    def __init__(
+            self,
+            default_collection: str = "deepsearcher",
+            path: str = "./numpy_db",
+            nlist: Optional[int] = None,
+            nprobe: int = 8,
+            ivf_min_size: int = 50_000,
+            search_params: Optional[dict] = None,
+            search_presets: Optional[dict] = None,
+            lexical_index_path: Optional[str] = None,
+            catalog_ttl: float = 300.0,
+            metric_type: str = "L2",
+            **kwargs
+    ):
+        """
+        Initializes the NumPy vector db
+        :param default_collection:
+        :param path: directory where the collections are stored
+        :param nlist: number of IVF clusters, None to always use exact search
+        :param nprobe: number of IVF clusters scanned per query
+        :param ivf_min_size: collections smaller than this are always searched exactly
+        :param search_params: default query-time params; {"nprobe": n} overrides `nprobe`
+        :param search_presets: named query-time params selectable per call, e.g.
+                               {"fast": {"nprobe": 4}, "accurate": {"nprobe": 32}}
+        :param lexical_index_path: path of the SQLite BM25 index kept next to the collections,
+                                   required for hybrid search
+        :param catalog_ttl: seconds the cached list of collections is trusted before it is read again
+        :param metric_type: metric of new collections, "L2", "IP" or "COSINE"
+        """
+        if metric_type not in ("L2", "IP", "COSINE"):
+            raise ValueError(f"NumpyVectorDB does not support metric_type '{metric_type}'")
+        super().__init__(
+            default_collection,
+            search_params=search_params,
+            search_presets=search_presets,
+            lexical_index_path=lexical_index_path,
+            catalog_ttl=catalog_ttl,
+        )
+        self.default_collection = default_collection
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ivf_min_size = ivf_min_size
+        self.metric_type = metric_type
+        self._collections = {}
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+    def _collection_path(self, collection: str) -> str:
+        return os.path.join(self.path, collection)
+
+    def _state(self, collection: str) -> Optional[_CollectionState]:
+        with self._lock:
+            if collection not in self._collections:
+                if not os.path.exists(os.path.join(self._collection_path(collection), _INFO_FILE)):
+                    return None
+                self._collections[collection] = _CollectionState(self._collection_path(collection))
+            return self._collections[collection]
+
+    def init_collection(
+            self,
+            dim: int,
+            collection: Optional[str] = "deepsearcher",
+            description: Optional[str] = "",
+            force_new_collection: bool = False,
+            metric_type: Optional[str] = None,
+            *args,
+            **kwargs,
+    ):
+        if not collection:
+            collection = self.default_collection
+        if description is None:
+            description = ""
+        metric_type = metric_type or self.metric_type
+        if metric_type not in ("L2", "IP", "COSINE"):
+            raise ValueError(f"NumpyVectorDB does not support metric_type '{metric_type}'")
+        with self._lock:
+            collection_path = self._collection_path(collection)
+            if os.path.exists(collection_path):
+                if not force_new_collection:
+                    return
+                self.clear_db(collection)
+            os.makedirs(collection_path)
+            with open(os.path.join(collection_path, _INFO_FILE), "w") as file:
+                json.dump({"dim": dim, "description": description, "metric_type": metric_type}, file)
+            self.invalidate_catalog()
+
+    def insert_data(
+            self,
+            collection: Optional[str],
+            chunks: List[Chunk],
+            *args,
+            **kwargs):
+        """
+        Append chunks to a collection
+        :param collection:
+        :param chunks:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        if not collection:
+            collection = self.default_collection
+        with self._lock:
+            state = self._state(collection)
+            if state is None:
+                log.critical(f"fail to insert data, collection '{collection}' does not exist")
+                return
+            embeddings = np.asarray([chunk.embedding for chunk in chunks], dtype=np.float32).reshape(-1, state.dim)
+            records = [
+                {"text": chunk.text, "reference": chunk.reference, "metadata": chunk.metadata}
+                for chunk in chunks
+            ]
+            lines = "".join(json.dumps(record) + "\n" for record in records)
+            # the records are the commit point: they are appended once the embeddings are on disk,
+            # and `_CollectionState` drops embeddings without a record on load
+            embeddings_path = os.path.join(state.path, _EMBEDDINGS_FILE)
+            records_path = os.path.join(state.path, _RECORDS_FILE)
+            embeddings_size = os.path.getsize(embeddings_path) if os.path.exists(embeddings_path) else 0
+            records_size = os.path.getsize(records_path) if os.path.exists(records_path) else 0
+            try:
+                with open(embeddings_path, "ab") as file:
+                    file.write(embeddings.tobytes())
+                    file.flush()
+                    os.fsync(file.fileno())
+                with open(records_path, "a") as file:
+                    file.write(lines)
+            except Exception:
+                # keep both files aligned for the next inserts of this process
+                for file_path, size in ((embeddings_path, embeddings_size), (records_path, records_size)):
+                    if os.path.exists(file_path):
+                        with open(file_path, "r+b") as file:
+                            file.truncate(size)
+                raise
+            self._collections[collection] = _CollectionState(state.path, state.info, state.records + records)
+            if self.lexical_index is not None:
+                self.lexical_index.add(collection, chunks)
+
+    def delete_data(self, collection: Optional[str], reference: str, *args, **kwargs):
+        """
+        Delete all the chunks of a collection that come from the given reference by compacting its files
+        :param collection:
+        :param reference:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        if not collection:
+            collection = self.default_collection
+        with self._lock:
+            if self.lexical_index is not None:
+                self.lexical_index.delete_reference(collection, reference)
+            state = self._state(collection)
+            if state is None:
+                return
+            keep = [i for i, record in enumerate(state.records) if record["reference"] != reference]
+            if len(keep) == state.count:
+                return
+            embeddings = np.array(state.embeddings[keep], dtype=np.float32)
+            records = [state.records[i] for i in keep]
+            self._write_files(state.path, embeddings, records)
+            self._collections[collection] = _CollectionState(state.path, state.info, records)
+
+    @staticmethod
+    def _write_files(path: str, embeddings: np.ndarray, records: List[dict]):
+        tmp_embeddings = os.path.join(path, _EMBEDDINGS_FILE + ".tmp")
+        tmp_records = os.path.join(path, _RECORDS_FILE + ".tmp")
+        with open(tmp_embeddings, "wb") as file:
+            file.write(embeddings.tobytes())
+        with open(tmp_records, "w") as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+        os.replace(tmp_embeddings, os.path.join(path, _EMBEDDINGS_FILE))
+        os.replace(tmp_records, os.path.join(path, _RECORDS_FILE))
+
+    def _scores(self, state: _CollectionState, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Score queries against the given rows (all rows if None). Higher is better for IP and
+        COSINE; for L2 the squared distance is returned and lower is better.
+        """
+        embeddings = state.embeddings if rows is None else state.embeddings[rows]
+        dot = queries @ np.asarray(embeddings).T
+        metric_type = state.info.get("metric_type", "L2")
+        if metric_type == "IP":
+            return dot
+        norms = state.norms if rows is None else state.norms[rows]
+        if metric_type == "COSINE":
+            query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            return dot / np.maximum(query_norms * norms[None, :], 1e-12)
+        return np.sum(queries ** 2, axis=1, keepdims=True) - 2 * dot + (norms ** 2)[None, :]
+
+    def _top_k(self, state: _CollectionState, scores: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Return the positions of the best `top_k` scores of a 1-d score array, best first
+        """
+        lower_is_better = state.info.get("metric_type", "L2") == "L2"
+        keys = scores if lower_is_better else -scores
+        if top_k < len(keys):
+            candidates = np.argpartition(keys, top_k)[:top_k]
+        else:
+            candidates = np.arange(len(keys))
+        return candidates[np.argsort(keys[candidates], kind="stable")]
+
+    @staticmethod
+    def _filter_mask(state: _CollectionState, filters: dict) -> np.ndarray:
+        """
+        Return the boolean mask of the rows whose metadata match the filters
+        """
+        mask = np.ones(state.count, dtype=bool)
+        for field, condition in filters.items():
+            column = state.column(field)
+            if isinstance(condition, dict):
+                mask &= np.fromiter(
+                    (matches_filters({field: value}, {field: condition}) for value in column),
+                    dtype=bool,
+                    count=state.count,
+                )
+            elif isinstance(condition, (list, tuple, set)):
+                mask &= np.isin(column, list(condition))
+            else:
+                mask &= column == condition
+        return mask
+
+    def _get_ivf(self, state: _CollectionState) -> Optional[_IVFIndex]:
+        if not self.nlist or state.count < self.ivf_min_size:
+            return None
+        with self._lock:
+            if state.ivf is None:
+                state.ivf = _IVFIndex(state.embeddings, self.nlist)
+            return state.ivf
+
+    def _to_results(
+            self,
+            collection: str,
+            state: _CollectionState,
+            rows: np.ndarray,
+            scores: np.ndarray,
+            output_fields: List[str]
+    ) -> List[RetrievalResult]:
+        results = []
+        for row, score in zip(rows, scores):
+            record = state.records[row]
+            results.append(
+                RetrievalResult(
+                    embedding=np.array(state.embeddings[row]) if "embedding" in output_fields else None,
+                    text=record["text"] if "text" in output_fields else "",
+                    reference=record["reference"] if "reference" in output_fields else "",
+                    metadata=record["metadata"] if "metadata" in output_fields else {},
+                    score=float(score),
+                    collection=collection,
+                )
+            )
+        return results
+
+    def search_data(
+            self,
+            collection: Optional[str],
+            vector: Union[np.array, List[float]],
+            top_k: int = 5,
+            output_fields: Optional[List[str]] = None,
+            *args,
+            **kwargs
+    ) -> List[RetrievalResult]:
+        """
+        Search for similar vectors in a collection
+        :param collection:
+        :param vector:
+        :param top_k:
+        :param output_fields: see `BaseVectorDB.search_data`
+        :param kwargs: `search_params`, `search_preset` or `filters`, see `search_batch`
+        :return:
+        """
+        return self.search_batch(collection, [vector], top_k=top_k, output_fields=output_fields, **kwargs)[0]
+
+    def search_batch(
+            self,
+            collection: Optional[str],
+            vectors: List[Union[np.array, List[float]]],
+            top_k: int = 5,
+            output_fields: Optional[List[str]] = None,
+            *args,
+            **kwargs
+    ) -> List[List[RetrievalResult]]:
+        """
+        Search for similar vectors of several queries in a collection with one matrix product
+        :param collection:
+        :param vectors:
+        :param top_k:
+        :param output_fields: see `BaseVectorDB.search_data`
+        :param kwargs: `search_params` or `search_preset`, see `BaseVectorDB.resolve_search_params`,
+                       and dict `filters`, applied before scoring, see `matches_filters`
+        :return: one list of results per query vector, in input order
+        """
+        if not collection:
+            collection = self.default_collection
+        if output_fields is None:
+            output_fields = DEFAULT_OUTPUT_FIELDS
+        # a snapshot, concurrent inserts and deletes publish a new state instead of changing it
+        state = self._state(collection)
+        if state is None or state.count == 0 or len(vectors) == 0:
+            return [[] for _ in vectors]
+        filters = kwargs.get("filters")
+        if isinstance(filters, str):
+            raise ValueError("NumpyVectorDB only supports dict filters")
+        mask = None
+        if filters:
+            mask = self._filter_mask(state, filters)
+            if not mask.any():
+                return [[] for _ in vectors]
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, state.dim)
+        ivf = self._get_ivf(state)
+        all_results = []
+        if ivf is None:
+            rows = None if mask is None else np.nonzero(mask)[0]
+            scores = self._scores(state, queries, rows)
+            for query_scores in scores:
+                positions = self._top_k(state, query_scores, top_k)
+                result_rows = positions if rows is None else rows[positions]
+                all_results.append(
+                    self._to_results(collection, state, result_rows, query_scores[positions], output_fields)
+                )
+            return all_results
+        params = self.resolve_search_params(kwargs.get("search_params"), kwargs.get("search_preset"))
+        nprobe = params.get("nprobe", self.nprobe)
+        for query in queries:
+            rows = ivf.candidates(query, nprobe)
+            if mask is not None:
+                rows = rows[mask[rows]]
+            query_scores = self._scores(state, query[None, :], rows)[0]
+            positions = self._top_k(state, query_scores, top_k)
+            all_results.append(
+                self._to_results(collection, state, rows[positions], query_scores[positions], output_fields)
+            )
+        return all_results
+
+    def _load_catalog(self) -> List[Tuple[CollectionInfo, int]]:
+        """
+        Read the info file of every collection, see `BaseVectorDB.list_collections`
+        :return:
+        """
+        catalog = []
+        for collection in sorted(os.listdir(self.path)):
+            info_path = os.path.join(self._collection_path(collection), _INFO_FILE)
+            if not os.path.exists(info_path):
+                continue
+            with open(info_path, "r") as file:
+                info = json.load(file)
+            catalog.append(
+                (CollectionInfo(collection_name=collection, description=info.get("description", "")), info["dim"])
+            )
+        return catalog
+
+    def clear_db(self, collection: str = "deepsearcher", *args, **kwargs):
+        """
+        Drop a collection from the db
+        :param collection:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        if not collection:
+            collection = self.default_collection
+        with self._lock:
+            self._collections.pop(collection, None)
+            if self.lexical_index is not None:
+                self.lexical_index.drop_collection(collection)
+            try:
+                shutil.rmtree(self._collection_path(collection))
+                self.invalidate_catalog()
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                log.warning(f"fail to clear db, error info: {e}")
@@ -14,16 +14,18 @@ from deepsearcher.configuration import Configuration, init_config
 from deepsearcher.online_query import query
 
 
-config = Configuration()
-openai_api_key = "Add the LLM API Key"
-config.set_provider_config("llm", "OpenAI", {"model": "o1-mini", "api_key": openai_api_key})
-config.set_provider_config("embedding", "OpenAIEmbedding", {"model": "text-embedding-ada-002", "api_key": openai_api_key})
+# PDF workers are spawned and re-import this module, so only run when executed as a script
+if __name__ == "__main__":
+    config = Configuration()
+    openai_api_key = "Add the LLM API Key"
+    config.set_provider_config("llm", "OpenAI", {"model": "o1-mini", "api_key": openai_api_key})
+    config.set_provider_config("embedding", "OpenAIEmbedding", {"model": "text-embedding-ada-002", "api_key": openai_api_key})
 
-print(config.provide_settings)
+    print(config.provide_settings)
 
-init_config(config=config)
+    init_config(config=config)
 
-from deepsearcher.offline_loader import load_from_local_files
+    from deepsearcher.offline_loader import load_from_local_files
 
-local_path = "/Users/petros-pavlosypsilantis/Documents/Projects/LLM_Agents/DeepResearch/deep-searcher/data"
-load_from_local_files(paths_or_directory=local_path)
\ No newline at end of file
+    local_path = "/Users/petros-pavlosypsilantis/Documents/Projects/LLM_Agents/DeepResearch/deep-searcher/data"
+    load_from_local_files(paths_or_directory=local_path)
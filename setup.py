@@ -13,6 +13,7 @@ setup(
         "pdfplumber",
         "pymilvus[model]",
         "openai",
+        "tiktoken",
         "numpy",
         "tqdm",
         "termcolor",